@@ -148,6 +148,115 @@ REST_FRAMEWORK = {
 
 # OpenAI настройки
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+# Дополнительные глобальные ключи через запятую: запросы ботов без своих
+# ключей распределяются между всеми глобальными ключами
+OPENAI_API_KEYS = [
+    key.strip() for key in os.getenv("OPENAI_API_KEYS", "").split(",") if key.strip()
+]
+# Ключ, отклоненный OpenAI (401), отключается, если у бота есть другие.
+# Единственный ключ пропускается столько секунд и пробуется снова
+OPENAI_KEY_REJECT_COOLDOWN = float(os.getenv("OPENAI_KEY_REJECT_COOLDOWN", "300"))
+# Сколько результатов подсчета токенов хранить в памяти процесса
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "10000"))
+# Адрес API, например локального тестового сервера (пусто - api.openai.com)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
+# Таймаут попытки и повторы запросов по умолчанию (у ботов - свои настройки)
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# Экспоненциальная задержка между повторами: начальная и максимальная, секунды
+OPENAI_RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "20"))
+# Предохранитель на пару ключ + модель: ошибок подряд до отключения и
+# сколько секунд запросы отклоняются без обращения к API
+OPENAI_CIRCUIT_FAILURE_THRESHOLD = int(
+    os.getenv("OPENAI_CIRCUIT_FAILURE_THRESHOLD", "5")
+)
+OPENAI_CIRCUIT_RESET_TIMEOUT = float(os.getenv("OPENAI_CIRCUIT_RESET_TIMEOUT", "30"))
+# Лимиты аккаунта OpenAI на каждый API ключ: запросов и токенов в минуту
+# (0 - без ограничения). Запросы сверх лимита ждут в очереди
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+# Какую долю лимитов использовать, чтобы не упираться в них
+OPENAI_RATE_LIMIT_HEADROOM = float(os.getenv("OPENAI_RATE_LIMIT_HEADROOM", "0.9"))
+# Максимум одновременных запросов к GPT на процесс. Остальные ждут в
+# очереди по приоритету (ответы пользователям, сценарии, фоновые задачи)
+# и по очереди между ботами с учетом их весов (Bot.gpt_weight)
+OPENAI_MAX_CONCURRENT_REQUESTS = int(
+    os.getenv("OPENAI_MAX_CONCURRENT_REQUESTS", "32")
+)
+# Выбор модели (у ботов с быстрой моделью): сообщения длиннее стольких
+# токенов или при истории длиннее стольких сообщений идут основной модели
+OPENAI_ROUTING_MAX_TOKENS = int(os.getenv("OPENAI_ROUTING_MAX_TOKENS", "40"))
+OPENAI_ROUTING_MAX_HISTORY = int(os.getenv("OPENAI_ROUTING_MAX_HISTORY", "6"))
+# Одинаковые одновременные запросы к GPT (модель, сообщения, температура,
+# максимум токенов) выполняются одним запросом к API, токены делятся поровну
+OPENAI_SINGLE_FLIGHT = os.getenv("OPENAI_SINGLE_FLIGHT", "true").lower() == "true"
+# Кеш ответов GPT для шагов сценариев с cache_ttl: memory (память процесса),
+# file (каталог GPT_RESPONSE_CACHE_DIR) или redis (GPT_RESPONSE_CACHE_REDIS_URL;
+# без адреса или пакета redis - замена в памяти процесса)
+GPT_RESPONSE_CACHE_BACKEND = os.getenv("GPT_RESPONSE_CACHE_BACKEND", "memory")
+GPT_RESPONSE_CACHE_SIZE = int(os.getenv("GPT_RESPONSE_CACHE_SIZE", "1000"))
+GPT_RESPONSE_CACHE_DIR = os.getenv("GPT_RESPONSE_CACHE_DIR", "")
+GPT_RESPONSE_CACHE_REDIS_URL = os.getenv("GPT_RESPONSE_CACHE_REDIS_URL", "")
+# Пул HTTP соединений клиента OpenAI (один клиент на API ключ)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+# Сколько держать простаивающее соединение открытым, секунды
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+
+# Настройки раннера Telegram ботов
+# Размер пула потоков (и соединений с БД) для запросов ORM из обработчиков
+TELEGRAM_DB_POOL_SIZE = int(os.getenv("TELEGRAM_DB_POOL_SIZE", "8"))
+# Максимум одновременно обрабатываемых обновлений на процесс (все боты).
+# Обновления одного чата всегда обрабатываются по очереди
+TELEGRAM_MAX_CONCURRENT_UPDATES = int(
+    os.getenv("TELEGRAM_MAX_CONCURRENT_UPDATES", "256")
+)
+# Минимальный интервал между правками сообщения при потоковом ответе, секунды
+TELEGRAM_STREAM_EDIT_INTERVAL = float(
+    os.getenv("TELEGRAM_STREAM_EDIT_INTERVAL", "1.0")
+)
+# Интервал записи метрик раннера в лог, секунды (0 - отключено)
+TELEGRAM_METRICS_INTERVAL = int(os.getenv("TELEGRAM_METRICS_INTERVAL", "60"))
+# Интервал полной сверки запущенных ботов с БД, секунды. Изменения
+# через канал настроек применяются сразу, сверка лишь подстраховывает
+TELEGRAM_RECONCILE_INTERVAL = int(os.getenv("TELEGRAM_RECONCILE_INTERVAL", "30"))
+# Интервал проверки версии настроек ботов, секунды
+TELEGRAM_CONFIG_POLL_INTERVAL = float(
+    os.getenv("TELEGRAM_CONFIG_POLL_INTERVAL", "0.5")
+)
+# Режим webhook (run_telegram_bots --webhook)
+TELEGRAM_WEBHOOK_HOST = os.getenv("TELEGRAM_WEBHOOK_HOST", "0.0.0.0")
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8080"))
+# Публичный адрес для setWebhook, например https://bots.example.com
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+# Токен доступа к GET /metrics сервера webhook (заголовок
+# Authorization: Bearer <token>). Пусто - метрики доступны только с localhost
+TELEGRAM_METRICS_TOKEN = os.getenv("TELEGRAM_METRICS_TOKEN", "")
+# Интервал проверки дочерних процессов супервизора (--workers), секунды
+TELEGRAM_SUPERVISOR_INTERVAL = float(os.getenv("TELEGRAM_SUPERVISOR_INTERVAL", "1"))
+# Сколько при остановке раннера (SIGTERM) ждать обработки уже принятых
+# обновлений, секунды. Не успевшие будут обработаны после перезапуска
+TELEGRAM_SHUTDOWN_TIMEOUT = float(os.getenv("TELEGRAM_SHUTDOWN_TIMEOUT", "25"))
+# Интервал записи позиций обработанных обновлений ботов в БД, секунды
+TELEGRAM_OFFSET_FLUSH_INTERVAL = float(
+    os.getenv("TELEGRAM_OFFSET_FLUSH_INTERVAL", "1.0")
+)
+# Интервал записи счетчиков баз знаний (обращения и ответы) в БД, секунды
+FAQ_STATS_FLUSH_INTERVAL = float(os.getenv("FAQ_STATS_FLUSH_INTERVAL", "10"))
+# Как часто раннер сверяет индекс базы знаний с БД, чтобы подхватить
+# изменения из админки и API других процессов, секунды
+FAQ_INDEX_REFRESH_INTERVAL = float(os.getenv("FAQ_INDEX_REFRESH_INTERVAL", "10"))
+# Сколько полученных обновлений бот может обрабатывать одновременно,
+# прежде чем перестанет запрашивать новые (режим polling)
+TELEGRAM_MAX_PENDING_UPDATES = int(os.getenv("TELEGRAM_MAX_PENDING_UPDATES", "1000"))
+# Лимиты исходящих сообщений, сообщений в секунду: на бота,
+# на личный чат и на группу (по рекомендациям Telegram)
+TELEGRAM_BOT_SEND_RATE = float(os.getenv("TELEGRAM_BOT_SEND_RATE", "30"))
+TELEGRAM_CHAT_SEND_RATE = float(os.getenv("TELEGRAM_CHAT_SEND_RATE", "1"))
+TELEGRAM_GROUP_SEND_RATE = float(os.getenv("TELEGRAM_GROUP_SEND_RATE", "0.33"))
 
 # Логирование
 LOGGING = {
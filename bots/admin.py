@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Bot, TelegramUser, Conversation, UserScenarioSession
+from .models import Bot, FaqEntry, TelegramUser, Conversation, UserScenarioSession
 
 
 @admin.register(TelegramUser)
@@ -52,10 +52,22 @@ class BotAdmin(admin.ModelAdmin):
             {
                 "fields": (
                     "gpt_api_key",
+                    "gpt_api_keys",
                     "gpt_model",
+                    "gpt_light_model",
+                    "gpt_routing_rules",
+                    "gpt_fallback_models",
+                    "gpt_hedge_after",
                     "max_tokens",
                     "temperature",
+                    "gpt_timeout",
+                    "gpt_max_retries",
+                    "gpt_weight",
                     "system_prompt",
+                    "stream_responses",
+                    "debounce_seconds",
+                    "summary_threshold_tokens",
+                    "faq_min_score",
                 )
             },
         ),
@@ -66,6 +78,14 @@ class BotAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(FaqEntry)
+class FaqEntryAdmin(admin.ModelAdmin):
+    list_display = ["question", "bot", "hits", "is_active", "updated_at"]
+    list_filter = ["is_active", "bot"]
+    search_fields = ["question", "answer"]
+    readonly_fields = ["hits", "created_at", "updated_at"]
+
+
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
     list_display = [
@@ -81,7 +101,14 @@ class ConversationAdmin(admin.ModelAdmin):
         "telegram_user__username",
         "telegram_user__first_name",
     ]
-    readonly_fields = ["created_at", "last_activity", "total_tokens"]
+    readonly_fields = [
+        "created_at",
+        "last_activity",
+        "total_tokens",
+        "summary",
+        "summary_tokens",
+        "summarized_count",
+    ]
 
     def get_queryset(self, request):
         return super().get_queryset(request).select_related("bot", "telegram_user")
@@ -0,0 +1,82 @@
+import time
+import tiktoken
+from django.core.management.base import BaseCommand, CommandError
+
+from bots.services.gpt_service import GPTService
+from bots.services.tokenizer import get_encoding, get_token_counter
+
+SYSTEM_PROMPT = (
+    "Ты полезный AI-ассистент. Отвечай дружелюбно и помогай пользователям. "
+    "Если вопрос неясен, уточни его. Не придумывай факты. " * 5
+)
+
+
+class Command(BaseCommand):
+    help = "Сравнение стоимости подсчета токенов за ход диалога до и после кеширования"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--messages", type=int, default=20, help="Сообщений в истории диалога"
+        )
+        parser.add_argument("--turns", type=int, default=50, help="Количество ходов")
+        parser.add_argument("--model", default="gpt-3.5-turbo", help="Модель GPT")
+
+    def handle(self, *args, **options):
+        history_size = options["messages"]
+        turns = options["turns"]
+        model = self.model = options["model"]
+
+        if get_encoding(model) is None:
+            raise CommandError(f"Кодировка tiktoken для модели {model} недоступна")
+
+        before = self.run_turns(self.legacy_turn, history_size, turns, model)
+
+        # Ключ не используется: запросов к API нет
+        self.gpt_service = GPTService(api_key="benchmark")
+        get_token_counter().clear()
+        after = self.run_turns(self.cached_turn, history_size, turns, model)
+
+        self.stdout.write(f"История: {history_size} сообщений, ходов: {turns}")
+        self.stdout.write(f"До:    {before:.3f} мс на ход")
+        self.stdout.write(f"После: {after:.3f} мс на ход ({before / after:.1f}x)")
+        self.stdout.write(f"Кеш токенов: {get_token_counter().get_stats()}")
+
+    def run_turns(self, turn, history_size: int, turns: int, model: str) -> float:
+        """Среднее время обработки хода в миллисекундах"""
+        history = [
+            {
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": f"Сообщение номер {i}: расскажи подробнее про пункт {i}.",
+            }
+            for i in range(history_size)
+        ]
+
+        started_at = time.perf_counter()
+        for i in range(turns):
+            # Каждый ход добавляет новое сообщение, старые повторяются
+            history = history[1:] + [
+                {"role": "user", "content": f"Новый вопрос {i}: что дальше?"}
+            ]
+            turn([{"role": "system", "content": SYSTEM_PROMPT}] + history)
+        return (time.perf_counter() - started_at) * 1000 / turns
+
+    def cached_turn(self, messages):
+        """Подсчет токенов за ход через GPTService (с кешами)"""
+        self.gpt_service.trim_messages(messages, 3000, self.model)
+        return self.gpt_service.count_messages_tokens(messages, self.model)
+
+    def legacy_turn(self, messages):
+        """Подсчет токенов за ход в исходной реализации (без кешей)"""
+
+        def count(text):
+            return len(tiktoken.encoding_for_model(self.model).encode(text))
+
+        # trim_messages: системное сообщение и каждое сообщение истории
+        total = sum(count(m["role"]) + count(m["content"]) + 4 for m in messages[:1])
+        for message in messages[1:]:
+            total += count(message["content"]) + 4
+        # count_messages_tokens: роль и содержимое каждого сообщения
+        for message in messages:
+            count(message["role"])
+            count(message["content"])
+        return total
@@ -2,10 +2,12 @@ import asyncio
 import signal
 import sys
 import logging
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 
-# from django.conf import settings
+from bots.services.bot_supervisor import BotSupervisor, parse_shard
 from bots.services.telegram_service import TelegramBotManager
+from bots.services.webhook_server import WebhookServer
 
 # Настройка логирования
 logging.basicConfig(
@@ -27,6 +29,7 @@ class Command(BaseCommand):
         super().__init__(*args, **kwargs)
         self.bot_manager = TelegramBotManager()
         self.shutdown_requested = False
+        self._loop = None
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -34,58 +37,156 @@ class Command(BaseCommand):
             type=int,
             help="ID конкретного бота для запуска (по умолчанию запускаются все активные)",
         )
+        parser.add_argument(
+            "--webhook",
+            action="store_true",
+            help="Принимать обновления всех ботов через один HTTP сервер вместо polling",
+        )
+        parser.add_argument(
+            "--webhook-host",
+            default=getattr(settings, "TELEGRAM_WEBHOOK_HOST", "0.0.0.0"),
+            help="Адрес HTTP сервера webhook",
+        )
+        parser.add_argument(
+            "--webhook-port",
+            type=int,
+            default=getattr(settings, "TELEGRAM_WEBHOOK_PORT", 8080),
+            help="Порт HTTP сервера webhook",
+        )
+        parser.add_argument(
+            "--webhook-url",
+            default=getattr(settings, "TELEGRAM_WEBHOOK_URL", ""),
+            help=(
+                "Публичный адрес сервера для setWebhook. Если не указан, webhook "
+                "в Telegram не регистрируется (локальная отладка)"
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help="Распределить ботов по N дочерним процессам (polling режим)",
+        )
+        parser.add_argument(
+            "--shard",
+            help="Обслуживать только шард index/count (используется супервизором)",
+        )
 
     def handle_shutdown(self, signum, frame):
-        """Обработчик сигналов"""
+        """
+        Обработчик сигналов: раннер перестает принимать обновления и
+        дообрабатывает принятые в пределах TELEGRAM_SHUTDOWN_TIMEOUT
+        """
         logger.info(f"Received signal {signum}, shutting down...")
         self.shutdown_requested = True
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.bot_manager.request_shutdown)
 
     def handle(self, *args, **options):
         """Основной метод"""
         bot_id = options.get("bot_id")
+        workers = options.get("workers") or 0
+        shard = None
+        if options.get("shard"):
+            try:
+                shard = parse_shard(options["shard"])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        if workers > 1 and (options.get("webhook") or bot_id or shard):
+            raise CommandError(
+                "--workers нельзя сочетать с --webhook, --bot-id и --shard"
+            )
+
+        webhook_options = None
+        if options.get("webhook"):
+            webhook_options = {
+                "host": options["webhook_host"],
+                "port": options["webhook_port"],
+                "url": options["webhook_url"],
+            }
 
         # Настраиваем обработчики сигналов
         signal.signal(signal.SIGINT, self.handle_shutdown)
         signal.signal(signal.SIGTERM, self.handle_shutdown)
 
+        if workers > 1:
+            self.stdout.write(f"Запуск ботов в {workers} процессах...")
+            try:
+                BotSupervisor(workers, lambda: self.shutdown_requested).run()
+            finally:
+                self.stdout.write("Все боты остановлены")
+            return
+
         if bot_id:
             self.stdout.write(f"Запуск бота с ID: {bot_id}")
+        elif shard:
+            self.stdout.write(f"Запуск ботов шарда {shard[0]}/{shard[1]}...")
         else:
             self.stdout.write("Запуск всех активных ботов...")
 
         try:
             # Запускаем event loop
-            asyncio.run(self.run_bots(bot_id))
+            asyncio.run(self.run_bots(bot_id, webhook_options, shard))
         except KeyboardInterrupt:
             logger.info("Received KeyboardInterrupt, shutting down...")
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
             self.stderr.write(f"Ошибка: {e}")
         finally:
-            self.stdout.write("Все боты остановлены")
-
-    async def run_bots(self, bot_id=None):
+            # Дожидаемся запросов к БД, поставленных перед остановкой
+            self.bot_manager.db.shutdown(wait=True)
+            self.stdout.write(
+                "Все боты остановлены. Обработано при остановке: "
+                f"{self.bot_manager.drained_updates}, "
+                f"прервано: {self.bot_manager.abandoned_updates}"
+            )
+
+    async def run_bots(self, bot_id=None, webhook_options=None, shard=None):
         """Запуск ботов в асинхронном режиме"""
+        self._loop = asyncio.get_running_loop()
+        webhook_server = None
+        webhook_url = None
         try:
+            if webhook_options:
+                webhook_server = WebhookServer(
+                    host=webhook_options["host"],
+                    port=webhook_options["port"],
+                    metrics_provider=self.bot_manager.get_metrics,
+                    metrics_token=getattr(settings, "TELEGRAM_METRICS_TOKEN", ""),
+                )
+                webhook_url = webhook_options["url"]
+                await webhook_server.start()
+
+            if self.shutdown_requested:
+                return
+
             if bot_id:
                 # Запуск конкретного бота
                 from bots.models import Bot
 
-                try:
-                    bot = Bot.objects.get(id=bot_id, is_active=True)
-                    from bots.services.telegram_service import TelegramBotService
-
-                    service = TelegramBotService(bot)
-                    await service.start_polling()
-                except Bot.DoesNotExist:
+                exists = await self.bot_manager.db.run(
+                    Bot.objects.filter(id=bot_id, is_active=True).exists
+                )
+                if not exists:
                     self.stderr.write(f"Активный бот с ID {bot_id} не найден")
                     return
+
+                await self.bot_manager.start_all_bots(
+                    bot_ids=[bot_id],
+                    webhook_server=webhook_server,
+                    webhook_url=webhook_url,
+                )
             else:
                 # Запуск всех активных ботов
-                await self.bot_manager.start_all_bots()
+                await self.bot_manager.start_all_bots(
+                    webhook_server=webhook_server, webhook_url=webhook_url, shard=shard
+                )
 
         except Exception as e:
             logger.error(f"Error running bots: {e}")
         finally:
             # Останавливаем все боты при завершении
             await self.bot_manager.stop_all_bots()
+            if webhook_server:
+                await webhook_server.stop()
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bots', '0005_alter_userscenariosession_scenario_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotConfigVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0, verbose_name='Версия')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Версия настроек ботов',
+                'verbose_name_plural': 'Версии настроек ботов',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bots', '0006_botconfigversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bot',
+            name='stream_responses',
+            field=models.BooleanField(default=False, help_text='Показывать ответ по мере генерации, редактируя сообщение', verbose_name='Потоковые ответы'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0007_bot_stream_responses"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bot",
+            name="debounce_seconds",
+            field=models.FloatField(
+                default=0,
+                help_text="Сообщения, присланные подряд в течение этого времени (секунды), объединяются в один запрос к GPT. 0 - отключено",
+                verbose_name="Окно объединения сообщений",
+            ),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0008_bot_debounce_seconds"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BotUpdateState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "last_update_id",
+                    models.BigIntegerField(
+                        default=0,
+                        help_text="Все обновления с ID не больше этого обработаны",
+                        verbose_name="Последнее обработанное обновление",
+                    ),
+                ),
+                (
+                    "completed_ids",
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text="ID обработанных обновлений после last_update_id",
+                        verbose_name="Обработанные обновления",
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Дата обновления"),
+                ),
+                (
+                    "bot",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="update_state",
+                        to="bots.bot",
+                        verbose_name="Бот",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Позиция обновлений бота",
+                "verbose_name_plural": "Позиции обновлений ботов",
+            },
+        ),
+    ]
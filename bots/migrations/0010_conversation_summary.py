@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0009_botupdatestate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bot",
+            name="summary_threshold_tokens",
+            field=models.IntegerField(
+                default=0,
+                help_text="Когда несжатая история диалога превышает это количество токенов, старые сообщения заменяются кратким пересказом. 0 - отключено",
+                verbose_name="Порог сжатия истории",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="summarized_count",
+            field=models.IntegerField(
+                default=0,
+                help_text="Количество первых сообщений истории, вошедших в пересказ",
+                verbose_name="Сжато сообщений",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="summary",
+            field=models.TextField(
+                blank=True,
+                default="",
+                help_text="Пересказ сообщений, вытесненных из контекста",
+                verbose_name="Краткое содержание",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="summary_tokens",
+            field=models.IntegerField(
+                default=0, verbose_name="Токенов в кратком содержании"
+            ),
+        ),
+    ]
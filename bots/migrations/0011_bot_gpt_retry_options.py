@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0010_conversation_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bot",
+            name="gpt_max_retries",
+            field=models.IntegerField(
+                default=2,
+                help_text="Сколько раз повторять запрос при перегрузке или сбое GPT API",
+                verbose_name="Повторы запросов к GPT",
+            ),
+        ),
+        migrations.AddField(
+            model_name="bot",
+            name="gpt_timeout",
+            field=models.FloatField(
+                default=30,
+                help_text="Сколько ждать ответа GPT на одну попытку, секунды",
+                verbose_name="Таймаут GPT",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0011_bot_gpt_retry_options"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bot",
+            name="gpt_weight",
+            field=models.FloatField(
+                default=1,
+                help_text="Вес бота в общей очереди запросов к GPT: при нагрузке бот с весом 2 получает вдвое больше запросов, чем бот с весом 1",
+                verbose_name="Доля запросов к GPT",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0012_bot_gpt_weight"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bot",
+            name="gpt_api_keys",
+            field=models.TextField(
+                blank=True,
+                default="",
+                help_text="По одному на строку. Запросы распределяются между всеми ключами бота по остатку их лимитов",
+                verbose_name="Дополнительные OpenAI API ключи",
+            ),
+        ),
+    ]
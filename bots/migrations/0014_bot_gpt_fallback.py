@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0013_bot_gpt_api_keys"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bot",
+            name="gpt_fallback_models",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Через запятую, по порядку. Используются, если основная модель вернула ошибку или не ответила вовремя",
+                max_length=255,
+                verbose_name="Резервные модели GPT",
+            ),
+        ),
+        migrations.AddField(
+            model_name="bot",
+            name="gpt_hedge_after",
+            field=models.FloatField(
+                default=0,
+                help_text="Если основная модель не ответила за это время (секунды), запрос параллельно отправляется резервной, и используется первый ответ. 0 - резервная модель только при ошибке",
+                verbose_name="Ожидание перед резервной моделью",
+            ),
+        ),
+    ]
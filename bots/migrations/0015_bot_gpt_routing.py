@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0014_bot_gpt_fallback"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bot",
+            name="gpt_light_model",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Модель для простых коротких сообщений (приветствия, благодарности). Пусто - все сообщения обрабатывает основная модель",
+                max_length=50,
+                verbose_name="Быстрая модель GPT",
+            ),
+        ),
+        migrations.AddField(
+            model_name="bot",
+            name="gpt_routing_rules",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text='Например: {"light_max_tokens": 40, "light_max_history": 6, "heavy_keywords": ["договор"], "light_phrases": ["ага"]}',
+                verbose_name="Правила выбора модели",
+            ),
+        ),
+    ]
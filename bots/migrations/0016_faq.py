@@ -0,0 +1,120 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0015_bot_gpt_routing"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bot",
+            name="faq_min_score",
+            field=models.FloatField(
+                default=0.6,
+                help_text="Сообщение, похожее на вопрос из базы знаний бота не меньше чем на эту долю (0-1), получает готовый ответ без запроса к GPT. 0 - отключено",
+                verbose_name="Порог ответа из базы знаний",
+            ),
+        ),
+        migrations.CreateModel(
+            name="BotFaqStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "lookups",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Проверено сообщений"
+                    ),
+                ),
+                (
+                    "hits",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Ответов из базы"
+                    ),
+                ),
+                (
+                    "bot",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="faq_stats",
+                        to="bots.bot",
+                        verbose_name="Бот",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Статистика базы знаний",
+                "verbose_name_plural": "Статистика баз знаний",
+            },
+        ),
+        migrations.CreateModel(
+            name="FaqEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "question",
+                    models.TextField(
+                        help_text="Типичная формулировка вопроса пользователя",
+                        verbose_name="Вопрос",
+                    ),
+                ),
+                ("answer", models.TextField(verbose_name="Ответ")),
+                (
+                    "is_active",
+                    models.BooleanField(default=True, verbose_name="Активен"),
+                ),
+                (
+                    "hits",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Сколько раз ответ отправлен вместо запроса к GPT",
+                        verbose_name="Ответов",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата создания"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Дата обновления"),
+                ),
+                (
+                    "bot",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="faq_entries",
+                        to="bots.bot",
+                        verbose_name="Бот",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Вопрос базы знаний",
+                "verbose_name_plural": "База знаний",
+                "ordering": ["bot", "-hits"],
+            },
+        ),
+    ]
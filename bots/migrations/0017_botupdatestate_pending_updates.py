@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0016_faq"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="botupdatestate",
+            name="pending_updates",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                help_text="Принятые, но не обработанные обновления: повторяются после перезапуска",
+                verbose_name="Необработанные обновления",
+            ),
+        ),
+    ]
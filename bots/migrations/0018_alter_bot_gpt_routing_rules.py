@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:31
+
+import bots.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0017_botupdatestate_pending_updates"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="bot",
+            name="gpt_routing_rules",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text='Например: {"light_max_tokens": 40, "light_max_history": 6, "heavy_keywords": ["договор"], "light_phrases": ["ага"]}',
+                validators=[bots.models.validate_routing_rules],
+                verbose_name="Правила выбора модели",
+            ),
+        ),
+    ]
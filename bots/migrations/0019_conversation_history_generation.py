@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bots", "0018_alter_bot_gpt_routing_rules"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="history_generation",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Увеличивается при каждой очистке истории",
+                verbose_name="Поколение истории",
+            ),
+        ),
+    ]
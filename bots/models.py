@@ -1,5 +1,40 @@
+import re
+from django.core.exceptions import ValidationError
 from django.db import models
 
+# Контекст запроса к GPT без сжатия истории, токенов
+DEFAULT_MAX_CONTEXT_TOKENS = 3000
+
+# Правила выбора модели (Bot.gpt_routing_rules) и их типы
+ROUTING_RULE_TYPES = {
+    "light_max_tokens": int,
+    "light_max_history": int,
+    "heavy_keywords": list,
+    "light_phrases": list,
+}
+
+
+def validate_routing_rules(value):
+    """Валидатор правил выбора модели"""
+    if not value:
+        return  # Пустое значение допустимо
+
+    if not isinstance(value, dict):
+        raise ValidationError("Правила выбора модели должны быть JSON объектом")
+
+    unknown = sorted(set(value) - set(ROUTING_RULE_TYPES))
+    if unknown:
+        raise ValidationError(f"Неизвестные правила: {', '.join(unknown)}")
+
+    for name, rule in value.items():
+        if ROUTING_RULE_TYPES[name] is int:
+            if not isinstance(rule, int) or isinstance(rule, bool) or rule < 0:
+                raise ValidationError(f"{name} должно быть неотрицательным целым")
+        elif not isinstance(rule, list) or not all(
+            isinstance(item, str) and item.strip() for item in rule
+        ):
+            raise ValidationError(f"{name} должно быть списком непустых строк")
+
 
 class Bot(models.Model):
     name = models.CharField(max_length=100, verbose_name="Название бота")
@@ -18,12 +53,60 @@ class Bot(models.Model):
         verbose_name="OpenAI API ключ",
         help_text=("API ключ для OpenAI " "(если пустой, используется глобальный)"),
     )
+    gpt_api_keys = models.TextField(
+        blank=True,
+        default="",
+        verbose_name="Дополнительные OpenAI API ключи",
+        help_text=(
+            "По одному на строку. Запросы распределяются между всеми ключами "
+            "бота по остатку их лимитов"
+        ),
+    )
     gpt_model = models.CharField(
         max_length=50,
         default="gpt-3.5-turbo",
         verbose_name="GPT модель",
         help_text="Модель GPT для использования",
     )
+    gpt_light_model = models.CharField(
+        max_length=50,
+        blank=True,
+        default="",
+        verbose_name="Быстрая модель GPT",
+        help_text=(
+            "Модель для простых коротких сообщений (приветствия, благодарности). "
+            "Пусто - все сообщения обрабатывает основная модель"
+        ),
+    )
+    gpt_routing_rules = models.JSONField(
+        default=dict,
+        blank=True,
+        validators=[validate_routing_rules],
+        verbose_name="Правила выбора модели",
+        help_text=(
+            'Например: {"light_max_tokens": 40, "light_max_history": 6, '
+            '"heavy_keywords": ["договор"], "light_phrases": ["ага"]}'
+        ),
+    )
+    gpt_fallback_models = models.CharField(
+        max_length=255,
+        blank=True,
+        default="",
+        verbose_name="Резервные модели GPT",
+        help_text=(
+            "Через запятую, по порядку. Используются, если основная модель "
+            "вернула ошибку или не ответила вовремя"
+        ),
+    )
+    gpt_hedge_after = models.FloatField(
+        default=0,
+        verbose_name="Ожидание перед резервной моделью",
+        help_text=(
+            "Если основная модель не ответила за это время (секунды), запрос "
+            "параллельно отправляется резервной, и используется первый ответ. "
+            "0 - резервная модель только при ошибке"
+        ),
+    )
     max_tokens = models.IntegerField(
         default=1000,
         verbose_name="Максимум токенов",
@@ -34,6 +117,24 @@ class Bot(models.Model):
         verbose_name="Температура",
         help_text="Креативность ответов (0.0-1.0)",
     )
+    gpt_timeout = models.FloatField(
+        default=30,
+        verbose_name="Таймаут GPT",
+        help_text="Сколько ждать ответа GPT на одну попытку, секунды",
+    )
+    gpt_max_retries = models.IntegerField(
+        default=2,
+        verbose_name="Повторы запросов к GPT",
+        help_text="Сколько раз повторять запрос при перегрузке или сбое GPT API",
+    )
+    gpt_weight = models.FloatField(
+        default=1,
+        verbose_name="Доля запросов к GPT",
+        help_text=(
+            "Вес бота в общей очереди запросов к GPT: при нагрузке бот с весом 2 "
+            "получает вдвое больше запросов, чем бот с весом 1"
+        ),
+    )
     system_prompt = models.TextField(
         default=(
             "Ты полезный AI-ассистент. " "Отвечай дружелюбно и помогай пользователям."
@@ -41,6 +142,36 @@ class Bot(models.Model):
         verbose_name="Системный промпт",
         help_text="Инструкция для GPT о том, как себя вести",
     )
+    stream_responses = models.BooleanField(
+        default=False,
+        verbose_name="Потоковые ответы",
+        help_text="Показывать ответ по мере генерации, редактируя сообщение",
+    )
+    debounce_seconds = models.FloatField(
+        default=0,
+        verbose_name="Окно объединения сообщений",
+        help_text=(
+            "Сообщения, присланные подряд в течение этого времени (секунды), "
+            "объединяются в один запрос к GPT. 0 - отключено"
+        ),
+    )
+    summary_threshold_tokens = models.IntegerField(
+        default=0,
+        verbose_name="Порог сжатия истории",
+        help_text=(
+            "Когда несжатая история диалога превышает это количество токенов, "
+            "старые сообщения заменяются кратким пересказом. 0 - отключено"
+        ),
+    )
+    faq_min_score = models.FloatField(
+        default=0.6,
+        verbose_name="Порог ответа из базы знаний",
+        help_text=(
+            "Сообщение, похожее на вопрос из базы знаний бота не меньше чем "
+            "на эту долю (0-1), получает готовый ответ без запроса к GPT. "
+            "0 - отключено"
+        ),
+    )
     is_active = models.BooleanField(default=True, verbose_name="Активен")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
@@ -53,6 +184,222 @@ class Bot(models.Model):
     def __str__(self):
         return self.name
 
+    def get_gpt_api_keys(self):
+        """API ключи бота: основной и дополнительные (пусто - глобальные)"""
+        keys = [self.gpt_api_key] if self.gpt_api_key else []
+        keys += re.split(r"[\s,]+", self.gpt_api_keys.strip())
+        return [key for key in keys if key]
+
+    def get_gpt_fallback_models(self):
+        """Резервные модели GPT по порядку"""
+        return [
+            model for model in re.split(r"[\s,]+", self.gpt_fallback_models) if model
+        ]
+
+    def get_gpt_routing(self):
+        """Параметры выбора модели для GPTService (None - без выбора)"""
+        if not self.gpt_light_model:
+            return None
+        rules = self.gpt_routing_rules
+        # Правила, сохраненные до появления валидатора, могут быть не объектом
+        if not isinstance(rules, dict):
+            rules = {}
+        return {**rules, "light_model": self.gpt_light_model}
+
+    def get_summary_max_tokens(self) -> int:
+        """Максимум токенов краткого содержания диалога"""
+        return max(100, self.summary_threshold_tokens // 4)
+
+    def get_max_context_tokens(self) -> int:
+        """
+        Максимум токенов контекста запроса к GPT
+
+        При сжатии истории в контекст должны помещаться системный промпт,
+        пересказ, несжатые сообщения (до порога) и запас на реплики,
+        пришедшие, пока готовится пересказ. Иначе старые сообщения
+        обрезались бы раньше, чем попадут в пересказ.
+        """
+        if not self.summary_threshold_tokens:
+            return DEFAULT_MAX_CONTEXT_TOKENS
+        return max(
+            DEFAULT_MAX_CONTEXT_TOKENS,
+            self.get_system_prompt_tokens()
+            + self.get_summary_max_tokens()
+            + self.summary_threshold_tokens
+            + 2 * self.max_tokens,
+        )
+
+    def get_system_prompt_tokens(self) -> int:
+        """
+        Количество токенов системного промпта.
+
+        Запоминается в экземпляре и пересчитывается только при изменении
+        промпта или модели
+        """
+        from .services.tokenizer import count_tokens
+
+        key = (self.system_prompt, self.gpt_model)
+        cached = getattr(self, "_system_prompt_tokens", None)
+        if cached is None or cached[0] != key:
+            cached = self._system_prompt_tokens = (
+                key,
+                count_tokens(self.system_prompt, self.gpt_model),
+            )
+        return cached[1]
+
+
+class BotConfigVersion(models.Model):
+    """
+    Глобальный счетчик изменений настроек ботов.
+
+    Увеличивается сигналами при сохранении или удалении Bot. Раннеры
+    опрашивают одну эту строку вместо перечитывания каждого бота.
+    """
+
+    version = models.BigIntegerField(default=0, verbose_name="Версия")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        verbose_name = "Версия настроек ботов"
+        verbose_name_plural = "Версии настроек ботов"
+
+    def __str__(self):
+        return f"v{self.version}"
+
+    @classmethod
+    def get_version(cls) -> int:
+        """Текущая версия настроек"""
+        row = cls.objects.filter(pk=1).values_list("version", flat=True).first()
+        return row or 0
+
+    @classmethod
+    def bump(cls) -> None:
+        """Увеличить версию настроек"""
+        updated = cls.objects.filter(pk=1).update(version=models.F("version") + 1)
+        if not updated:
+            obj, created = cls.objects.get_or_create(pk=1, defaults={"version": 1})
+            if not created:
+                cls.objects.filter(pk=1).update(version=models.F("version") + 1)
+
+
+class BotUpdateState(models.Model):
+    """
+    Позиция обработки обновлений Telegram для бота.
+
+    Раннер не обрабатывает повторно уже обработанные обновления после
+    перезапуска, а принятые, но не обработанные - обрабатывает.
+    """
+
+    bot = models.OneToOneField(
+        Bot,
+        on_delete=models.CASCADE,
+        related_name="update_state",
+        verbose_name="Бот",
+    )
+    last_update_id = models.BigIntegerField(
+        default=0,
+        verbose_name="Последнее обработанное обновление",
+        help_text="Все обновления с ID не больше этого обработаны",
+    )
+    completed_ids = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name="Обработанные обновления",
+        help_text="ID обработанных обновлений после last_update_id",
+    )
+    pending_updates = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name="Необработанные обновления",
+        help_text="Принятые, но не обработанные обновления: повторяются после перезапуска",
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        verbose_name = "Позиция обновлений бота"
+        verbose_name_plural = "Позиции обновлений ботов"
+
+    def __str__(self):
+        return f"{self.bot} - {self.last_update_id}"
+
+
+class FaqEntry(models.Model):
+    """Вопрос и готовый ответ из базы знаний бота"""
+
+    bot = models.ForeignKey(
+        Bot,
+        on_delete=models.CASCADE,
+        related_name="faq_entries",
+        verbose_name="Бот",
+    )
+    question = models.TextField(
+        verbose_name="Вопрос",
+        help_text="Типичная формулировка вопроса пользователя",
+    )
+    answer = models.TextField(verbose_name="Ответ")
+    is_active = models.BooleanField(default=True, verbose_name="Активен")
+    hits = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Ответов",
+        help_text="Сколько раз ответ отправлен вместо запроса к GPT",
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        verbose_name = "Вопрос базы знаний"
+        verbose_name_plural = "База знаний"
+        ordering = ["bot", "-hits"]
+
+    def __str__(self):
+        return f"{self.bot} - {self.question[:50]}"
+
+
+class BotFaqStats(models.Model):
+    """
+    Обращения к базе знаний бота.
+
+    Счетчики обновляются отдельной строкой, а не полями Bot, чтобы
+    сохранение бота в админке не затирало их.
+    """
+
+    bot = models.OneToOneField(
+        Bot,
+        on_delete=models.CASCADE,
+        related_name="faq_stats",
+        verbose_name="Бот",
+    )
+    lookups = models.PositiveIntegerField(default=0, verbose_name="Проверено сообщений")
+    hits = models.PositiveIntegerField(default=0, verbose_name="Ответов из базы")
+
+    class Meta:
+        verbose_name = "Статистика базы знаний"
+        verbose_name_plural = "Статистика баз знаний"
+
+    def __str__(self):
+        return f"{self.bot} - {self.hits}/{self.lookups}"
+
+    @classmethod
+    def record(cls, bot_id: int, lookups: int, hits: int) -> None:
+        """
+        Добавить проверки сообщений по базе знаний
+
+        Args:
+            bot_id: Бот
+            lookups: Сколько сообщений проверено
+            hits: Сколько из них получили ответ из базы
+        """
+        changes = {
+            "lookups": models.F("lookups") + lookups,
+            "hits": models.F("hits") + hits,
+        }
+        if not cls.objects.filter(bot_id=bot_id).update(**changes):
+            obj, created = cls.objects.get_or_create(
+                bot_id=bot_id, defaults={"lookups": lookups, "hits": hits}
+            )
+            if not created:
+                cls.objects.filter(bot_id=bot_id).update(**changes)
+
 
 class TelegramUser(models.Model):
     telegram_id = models.BigIntegerField(
@@ -114,6 +461,26 @@ class Conversation(models.Model):
         verbose_name="Всего токенов",
         help_text="Общее количество использованных токенов",
     )
+    summary = models.TextField(
+        blank=True,
+        default="",
+        verbose_name="Краткое содержание",
+        help_text="Пересказ сообщений, вытесненных из контекста",
+    )
+    summary_tokens = models.IntegerField(
+        default=0,
+        verbose_name="Токенов в кратком содержании",
+    )
+    summarized_count = models.IntegerField(
+        default=0,
+        verbose_name="Сжато сообщений",
+        help_text="Количество первых сообщений истории, вошедших в пересказ",
+    )
+    history_generation = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Поколение истории",
+        help_text="Увеличивается при каждой очистке истории",
+    )
     last_activity = models.DateTimeField(
         auto_now=True,
         verbose_name="Последняя активность",
@@ -133,35 +500,179 @@ class Conversation(models.Model):
     def __str__(self):
         return f"{self.bot.name} - {self.telegram_user}"
 
-    def add_message(self, role, content):
-        """Добавить сообщение в диалог"""
+    def add_message(self, role, content, tokens=None):
+        """
+        Добавить сообщение в диалог
+
+        Args:
+            role: Роль автора сообщения
+            content: Текст сообщения
+            tokens: Количество токенов в тексте, если уже известно
+                (например, completion_tokens ответа). Иначе считается здесь
+        """
         from django.utils import timezone
+        from .services.tokenizer import count_tokens
+
+        if tokens is None:
+            tokens = count_tokens(content, self.bot.gpt_model)
 
         message = {
             "role": role,
             "content": content,
+            "tokens": tokens,
             "timestamp": timezone.now().isoformat(),
         }
         self.messages.append(message)
-        self.save()
+        # Только свои поля: пересказ и счетчик токенов обновляются отдельно
+        self.save(update_fields=["messages", "last_activity"])
+
+    def add_usage(self, tokens):
+        """Атомарно увеличить счетчик использованных токенов"""
+        Conversation.objects.filter(pk=self.pk).update(
+            total_tokens=models.F("total_tokens") + tokens
+        )
+        self.total_tokens += tokens
 
     def get_openai_messages(self, max_messages=20):
-        """Получить сообщения в формате OpenAI API"""
+        """
+        Получить сообщения в формате OpenAI API
+
+        Каждое сообщение дополнительно содержит "tokens" - количество токенов
+        в тексте. GPTService.trim_messages использует его и убирает перед
+        отправкой в API
+        """
+        from .services.tokenizer import count_tokens
+
         # Системный промпт всегда первый
-        messages = [{"role": "system", "content": self.bot.system_prompt}]
+        messages = [
+            {
+                "role": "system",
+                "content": self.bot.system_prompt,
+                "tokens": self.bot.get_system_prompt_tokens(),
+            }
+        ]
 
-        # Добавляем последние сообщения пользователя
-        recent_messages = self.messages[-max_messages:] if self.messages else []
+        if self.summary:
+            messages.append(
+                {
+                    "role": "system",
+                    "content": f"Краткое содержание предыдущего диалога:\n{self.summary}",
+                    "tokens": self.summary_tokens,
+                }
+            )
+
+        # Добавляем последние сообщения пользователя. При сжатии истории
+        # берутся все не вошедшие в пересказ - их объем ограничен порогом
+        recent_messages = self.messages[self.summarized_count :]
+        if not self.bot.summary_threshold_tokens:
+            recent_messages = recent_messages[-max_messages:]
         for msg in recent_messages:
-            messages.append({"role": msg["role"], "content": msg["content"]})
+            if msg.get("tokens") is None:
+                # Сообщения, сохраненные до учета токенов: считаем один раз,
+                # результат сохранится вместе с диалогом
+                msg["tokens"] = count_tokens(msg["content"], self.bot.gpt_model)
+            messages.append(
+                {
+                    "role": msg["role"],
+                    "content": msg["content"],
+                    "tokens": msg["tokens"],
+                }
+            )
 
         return messages
 
+    def get_summary_end(self, threshold):
+        """
+        Граница сжатия истории
+
+        Если несжатые сообщения превышают threshold токенов, старые из них
+        нужно свернуть в пересказ так, чтобы осталось не больше половины
+        порога (но не меньше двух последних сообщений).
+
+        Returns:
+            Индекс, до которого сообщения войдут в пересказ, или None
+        """
+        from .services.tokenizer import count_tokens
+
+        def tokens(msg):
+            if msg.get("tokens") is None:
+                msg["tokens"] = count_tokens(msg["content"], self.bot.gpt_model)
+            return msg["tokens"]
+
+        start = self.summarized_count
+        if sum(tokens(msg) for msg in self.messages[start:]) <= threshold:
+            return None
+
+        end = len(self.messages)
+        kept_tokens = 0
+        while end > start:
+            msg_tokens = tokens(self.messages[end - 1])
+            if len(self.messages) - end >= 2 and kept_tokens + msg_tokens > (
+                threshold // 2
+            ):
+                break
+            kept_tokens += msg_tokens
+            end -= 1
+
+        return end if end > start else None
+
+    def apply_summary(self, summary, summary_tokens, start, end, generation):
+        """
+        Сохранить пересказ сообщений [start, end)
+
+        Пересказ строится в фоне, поэтому сохраняется, только если за это
+        время история не была очищена или сжата другим процессом. Очищенную
+        и заново заполненную историю отличает поколение
+
+        Args:
+            summary: Текст пересказа
+            summary_tokens: Количество токенов в пересказе
+            start: Начало пересказанных сообщений
+            end: Конец пересказанных сообщений (не включая)
+            generation: history_generation на момент чтения сообщений
+
+        Returns:
+            True, если пересказ сохранен
+        """
+        from django.db import transaction
+
+        with transaction.atomic():
+            current = (
+                Conversation.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values("summarized_count", "messages", "history_generation")
+                .first()
+            )
+            if (
+                not current
+                or current["history_generation"] != generation
+                or current["summarized_count"] != start
+                or len(current["messages"]) < end
+            ):
+                return False
+
+            Conversation.objects.filter(pk=self.pk).update(
+                summary=summary,
+                summary_tokens=summary_tokens,
+                summarized_count=end,
+            )
+
+        self.summary = summary
+        self.summary_tokens = summary_tokens
+        self.summarized_count = end
+        return True
+
     def clear_history(self):
         """Очистить историю сообщений"""
         self.messages = []
         self.total_tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summarized_count = 0
+        # Пересказ, начатый до очистки, не должен попасть в новую историю
+        self.history_generation = models.F("history_generation") + 1
         self.save()
+        self.refresh_from_db(fields=["history_generation"])
 
 
 # Модель для отслеживания сессий сценариев пользователей
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Bot, TelegramUser, Conversation, UserScenarioSession
+from .models import Bot, FaqEntry, TelegramUser, Conversation, UserScenarioSession
 
 
 class BotSerializer(serializers.ModelSerializer):
@@ -11,10 +11,22 @@ class BotSerializer(serializers.ModelSerializer):
             "description",
             "telegram_token",
             "gpt_api_key",
+            "gpt_api_keys",
             "gpt_model",
+            "gpt_light_model",
+            "gpt_routing_rules",
+            "gpt_fallback_models",
+            "gpt_hedge_after",
             "max_tokens",
             "temperature",
+            "gpt_timeout",
+            "gpt_max_retries",
+            "gpt_weight",
             "system_prompt",
+            "stream_responses",
+            "debounce_seconds",
+            "summary_threshold_tokens",
+            "faq_min_score",
             "is_active",
             "created_at",
             "updated_at",
@@ -22,9 +34,26 @@ class BotSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             "telegram_token": {"write_only": True},
             "gpt_api_key": {"write_only": True},
+            "gpt_api_keys": {"write_only": True},
         }
 
 
+class FaqEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = FaqEntry
+        fields = [
+            "id",
+            "bot",
+            "question",
+            "answer",
+            "is_active",
+            "hits",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = ["hits"]
+
+
 class TelegramUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = TelegramUser
@@ -68,7 +97,11 @@ class ConversationDetailSerializer(ConversationSerializer):
     messages = serializers.JSONField(read_only=True)
 
     class Meta(ConversationSerializer.Meta):
-        fields = ConversationSerializer.Meta.fields + ["messages"]
+        fields = ConversationSerializer.Meta.fields + [
+            "messages",
+            "summary",
+            "summarized_count",
+        ]
 
 
 class TestMessageSerializer(serializers.Serializer):
@@ -0,0 +1,132 @@
+import logging
+import threading
+import time
+from typing import Dict, List
+from django.conf import settings
+from .rate_limit import get_api_rate_limiter
+from .resilience import CircuitBreaker, get_circuit_breaker
+
+logger = logging.getLogger(__name__)
+
+
+class NoApiKeyError(Exception):
+    """Все API ключи сервиса отключены после ошибок аутентификации"""
+
+
+class ApiKeyState:
+    """Использование одного API ключа в процессе"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = 0
+        self.tokens = 0
+        self.failures = 0
+        self.retired = False
+        # Единственный ключ после 401 не отключается, а пропускается до
+        # этого момента (time.monotonic())
+        self.cooldown_until = 0.0
+
+    @property
+    def usable(self) -> bool:
+        """Ключ не отключен и не пропускается после ошибки аутентификации"""
+        return not self.retired and time.monotonic() >= self.cooldown_until
+
+
+_key_states: Dict[str, ApiKeyState] = {}
+_key_states_lock = threading.Lock()
+
+
+def get_key_state(api_key: str) -> ApiKeyState:
+    """Состояние API ключа (общее для всех сервисов процесса)"""
+    with _key_states_lock:
+        state = _key_states.get(api_key)
+        if state is None:
+            state = _key_states[api_key] = ApiKeyState()
+        return state
+
+
+def select_api_key(api_keys: List[str], model: str) -> str:
+    """
+    Выбрать ключ для запроса
+
+    Из ключей, не отключенных и не пропускаемых после ошибки
+    аутентификации (см. retire_api_key), выбирается
+    ключ с наибольшим остатком лимитов (см. ApiRateLimiter.remaining),
+    а при равенстве - с наименьшим числом выполняющихся запросов. Ключи
+    с разомкнутым предохранителем для модели используются, только если
+    других нет.
+
+    Args:
+        api_keys: Ключи сервиса
+        model: Модель GPT
+
+    Returns:
+        Выбранный ключ
+
+    Raises:
+        NoApiKeyError: Все ключи отключены или пропускаются
+    """
+    candidates = [key for key in api_keys if get_key_state(key).usable]
+    if not candidates:
+        raise NoApiKeyError("All OpenAI API keys were rejected")
+    if len(candidates) == 1:
+        return candidates[0]
+
+    def score(key):
+        available = get_circuit_breaker(key, model).state != CircuitBreaker.OPEN
+        return (
+            available,
+            get_api_rate_limiter(key).remaining(),
+            -get_key_state(key).in_flight,
+        )
+
+    return max(candidates, key=score)
+
+
+def retire_api_key(api_key: str, error: Exception, api_keys: List[str]) -> None:
+    """
+    Перестать использовать ключ, отклоненный OpenAI
+
+    Если у сервиса остаются другие ключи, отклоненный отключается до
+    перезапуска процесса. Последний ключ не отключается навсегда: одна
+    ошибка аутентификации может быть временной, поэтому он пропускается
+    OPENAI_KEY_REJECT_COOLDOWN секунд и затем пробуется снова
+
+    Args:
+        api_key: Отклоненный ключ
+        error: Ошибка аутентификации
+        api_keys: Ключи сервиса
+    """
+    state = get_key_state(api_key)
+    if state.retired:
+        return
+
+    if any(key != api_key and not get_key_state(key).retired for key in api_keys):
+        state.retired = True
+        logger.error(f"OpenAI API key ...{api_key[-4:]} retired: {error}")
+        return
+
+    cooldown = getattr(settings, "OPENAI_KEY_REJECT_COOLDOWN", 300)
+    state.cooldown_until = time.monotonic() + cooldown
+    logger.error(
+        f"OpenAI API key ...{api_key[-4:]} rejected, retrying in {cooldown:.0f}s: "
+        f"{error}"
+    )
+
+
+def get_key_stats() -> Dict:
+    """Использование ключей (ключи сокращены до последних символов)"""
+    with _key_states_lock:
+        states = list(_key_states.items())
+    return {
+        f"...{api_key[-4:]}": {
+            "in_flight": state.in_flight,
+            "requests": state.requests,
+            "tokens": state.tokens,
+            "failures": state.failures,
+            "retired": state.retired,
+            "cooldown": round(max(0.0, state.cooldown_until - time.monotonic()), 1),
+            "remaining": round(get_api_rate_limiter(api_key).remaining(), 3),
+        }
+        for api_key, state in states
+    }
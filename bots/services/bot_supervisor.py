@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import os
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for_bot(bot_id: int, shard_count: int) -> int:
+    """
+    Номер шарда для бота.
+
+    Используется blake2b, а не hash(): значение одинаково во всех
+    процессах и не зависит от PYTHONHASHSEED.
+    """
+    digest = hashlib.blake2b(str(bot_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    Разбор аргумента --shard вида "index/count"
+
+    Raises:
+        ValueError: Если значение некорректно
+    """
+    index, _, count = value.partition("/")
+    index, count = int(index), int(count)
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Некорректный шард: {value}")
+    return index, count
+
+
+class WorkerProcess:
+    """Дочерний процесс раннера, обслуживающий один шард ботов"""
+
+    def __init__(self, index: int, count: int, command: List[str]):
+        self.index = index
+        self.count = count
+        self.command = command
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.next_start_at = 0.0
+
+    def start(self) -> None:
+        """Запустить процесс"""
+        self.process = subprocess.Popen(
+            self.command + ["--shard", f"{self.index}/{self.count}"],
+            cwd=str(settings.BASE_DIR),
+        )
+        self.started_at = time.monotonic()
+        logger.info(f"Worker {self.index} started (pid {self.process.pid})")
+
+    def is_alive(self) -> bool:
+        """Работает ли процесс"""
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Остановить процесс: SIGTERM, затем SIGKILL по таймауту.
+
+        По умолчанию таймаут чуть больше TELEGRAM_SHUTDOWN_TIMEOUT, чтобы
+        процесс успел дообработать принятые обновления
+        """
+        if not self.is_alive():
+            return
+
+        if timeout is None:
+            timeout = getattr(settings, "TELEGRAM_SHUTDOWN_TIMEOUT", 25) + 5
+
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Worker {self.index} did not stop in {timeout}s, killing")
+            self.process.kill()
+            self.process.wait()
+
+
+class BotSupervisor:
+    """
+    Супервизор многопроцессного раннера.
+
+    Распределяет ботов по дочерним процессам по стабильному хешу Bot.id
+    и перезапускает упавшие процессы с экспоненциальной задержкой.
+    Включение и отключение ботов каждый процесс подхватывает сам, сверяя
+    свой шард с БД, поэтому перезапуск при перебалансировке не нужен.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        should_stop: Callable[[], bool],
+        extra_args: Optional[List[str]] = None,
+    ):
+        """
+        Инициализация супервизора
+
+        Args:
+            workers: Количество дочерних процессов
+            should_stop: Функция, сообщающая о запросе остановки
+            extra_args: Дополнительные аргументы для дочерних процессов
+        """
+        command = [sys.executable, "-m", "django", "run_telegram_bots"]
+        command += extra_args or []
+        self.workers = [WorkerProcess(i, workers, command) for i in range(workers)]
+        self.should_stop = should_stop
+        self.check_interval = getattr(settings, "TELEGRAM_SUPERVISOR_INTERVAL", 1.0)
+        self.max_backoff = 30.0
+        self.stable_after = 60.0
+
+    def get_shard_assignment(self) -> Dict[int, Set[int]]:
+        """Активные боты каждого шарда"""
+        from ..models import Bot
+
+        assignment = {worker.index: set() for worker in self.workers}
+        bot_ids = Bot.objects.filter(is_active=True).values_list("id", flat=True)
+        for bot_id in bot_ids:
+            assignment[shard_for_bot(bot_id, len(self.workers))].add(bot_id)
+        return assignment
+
+    def run(self) -> None:
+        """Основной цикл супервизора"""
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings.SETTINGS_MODULE)
+
+        assignment = self.get_shard_assignment()
+        for worker in self.workers:
+            logger.info(f"Worker {worker.index}: {len(assignment[worker.index])} bots")
+            worker.start()
+
+        try:
+            while not self.should_stop():
+                time.sleep(self.check_interval)
+                self.check_workers()
+        finally:
+            logger.info("Stopping workers...")
+            for worker in self.workers:
+                if worker.is_alive():
+                    worker.process.terminate()
+            for worker in self.workers:
+                worker.stop()
+            logger.info("All workers stopped")
+
+    def check_workers(self) -> None:
+        """Перезапуск упавших процессов"""
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.is_alive() or self.should_stop():
+                continue
+
+            if not worker.next_start_at:
+                # Сбрасываем задержку, если процесс успел проработать долго
+                if now - worker.started_at > self.stable_after:
+                    worker.restarts = 0
+                delay = min(self.max_backoff, 2**worker.restarts)
+                worker.next_start_at = now + delay
+                logger.error(
+                    f"Worker {worker.index} exited with code "
+                    f"{worker.process.returncode}, restarting in {delay}s"
+                )
+
+            if now >= worker.next_start_at:
+                worker.restarts += 1
+                worker.next_start_at = 0.0
+                worker.start()
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import weakref
+from typing import Callable, Dict, List, Optional
+from django.conf import settings
+from .db_executor import DatabaseExecutor, get_db_executor
+
+logger = logging.getLogger(__name__)
+
+# Поля Bot, которые раннер подхватывает без перезапуска
+RELOADABLE_FIELDS = (
+    "name",
+    "telegram_token",
+    "gpt_api_key",
+    "gpt_api_keys",
+    "description",
+    "gpt_model",
+    "gpt_light_model",
+    "gpt_routing_rules",
+    "gpt_fallback_models",
+    "gpt_hedge_after",
+    "max_tokens",
+    "temperature",
+    "gpt_timeout",
+    "gpt_max_retries",
+    "gpt_weight",
+    "system_prompt",
+    "stream_responses",
+    "debounce_seconds",
+    "summary_threshold_tokens",
+    "faq_min_score",
+    "is_active",
+)
+
+# Наблюдатели текущего процесса, которых будят сигналы
+_watchers: "weakref.WeakSet[BotConfigWatcher]" = weakref.WeakSet()
+
+
+def notify_config_changed() -> None:
+    """
+    Разбудить наблюдателей текущего процесса.
+
+    Изменения из других процессов (админка, API) доходят через
+    опрос BotConfigVersion.
+    """
+    for watcher in list(_watchers):
+        watcher.wake()
+
+
+def get_config_values(bot) -> Dict:
+    """Снимок перезагружаемых полей бота"""
+    return {field: getattr(bot, field) for field in RELOADABLE_FIELDS}
+
+
+class BotConfigWatcher:
+    """
+    Канал изменений настроек ботов.
+
+    Опрашивает одну строку BotConfigVersion и только при изменении версии
+    одним запросом перечитывает настройки подписанных ботов. Подписчики
+    вызываются лишь для ботов, у которых что-то действительно поменялось.
+    """
+
+    def __init__(
+        self,
+        db_executor: Optional[DatabaseExecutor] = None,
+        poll_interval: Optional[float] = None,
+    ):
+        """
+        Инициализация наблюдателя
+
+        Args:
+            db_executor: Пул потоков для запросов к БД
+            poll_interval: Интервал опроса версии, секунды
+        """
+        self.db = db_executor or get_db_executor()
+        self.poll_interval = poll_interval or getattr(
+            settings, "TELEGRAM_CONFIG_POLL_INTERVAL", 0.5
+        )
+        self.version: Optional[int] = None
+        self._callbacks: Dict[int, Callable[[Optional[Dict]], None]] = {}
+        self._snapshots: Dict[int, Dict] = {}
+        self._listeners: List[Callable[[], None]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def subscribe(self, bot, callback: Callable[[Optional[Dict]], None]) -> None:
+        """
+        Подписаться на изменения настроек бота
+
+        Args:
+            bot: Экземпляр модели Bot (его текущие значения - исходный снимок)
+            callback: Вызывается с новыми значениями полей
+                или None, если бот удален
+        """
+        self._callbacks[bot.id] = callback
+        self._snapshots[bot.id] = get_config_values(bot)
+
+    def unsubscribe(self, bot_id: int) -> None:
+        """Отписаться от изменений настроек бота"""
+        self._callbacks.pop(bot_id, None)
+        self._snapshots.pop(bot_id, None)
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """Подписаться на любое изменение версии настроек"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[], None]) -> None:
+        """Отписаться от изменений версии настроек"""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def wake(self) -> None:
+        """Немедленно проверить версию (потокобезопасно)"""
+        if self._loop and self._wakeup and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def run(self) -> None:
+        """Цикл наблюдения за версией настроек"""
+        from ..models import BotConfigVersion
+
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        _watchers.add(self)
+
+        try:
+            self.version = await self.db.run(BotConfigVersion.get_version)
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+                try:
+                    version = await self.db.run(BotConfigVersion.get_version)
+                    if version != self.version:
+                        self.version = version
+                        await self.reload()
+                        for listener in list(self._listeners):
+                            listener()
+                except Exception as e:
+                    logger.error(f"Error checking bot config version: {e}")
+        finally:
+            _watchers.discard(self)
+
+    async def reload(self) -> None:
+        """Перечитать настройки подписанных ботов и уведомить об изменениях"""
+        from ..models import Bot
+
+        bot_ids = list(self._callbacks)
+        if not bot_ids:
+            return
+
+        rows = await self.db.run(
+            lambda: {
+                row.pop("id"): row
+                for row in Bot.objects.filter(id__in=bot_ids).values(
+                    "id", *RELOADABLE_FIELDS
+                )
+            }
+        )
+
+        for bot_id in bot_ids:
+            callback = self._callbacks.get(bot_id)
+            if callback is None:
+                continue
+
+            values = rows.get(bot_id)
+            if values is not None and values == self._snapshots.get(bot_id):
+                continue
+
+            if values is None:
+                self._snapshots.pop(bot_id, None)
+            else:
+                self._snapshots[bot_id] = values
+
+            try:
+                callback(values)
+            except Exception as e:
+                logger.error(f"Error applying config for bot {bot_id}: {e}")
@@ -0,0 +1,132 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseExecutor:
+    """
+    Ограниченный пул потоков для синхронных запросов Django ORM.
+
+    Обработчики Telegram выполняются в event loop, поэтому любые
+    обращения к БД выносятся сюда, чтобы задержки базы не останавливали
+    остальные диалоги и ботов.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        """
+        Инициализация пула
+
+        Args:
+            max_workers: Количество потоков (и соединений с БД).
+                Если не указано, используется TELEGRAM_DB_POOL_SIZE
+        """
+        self.max_workers = max_workers or getattr(settings, "TELEGRAM_DB_POOL_SIZE", 8)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="bots-db"
+        )
+        self._lock = threading.Lock()
+
+        # Метрики загрузки пула
+        self._active = 0
+        self._queued = 0
+        self._peak_active = 0
+        self._peak_queued = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._total_run = 0.0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Выполнить синхронную функцию с запросами к БД в пуле потоков
+
+        Args:
+            func: Синхронная функция
+            *args, **kwargs: Аргументы функции
+
+        Returns:
+            Результат функции
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._queued += 1
+            self._peak_queued = max(self._peak_queued, self._queued)
+
+        call = functools.partial(self._call, time.monotonic(), func, args, kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    def _call(self, submitted_at: float, func: Callable, args, kwargs) -> Any:
+        """Выполнение задачи в потоке пула с учетом метрик"""
+        started_at = time.monotonic()
+        wait = started_at - submitted_at
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+            self._peak_active = max(self._peak_active, self._active)
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+
+        failed = False
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+                self._total_run += time.monotonic() - started_at
+                if failed:
+                    self._failed += 1
+
+    def get_stats(self) -> Dict:
+        """
+        Метрики загрузки пула
+
+        Returns:
+            Словарь с текущей и накопленной статистикой
+        """
+        with self._lock:
+            completed = self._completed or 1
+            return {
+                "max_workers": self.max_workers,
+                "active": self._active,
+                "queued": self._queued,
+                "saturation": round(self._active / self.max_workers, 2),
+                "peak_active": self._peak_active,
+                "peak_queued": self._peak_queued,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_ms": round(self._total_wait / completed * 1000, 2),
+                "max_wait_ms": round(self._max_wait * 1000, 2),
+                "avg_run_ms": round(self._total_run / completed * 1000, 2),
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Остановить пул, дождавшись выполнения поставленных задач"""
+        self._executor.shutdown(wait=wait)
+
+
+_db_executor: Optional[DatabaseExecutor] = None
+_db_executor_lock = threading.Lock()
+
+
+def get_db_executor() -> DatabaseExecutor:
+    """Общий для процесса пул потоков для работы с БД"""
+    global _db_executor
+    with _db_executor_lock:
+        if _db_executor is None:
+            _db_executor = DatabaseExecutor()
+        return _db_executor
@@ -0,0 +1,320 @@
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Слова, не помогающие отличить один вопрос от другого
+STOP_WORDS = frozenset(
+    (
+        "а и в во на к ко с со у о об от до по за из для не ни ли же бы "
+        "я ты вы мы он она оно они мне меня вас вам нас нам его ее их "
+        "как что где когда какой какая какие каком это этот эта то ваш ваша "
+        "ваши ваше мой можно есть быть бывает ну пожалуйста подскажите "
+        "скажите "
+        "a an the is are do does to of in on at for and or i you we "
+        "what how when where can please"
+    ).split()
+)
+
+# Окончания русских слов: "часы" и "часов", "цена" и "цены" дают одну основу
+_ENDINGS = re.compile(
+    r"(иями|ями|ами|ого|его|ому|ему|ыми|ими|ах|ях|ов|ев|ей|ой|ий|ый|ая|яя|"
+    r"ое|ее|ые|ие|ом|ем|ам|ям|ую|юю|ть|а|я|о|е|ы|и|у|ю|ь|й)$"
+)
+
+# Параметры BM25
+K1 = 1.5
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Термы текста для поиска
+
+    Слова приводятся к нижнему регистру, стоп-слова отбрасываются,
+    у остальных отрезается окончание и основа обрезается до 5 букв.
+    """
+    terms = []
+    for word in re.findall(r"\w+", text.lower().replace("ё", "е")):
+        if word in STOP_WORDS:
+            continue
+        if len(word) > 3:
+            stem = _ENDINGS.sub("", word)
+            if len(stem) >= 3:
+                word = stem
+            if word.isascii() and word.endswith("s") and len(word) > 3:
+                word = word[:-1]
+        terms.append(word[:5])
+    return terms
+
+
+class FaqMatch(NamedTuple):
+    """Найденный вопрос базы знаний"""
+
+    entry_id: int
+    question: str
+    answer: str
+    score: float
+
+
+class FaqIndex:
+    """
+    Инвертированный индекс BM25 по вопросам базы знаний одного бота.
+
+    Строится в памяти процесса и обновляется по изменившимся записям:
+    refresh перечитывает только ID и даты изменения, а вопросы и ответы -
+    только новых и измененных записей. Оценка совпадения нормирована
+    к 0-1: 1 - сообщение совпадает с вопросом по всем значимым словам.
+
+    Счетчики обращений копятся в памяти и записываются в БД
+    flush_faq_stats, а не при каждом сообщении.
+    """
+
+    def __init__(self, bot_id: int):
+        self.bot_id = bot_id
+        # терм -> {id записи: сколько раз терм встречается в вопросе}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._terms: Dict[int, Counter] = {}
+        self._lengths: Dict[int, int] = {}
+        self._entries: Dict[int, Tuple[str, str]] = {}
+        self._versions: Dict[int, object] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+        self.stale = True
+        self.refreshed_at = 0.0
+        self.lookups = 0
+        self.hits = 0
+        # Еще не записанные в БД обращения, ответы и ответы по записям
+        self._unsaved_lookups = 0
+        self._unsaved_hits = 0
+        self._unsaved_entry_hits: Counter = Counter()
+
+    def add(self, entry_id: int, question: str, answer: str) -> None:
+        """Добавить или заменить запись"""
+        with self._lock:
+            self._remove(entry_id)
+            terms = Counter(tokenize(question))
+            for term, count in terms.items():
+                self._postings.setdefault(term, {})[entry_id] = count
+            self._terms[entry_id] = terms
+            self._lengths[entry_id] = sum(terms.values())
+            self._total_length += self._lengths[entry_id]
+            self._entries[entry_id] = (question, answer)
+
+    def remove(self, entry_id: int) -> None:
+        """Удалить запись"""
+        with self._lock:
+            self._remove(entry_id)
+
+    def _remove(self, entry_id: int) -> None:
+        terms = self._terms.pop(entry_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[entry_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(entry_id)
+        del self._entries[entry_id]
+        self._versions.pop(entry_id, None)
+
+    def refresh(self) -> None:
+        """Применить изменения базы знаний бота из БД (синхронно)"""
+        from ..models import FaqEntry
+
+        entries = FaqEntry.objects.filter(bot_id=self.bot_id, is_active=True)
+        versions = dict(entries.values_list("id", "updated_at"))
+        self.stale = False
+        self.refreshed_at = time.monotonic()
+
+        for entry_id in set(self._versions) - set(versions):
+            self.remove(entry_id)
+
+        changed = [
+            entry_id
+            for entry_id, updated_at in versions.items()
+            if self._versions.get(entry_id) != updated_at
+        ]
+        if not changed:
+            return
+        for entry_id, question, answer in FaqEntry.objects.filter(
+            id__in=changed
+        ).values_list("id", "question", "answer"):
+            self.add(entry_id, question, answer)
+            self._versions[entry_id] = versions[entry_id]
+        logger.info(f"FAQ index for bot {self.bot_id}: {len(changed)} entries updated")
+
+    def needs_refresh(self) -> bool:
+        """
+        Пора ли перечитать изменения: индекс помечен устаревшим в этом
+        процессе или давно не сверялся с БД (изменения из других процессов)
+        """
+        interval = getattr(settings, "FAQ_INDEX_REFRESH_INTERVAL", 10)
+        return self.stale or time.monotonic() - self.refreshed_at >= interval
+
+    def _idf(self, term: str) -> float:
+        count = len(self._postings.get(term, ()))
+        total = len(self._entries)
+        return math.log(1 + (total - count + 0.5) / (count + 0.5))
+
+    def _score(self, query: Counter, terms: Counter, length: int) -> float:
+        """BM25 текста с термами terms (длины length) для запроса query"""
+        average = self._total_length / len(self._entries) or 1
+        score = 0.0
+        for term, query_count in query.items():
+            count = terms.get(term)
+            if not count:
+                continue
+            norm = count + K1 * (1 - B + B * length / average)
+            score += query_count * self._idf(term) * count * (K1 + 1) / norm
+        return score
+
+    def search(self, text: str, min_score: float = 0.0) -> Optional[FaqMatch]:
+        """
+        Найти вопрос, наиболее похожий на сообщение
+
+        Args:
+            text: Сообщение пользователя
+            min_score: Минимальная нормированная оценка совпадения
+
+        Returns:
+            Лучшее совпадение не ниже min_score или None
+        """
+        query = Counter(tokenize(text))
+        with self._lock:
+            self.lookups += 1
+            self._unsaved_lookups += 1
+            if not query or not self._entries:
+                return None
+
+            candidates = set()
+            for term in query:
+                candidates.update(self._postings.get(term, ()))
+
+            best_id, best_score = None, 0.0
+            full_query = self._score(query, query, sum(query.values()))
+            for entry_id in candidates:
+                terms = self._terms[entry_id]
+                length = self._lengths[entry_id]
+                score = self._score(query, terms, length)
+                # Доля от оценки полного совпадения с вопросом и с сообщением:
+                # лишние слова и в сообщении, и в вопросе снижают оценку
+                full_question = self._score(terms, terms, length)
+                if full_question <= 0 or full_query <= 0:
+                    continue
+                score = math.sqrt(score / full_question * score / full_query)
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None or best_score < min_score:
+                return None
+            self.hits += 1
+            self._unsaved_hits += 1
+            self._unsaved_entry_hits[best_id] += 1
+            question, answer = self._entries[best_id]
+            return FaqMatch(best_id, question, answer, round(min(best_score, 1.0), 3))
+
+    def take_unsaved_stats(self) -> Tuple[int, int, Counter]:
+        """
+        Забрать незаписанные счетчики
+
+        Returns:
+            Обращения, ответы из базы и ответы по ID записей
+        """
+        with self._lock:
+            stats = (
+                self._unsaved_lookups,
+                self._unsaved_hits,
+                self._unsaved_entry_hits,
+            )
+            self._unsaved_lookups = 0
+            self._unsaved_hits = 0
+            self._unsaved_entry_hits = Counter()
+            return stats
+
+    def get_stats(self) -> Dict:
+        """Размер индекса и доля сообщений, получивших ответ из базы знаний"""
+        return {
+            "entries": len(self._entries),
+            "terms": len(self._postings),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+        }
+
+
+_indexes: Dict[int, FaqIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_faq_index(bot_id: int) -> FaqIndex:
+    """Индекс базы знаний бота (общий для процесса)"""
+    with _indexes_lock:
+        index = _indexes.get(bot_id)
+        if index is None:
+            index = _indexes[bot_id] = FaqIndex(bot_id)
+        return index
+
+
+def invalidate_faq_indexes(bot_id: Optional[int] = None) -> None:
+    """
+    Перечитать изменения базы знаний при следующем поиске
+
+    Args:
+        bot_id: Бот, чья база изменилась. None - все боты
+    """
+    with _indexes_lock:
+        indexes = list(_indexes.values()) if bot_id is None else [_indexes.get(bot_id)]
+    for index in indexes:
+        if index is not None:
+            index.stale = True
+
+
+def flush_faq_stats() -> None:
+    """Записать накопленные счетчики баз знаний в БД (синхронно)"""
+    from django.db.models import F
+    from ..models import BotFaqStats, FaqEntry
+
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        lookups, hits, entry_hits = index.take_unsaved_stats()
+        if lookups:
+            BotFaqStats.record(index.bot_id, lookups, hits)
+        for entry_id, count in entry_hits.items():
+            FaqEntry.objects.filter(pk=entry_id).update(hits=F("hits") + count)
+
+
+def find_faq_answer(bot, text: str) -> Optional[FaqMatch]:
+    """
+    Ответ из базы знаний бота (синхронно, может перечитать индекс из БД)
+
+    Обращение учитывается в памяти, в БД его записывает flush_faq_stats.
+
+    Args:
+        bot: Экземпляр модели Bot
+        text: Сообщение пользователя
+
+    Returns:
+        Совпадение или None, если база отключена или ответа нет
+    """
+    if bot.faq_min_score <= 0:
+        return None
+
+    index = get_faq_index(bot.id)
+    if index.needs_refresh():
+        index.refresh()
+    if not index.get_stats()["entries"]:
+        return None
+
+    match = index.search(text, bot.faq_min_score)
+    if match is not None:
+        logger.info(f"FAQ answer for bot {bot.id}: entry {match.entry_id}")
+    return match
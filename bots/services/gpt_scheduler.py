@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Deque, Dict, Optional, Tuple
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета запросов к GPT (меньше - важнее)
+PRIORITY_INTERACTIVE = 0  # ответы пользователям Telegram и тестовые запросы
+PRIORITY_SCENARIO = 1  # шаги сценариев
+PRIORITY_BACKGROUND = 2  # фоновые задачи (сжатие истории)
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_SCENARIO: "scenario",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+class _Waiter:
+    """Запрос, ожидающий слота"""
+
+    __slots__ = ("bot_id", "priority", "enqueued_at", "event", "loop", "future")
+
+    def __init__(self, bot_id, priority, loop=None):
+        self.bot_id = bot_id
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+            self.future = None
+        else:
+            self.event = None
+            self.future = loop.create_future()
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._set_result)
+
+    def _set_result(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class GPTRequestScheduler:
+    """
+    Общая для процесса очередь запросов к GPT.
+
+    Одновременно выполняется не больше max_concurrent запросов. Свободный
+    слот получает запрос самого важного класса приоритета, а внутри
+    класса - бот, получивший меньше всего обслуживания с учетом веса
+    (start-time fair queuing). Поэтому один бот с потоком запросов не
+    задерживает остальных, а фоновые задачи не мешают ответам
+    пользователям. Работает и из потоков, и из asyncio.
+    """
+
+    def __init__(self, max_concurrent: Optional[int] = None):
+        """
+        Инициализация очереди
+
+        Args:
+            max_concurrent: Максимум одновременных запросов.
+                По умолчанию - OPENAI_MAX_CONCURRENT_REQUESTS
+        """
+        self.max_concurrent = max_concurrent or getattr(
+            settings, "OPENAI_MAX_CONCURRENT_REQUESTS", 32
+        )
+        self.in_flight = 0
+        # priority -> bot_id -> ожидающие запросы бота по порядку
+        self._queues: Dict[int, Dict[Optional[int], Deque[_Waiter]]] = {
+            priority: {} for priority in PRIORITY_NAMES
+        }
+        # Виртуальное время: обслуживание бота в классе приоритета с учетом веса
+        self._vtime: Dict[Tuple[int, Optional[int]], float] = {}
+        self._clock: Dict[int, float] = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._weights: Dict[Optional[int], float] = {}
+        self._lock = threading.Lock()
+
+        self.granted = {priority: 0 for priority in PRIORITY_NAMES}
+        self.wait_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.wait_max = {priority: 0.0 for priority in PRIORITY_NAMES}
+
+    def _enqueue(
+        self, bot_id: Optional[int], priority: int, weight: float, loop=None
+    ) -> Optional[_Waiter]:
+        """
+        Получить слот сразу или встать в очередь
+
+        Returns:
+            None, если слот получен, иначе ожидающий запрос
+        """
+        with self._lock:
+            self._weights[bot_id] = max(weight, 0.01)
+            queued = any(self._queues[p] for p in PRIORITY_NAMES)
+            if self.in_flight < self.max_concurrent and not queued:
+                self.in_flight += 1
+                self._account(priority, 0.0)
+                return None
+
+            waiter = _Waiter(bot_id, priority, loop)
+            flows = self._queues[priority]
+            if bot_id not in flows:
+                # Бот возвращается в очередь без накопленного "кредита"
+                key = (priority, bot_id)
+                self._vtime[key] = max(self._vtime.get(key, 0.0), self._clock[priority])
+                flows[bot_id] = deque()
+            flows[bot_id].append(waiter)
+            return waiter
+
+    def _account(self, priority: int, waited: float) -> None:
+        self.granted[priority] += 1
+        self.wait_total[priority] += waited
+        self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Следующий запрос на освободившийся слот (под self._lock)"""
+        for priority in sorted(self._queues):
+            flows = self._queues[priority]
+            if not flows:
+                continue
+
+            bot_id = min(flows, key=lambda b: self._vtime[(priority, b)])
+            waiter = flows[bot_id].popleft()
+            if not flows[bot_id]:
+                del flows[bot_id]
+
+            key = (priority, bot_id)
+            self._clock[priority] = self._vtime[key]
+            self._vtime[key] += 1 / self._weights.get(bot_id, 1.0)
+            self._account(priority, time.monotonic() - waiter.enqueued_at)
+            return waiter
+        return None
+
+    def _remove(self, waiter: _Waiter) -> bool:
+        """Убрать запрос из очереди (под self._lock). False - слот уже выдан"""
+        flows = self._queues[waiter.priority]
+        queue = flows.get(waiter.bot_id)
+        if queue is None or waiter not in queue:
+            return False
+        queue.remove(waiter)
+        if not queue:
+            del flows[waiter.bot_id]
+        return True
+
+    def release(self) -> None:
+        """Освободить слот и передать его следующему запросу"""
+        with self._lock:
+            waiter = self._next_waiter()
+            if waiter is None:
+                self.in_flight -= 1
+        if waiter is not None:
+            waiter.wake()
+
+    def acquire(
+        self,
+        bot_id: Optional[int] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        weight: float = 1.0,
+    ) -> None:
+        """Дождаться слота (блокирует поток)"""
+        waiter = self._enqueue(bot_id, priority, weight)
+        if waiter is not None:
+            waiter.event.wait()
+
+    async def aacquire(
+        self,
+        bot_id: Optional[int] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        weight: float = 1.0,
+    ) -> None:
+        """Дождаться слота, не блокируя event loop"""
+        waiter = self._enqueue(bot_id, priority, weight, asyncio.get_running_loop())
+        if waiter is None:
+            return
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                removed = self._remove(waiter)
+            if not removed:
+                # Слот успели выдать - отдаем следующему
+                self.release()
+            raise
+
+    @contextmanager
+    def slot(
+        self,
+        bot_id: Optional[int] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        weight: float = 1.0,
+    ):
+        """Выполнить блок, заняв слот"""
+        self.acquire(bot_id, priority, weight)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(
+        self,
+        bot_id: Optional[int] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        weight: float = 1.0,
+    ):
+        """Асинхронный вариант slot"""
+        await self.aacquire(bot_id, priority, weight)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_stats(self) -> Dict:
+        """Глубина очередей и время ожидания по классам приоритета"""
+        with self._lock:
+            stats = {"in_flight": self.in_flight, "max_concurrent": self.max_concurrent}
+            for priority, name in PRIORITY_NAMES.items():
+                flows = self._queues[priority]
+                granted = self.granted[priority]
+                stats[name] = {
+                    "queued": sum(len(queue) for queue in flows.values()),
+                    "queued_by_bot": {
+                        bot_id: len(queue) for bot_id, queue in flows.items()
+                    },
+                    "granted": granted,
+                    "avg_wait_ms": (
+                        round(self.wait_total[priority] * 1000 / granted, 1)
+                        if granted
+                        else 0.0
+                    ),
+                    "max_wait_ms": round(self.wait_max[priority] * 1000, 1),
+                }
+            return stats
+
+
+_scheduler: Optional[GPTRequestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_gpt_scheduler() -> GPTRequestScheduler:
+    """Общая для процесса очередь запросов к GPT"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = GPTRequestScheduler()
+        return _scheduler
@@ -1,8 +1,23 @@
+import asyncio
 import openai
-import tiktoken
 import logging
-from typing import List, Dict, Optional
+import time
+from typing import Any, AsyncIterator, Callable, List, Dict, Optional, Tuple
 from django.conf import settings
+from .api_keys import NoApiKeyError, get_key_state, retire_api_key, select_api_key
+from .gpt_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, get_gpt_scheduler
+from .model_router import ModelRouter
+from .openai_clients import get_client_registry
+from .rate_limit import ApiRateLimiter, get_api_rate_limiter
+from .resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    get_circuit_breaker,
+    get_retry_after,
+)
+from .single_flight import get_single_flight, make_request_key
+from .tokenizer import count_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -10,20 +25,52 @@ logger = logging.getLogger(__name__)
 class GPTService:
     """Сервис для работы с OpenAI GPT API"""
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        api_keys: Optional[List[str]] = None,
+        bot_id: Optional[int] = None,
+        weight: float = 1.0,
+        priority: int = PRIORITY_INTERACTIVE,
+    ):
         """
         Инициализация сервиса
 
         Args:
-            api_key: API ключ OpenAI. Если не указан, используется из настроек
+            api_key: API ключ OpenAI
+            api_keys: Пул API ключей, между которыми распределяются запросы.
+                Если не указаны ни api_key, ни api_keys, используются
+                OPENAI_API_KEY и OPENAI_API_KEYS из настроек
+            bot_id: ID бота, от имени которого идут запросы (для честной
+                очереди запросов между ботами)
+            weight: Вес бота в очереди запросов
+            priority: Класс приоритета запросов по умолчанию
         """
-        self.api_key = api_key or getattr(settings, "OPENAI_API_KEY", None)
-        if not self.api_key:
+        keys = ([api_key] if api_key else []) + list(api_keys or [])
+        if not keys:
+            keys = [getattr(settings, "OPENAI_API_KEY", None)] + list(
+                getattr(settings, "OPENAI_API_KEYS", [])
+            )
+        self.api_keys = [key for key in dict.fromkeys(keys) if key]
+        if not self.api_keys:
             raise ValueError("OpenAI API key is required")
+        self.api_key = self.api_keys[0]
 
-        # Настройка клиента OpenAI
-        openai.api_key = self.api_key
-        self.client = openai.OpenAI(api_key=self.api_key)
+        self.bot_id = bot_id
+        self.weight = weight
+        self.priority = priority
+        self.clients = get_client_registry()
+        self.scheduler = get_gpt_scheduler()
+        self.router = ModelRouter()
+        self.single_flight = get_single_flight()
+        # Страховочные запросы к резервным моделям (см. agenerate_response)
+        self.hedge_stats = {
+            "hedged": 0,
+            "fallback_wins": 0,
+            "cancelled": 0,
+            "overhead_tokens": 0,
+            "tokens_by_model": {},
+        }
 
     def count_tokens(self, text: str, model: str = "gpt-3.5-turbo") -> int:
         """
@@ -37,8 +84,8 @@ class GPTService:
             Количество токенов
         """
         try:
-            encoding = tiktoken.encoding_for_model(model)
-            return len(encoding.encode(text))
+            # Кодировки и результаты для повторяющихся строк кешируются
+            return count_tokens(text, model)
         except Exception as e:
             logger.warning(f"Error counting tokens: {e}")
             # Приблизительная оценка: 1 токен ≈ 4 символа
@@ -59,9 +106,12 @@ class GPTService:
         """
         total_tokens = 0
         for message in messages:
-            # Токены за роль и контент
+            # Токены за роль и контент (контент может быть уже посчитан)
             total_tokens += self.count_tokens(message.get("role", ""), model)
-            total_tokens += self.count_tokens(message.get("content", ""), model)
+            content_tokens = message.get("tokens")
+            if content_tokens is None:
+                content_tokens = self.count_tokens(message.get("content", ""), model)
+            total_tokens += content_tokens
             # Дополнительные токены за структуру сообщения
             total_tokens += 4
 
@@ -83,33 +133,60 @@ class GPTService:
         Returns:
             Обрезанный массив сообщений
         """
+        return self._trim_messages(messages, max_tokens, model)[0]
+
+    def _trim_messages(
+        self, messages: List[Dict], max_tokens: int, model: str
+    ) -> Tuple[List[Dict], int]:
+        """
+        Обрезка сообщений с оценкой токенов результата
+
+        Сообщения с ключом "tokens" (см. Conversation.get_openai_messages)
+        повторно не токенизируются. В результате остаются только поля,
+        которые принимает OpenAI API
+
+        Args:
+            messages: Массив сообщений
+            max_tokens: Максимальное количество токенов
+            model: Модель GPT
+
+        Returns:
+            Обрезанный массив сообщений и оценка его токенов
+        """
         if not messages:
-            return messages
+            return messages, 0
 
-        # Системное сообщение всегда сохраняем
-        system_message = None
+        # Системные сообщения (промпт и пересказ истории) всегда сохраняем
+        system_messages = []
         user_messages = []
 
         for msg in messages:
             if msg.get("role") == "system":
-                system_message = msg
+                system_messages.append(msg)
             else:
                 user_messages.append(msg)
 
-        # Начинаем с системного сообщения
-        result = [system_message] if system_message else []
-        current_tokens = self.count_messages_tokens(result, model)
+        # Начинаем с системных сообщений
+        current_tokens = self.count_messages_tokens(system_messages, model)
 
-        # Добавляем сообщения с конца (самые новые)
+        # Добавляем сообщения с конца (самые новые), пока хватает лимита
+        kept = []
         for msg in reversed(user_messages):
-            msg_tokens = self.count_tokens(msg.get("content", ""), model) + 4
-            if current_tokens + msg_tokens <= max_tokens:
-                result.insert(-1 if system_message else 0, msg)
-                current_tokens += msg_tokens
-            else:
+            msg_tokens = msg.get("tokens")
+            if msg_tokens is None:
+                msg_tokens = self.count_tokens(msg.get("content", ""), model)
+            # Как в count_messages_tokens: роль и структура сообщения
+            msg_tokens += self.count_tokens(msg.get("role", ""), model) + 4
+            if current_tokens + msg_tokens > max_tokens:
                 break
+            kept.append(msg)
+            current_tokens += msg_tokens
+        kept.reverse()
 
-        return result
+        result = system_messages + kept
+        return [
+            {"role": msg["role"], "content": msg["content"]} for msg in result
+        ], current_tokens
 
     def generate_response(
         self,
@@ -118,6 +195,11 @@ class GPTService:
         max_tokens: int = 1000,
         temperature: float = 0.7,
         max_context_tokens: int = 3000,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        priority: Optional[int] = None,
+        fallback_models: Optional[List[str]] = None,
+        routing: Optional[Dict] = None,
     ) -> Dict:
         """
         Генерация ответа от GPT
@@ -128,43 +210,814 @@ class GPTService:
             max_tokens: Максимум токенов в ответе
             temperature: Температура (креативность)
             max_context_tokens: Максимум токенов в контексте
+            timeout: Таймаут одной попытки, секунды (по умолчанию OPENAI_TIMEOUT)
+            max_retries: Повторов при перегрузке и сбоях API
+                (по умолчанию OPENAI_MAX_RETRIES)
+            priority: Класс приоритета запроса (по умолчанию - сервиса)
+            fallback_models: Резервные модели по порядку: запрос к следующей
+                отправляется, если предыдущая вернула ошибку
+            routing: Быстрая модель для простых сообщений и правила выбора
+                (см. ModelRouter). None - всегда основная модель
 
         Returns:
-            Словарь с ответом и метаданными
+            Словарь с ответом и метаданными (model - модель, давшая ответ)
+        """
+        options = {
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "max_context_tokens": max_context_tokens,
+            "timeout": timeout,
+            "max_retries": max_retries,
+            "priority": priority,
+        }
+        model, fallback_models = self._route(messages, model, fallback_models, routing)
+        models = self._get_model_chain(model, fallback_models)
+
+        def call():
+            result = None
+            for current_model in models:
+                result = self._generate_once(messages, current_model, **options)
+                if result["success"]:
+                    break
+            return result
+
+        key = self._flight_key(messages, models, options)
+        if key is None:
+            return call()
+        return self.single_flight.do(key, call)
+
+    async def agenerate_response(
+        self,
+        messages: List[Dict],
+        model: str = "gpt-3.5-turbo",
+        max_tokens: int = 1000,
+        temperature: float = 0.7,
+        max_context_tokens: int = 3000,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        priority: Optional[int] = None,
+        fallback_models: Optional[List[str]] = None,
+        routing: Optional[Dict] = None,
+        hedge_after: Optional[float] = None,
+    ) -> Dict:
+        """
+        Асинхронная генерация ответа от GPT.
+
+        Не блокирует event loop на время запроса, поэтому параллельно
+        могут выполняться запросы из многих диалогов и ботов.
+        Возвращает словарь того же формата, что и generate_response.
+
+        Если задан hedge_after, а модель не ответила за это время,
+        параллельно отправляется запрос к следующей резервной модели, и
+        используется первый успешный ответ. Остальные запросы отменяются.
+
+        Args:
+            messages: Массив сообщений в формате OpenAI
+            model: Модель GPT
+            max_tokens: Максимум токенов в ответе
+            temperature: Температура (креативность)
+            max_context_tokens: Максимум токенов в контексте
+            timeout: Таймаут одной попытки, секунды (по умолчанию OPENAI_TIMEOUT)
+            max_retries: Повторов при перегрузке и сбоях API
+                (по умолчанию OPENAI_MAX_RETRIES)
+            priority: Класс приоритета запроса (по умолчанию - сервиса)
+            fallback_models: Резервные модели по порядку: запрос к следующей
+                отправляется, если предыдущая вернула ошибку
+            routing: Быстрая модель для простых сообщений и правила выбора
+                (см. ModelRouter). None - всегда основная модель
+            hedge_after: Через сколько секунд без ответа подключать
+                следующую резервную модель (None или 0 - только при ошибке)
+
+        Returns:
+            Словарь с ответом и метаданными (model - модель, давшая ответ)
+        """
+        options = {
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "max_context_tokens": max_context_tokens,
+            "timeout": timeout,
+            "max_retries": max_retries,
+            "priority": priority,
+        }
+        model, fallback_models = self._route(messages, model, fallback_models, routing)
+        models = self._get_model_chain(model, fallback_models)
+
+        async def call():
+            if len(models) == 1:
+                return await self._agenerate_once(messages, model, **options)
+            return await self._agenerate_hedged(messages, models, hedge_after, options)
+
+        key = self._flight_key(messages, models, options)
+        if key is None:
+            return await call()
+        return await self.single_flight.ado(key, call)
+
+    async def _agenerate_hedged(
+        self,
+        messages: List[Dict],
+        models: List[str],
+        hedge_after: Optional[float],
+        options: Dict,
+    ) -> Dict:
+        """
+        Запросы к цепочке моделей: следующая подключается при ошибке
+        предыдущей или по истечении hedge_after секунд без ответа
+
+        Args:
+            messages: Массив сообщений в формате OpenAI
+            models: Основная и резервные модели по порядку
+            hedge_after: Бюджет ожидания ответа перед подключением следующей
+            options: Остальные параметры запроса
+
+        Returns:
+            Первый успешный ответ или ошибка последней модели
+        """
+        pending: Dict[asyncio.Task, str] = {}
+        remaining = list(models)
+        # Модели, запросы к которым дошли до API (а не ждали в очереди)
+        sent = set()
+        result = None
+
+        def start_next(hedge: bool = False):
+            current_model = remaining.pop(0)
+
+            def on_send():
+                # Страховка считается, только если запрос дошел до API
+                if hedge and current_model not in sent:
+                    self.hedge_stats["hedged"] += 1
+                sent.add(current_model)
+
+            task = asyncio.create_task(
+                self._agenerate_once(
+                    messages, current_model, on_send=on_send, **options
+                )
+            )
+            pending[task] = current_model
+
+        start_next()
+        try:
+            while pending:
+                budget = hedge_after if hedge_after and remaining else None
+                done, _ = await asyncio.wait(
+                    pending, timeout=budget, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # Модель не уложилась в бюджет - страхуемся следующей
+                    logger.info(
+                        f"No response from {list(pending.values())} in "
+                        f"{hedge_after}s, hedging with {remaining[0]}"
+                    )
+                    start_next(hedge=True)
+                    continue
+
+                for task in done:
+                    current_model = pending.pop(task)
+                    result = task.result()
+                    if result["success"]:
+                        if current_model != models[0]:
+                            self.hedge_stats["fallback_wins"] += 1
+                        self._record_model_usage(current_model, result)
+                        return result
+                    logger.warning(f"Model {current_model} failed: {result['error']}")
+
+                if not pending and remaining:
+                    start_next()
+            return result
+        finally:
+            # Проигравшие запросы отменяем; промпт отправленных, вероятно,
+            # оплачен
+            for task, current_model in pending.items():
+                task.cancel()
+                self.hedge_stats["cancelled"] += 1
+                if current_model in sent:
+                    self.hedge_stats["overhead_tokens"] += self.count_messages_tokens(
+                        messages, current_model
+                    )
+
+    async def astream_response(
+        self,
+        messages: List[Dict],
+        model: str = "gpt-3.5-turbo",
+        max_tokens: int = 1000,
+        temperature: float = 0.7,
+        max_context_tokens: int = 3000,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        priority: Optional[int] = None,
+        fallback_models: Optional[List[str]] = None,
+        routing: Optional[Dict] = None,
+    ) -> AsyncIterator[Dict]:
+        """
+        Потоковая генерация ответа от GPT
+
+        Резервная модель используется, только если основная вернула ошибку
+        до первого фрагмента ответа
+
+        Args:
+            messages: Массив сообщений в формате OpenAI
+            model: Модель GPT
+            max_tokens: Максимум токенов в ответе
+            temperature: Температура (креативность)
+            max_context_tokens: Максимум токенов в контексте
+            timeout: Таймаут одной попытки, секунды (по умолчанию OPENAI_TIMEOUT)
+            max_retries: Повторов при перегрузке и сбоях API
+                (по умолчанию OPENAI_MAX_RETRIES)
+            priority: Класс приоритета запроса (по умолчанию - сервиса)
+            fallback_models: Резервные модели по порядку: запрос к следующей
+                отправляется, если предыдущая вернула ошибку
+            routing: Быстрая модель для простых сообщений и правила выбора
+                (см. ModelRouter). None - всегда основная модель
+
+        Yields:
+            {"type": "delta", "content": str} - очередной фрагмент ответа;
+            {"type": "result", "result": dict} - последнее событие, результат
+            в формате generate_response (с полным текстом и usage)
+        """
+        options = {
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "max_context_tokens": max_context_tokens,
+            "timeout": timeout,
+            "max_retries": max_retries,
+            "priority": priority,
+        }
+        model, fallback_models = self._route(messages, model, fallback_models, routing)
+        models = self._get_model_chain(model, fallback_models)
+        for index, current_model in enumerate(models):
+            started = False
+            async for event in self._astream_once(messages, current_model, **options):
+                if event["type"] == "delta":
+                    started = True
+                elif (
+                    not event["result"]["success"]
+                    and not started
+                    and index + 1 < len(models)
+                ):
+                    # Пользователь еще ничего не видел - пробуем следующую
+                    break
+                yield event
+            else:
+                return
+
+    def _route(
+        self,
+        messages: List[Dict],
+        model: str,
+        fallback_models: Optional[List[str]],
+        routing: Optional[Dict],
+    ) -> Tuple[str, Optional[List[str]]]:
         """
+        Выбрать модель для запроса (см. ModelRouter)
+
+        Returns:
+            Модель и резервные модели. Если выбрана быстрая модель,
+            основная становится первой резервной
+        """
+        chosen, _ = self.router.route(messages, model, routing)
+        if chosen == model:
+            return model, fallback_models
+        return chosen, [model] + list(fallback_models or [])
+
+    def _flight_key(
+        self, messages: List[Dict], models: List[str], options: Dict
+    ) -> Optional[str]:
+        """
+        Ключ для объединения одинаковых одновременных запросов
+        (см. SingleFlight). None - объединение отключено
+
+        Запросы объединяются только при одинаковом наборе API ключей:
+        иначе один бот платил бы за запросы другого и получал его ошибки
+        """
+        if not getattr(settings, "OPENAI_SINGLE_FLIGHT", True):
+            return None
+        return make_request_key(
+            models[0],
+            messages,
+            options["temperature"],
+            options["max_tokens"],
+            fallback_models=models[1:],
+            max_context_tokens=options["max_context_tokens"],
+            api_keys=sorted(self.api_keys),
+        )
+
+    def _get_model_chain(
+        self, model: str, fallback_models: Optional[List[str]]
+    ) -> List[str]:
+        """Основная модель и резервные без повторов"""
+        return list(dict.fromkeys([model] + list(fallback_models or [])))
+
+    def _record_model_usage(self, model: str, result: Dict) -> None:
+        """Учесть токены ответа по моделям (для оценки стоимости страховки)"""
+        tokens_by_model = self.hedge_stats["tokens_by_model"]
+        tokens_by_model[model] = (
+            tokens_by_model.get(model, 0) + result["usage"]["total_tokens"]
+        )
+
+    def _generate_once(
+        self,
+        messages: List[Dict],
+        model: str = "gpt-3.5-turbo",
+        max_tokens: int = 1000,
+        temperature: float = 0.7,
+        max_context_tokens: int = 3000,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        priority: Optional[int] = None,
+    ) -> Dict:
+        """Один запрос к модели (см. generate_response)"""
         try:
             # Обрезаем сообщения если нужно
-            trimmed_messages = self.trim_messages(messages, max_context_tokens, model)
+            trimmed_messages, prompt_tokens = self._trim_messages(
+                messages, max_context_tokens, model
+            )
 
             logger.info(f"Sending request to OpenAI: {len(trimmed_messages)} messages")
 
-            # Отправляем запрос к OpenAI
-            response = self.client.chat.completions.create(
+            # Отправляем запрос к OpenAI, дождавшись очереди
+            response, _ = self._create_completion(
+                timeout,
+                max_retries,
+                prompt_tokens + max_tokens,
+                priority,
                 model=model,
                 messages=trimmed_messages,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                timeout=30,
             )
 
-            # Извлекаем данные из ответа
-            content = response.choices[0].message.content
-            usage = response.usage
+            return self._build_response(response, model)
 
-            logger.info(f"OpenAI response received: {usage.total_tokens} tokens used")
+        except Exception as e:
+            return self._build_error(e)
 
-            return {
-                "success": True,
-                "content": content,
-                "usage": {
+    async def _agenerate_once(
+        self,
+        messages: List[Dict],
+        model: str = "gpt-3.5-turbo",
+        max_tokens: int = 1000,
+        temperature: float = 0.7,
+        max_context_tokens: int = 3000,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        priority: Optional[int] = None,
+        on_send: Optional[Callable[[], None]] = None,
+    ) -> Dict:
+        """
+        Один асинхронный запрос к модели (см. agenerate_response)
+
+        on_send вызывается, когда запрос уходит в API (после очереди)
+        """
+        try:
+            # Обрезаем сообщения если нужно
+            trimmed_messages, prompt_tokens = self._trim_messages(
+                messages, max_context_tokens, model
+            )
+
+            logger.info(f"Sending request to OpenAI: {len(trimmed_messages)} messages")
+
+            # Отправляем запрос к OpenAI без блокировки event loop
+            response, _ = await self._acreate_completion(
+                timeout,
+                max_retries,
+                prompt_tokens + max_tokens,
+                on_send,
+                priority,
+                model=model,
+                messages=trimmed_messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+            )
+
+            return self._build_response(response, model)
+
+        except Exception as e:
+            return self._build_error(e)
+
+    async def asummarize(
+        self,
+        previous_summary: str,
+        messages: List[Dict],
+        model: str = "gpt-3.5-turbo",
+        max_tokens: int = 500,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+    ) -> Dict:
+        """
+        Асинхронное обновление краткого содержания диалога
+
+        Args:
+            previous_summary: Текущее краткое содержание (может быть пустым)
+            messages: Сообщения, которые нужно добавить в пересказ
+            model: Модель GPT
+            max_tokens: Максимум токенов в пересказе
+            timeout: Таймаут одной попытки, секунды
+            max_retries: Повторов при перегрузке и сбоях API
+
+        Returns:
+            Словарь в формате generate_response, content - новый пересказ
+        """
+        roles = {"user": "Пользователь", "assistant": "Ассистент"}
+        dialog = "\n".join(
+            f"{roles.get(msg['role'], msg['role'])}: {msg['content']}"
+            for msg in messages
+        )
+        prompt = (
+            f"Предыдущее краткое содержание:\n{previous_summary or '(нет)'}\n\n"
+            f"Новые сообщения:\n{dialog}\n\n"
+            "Составь обновленное краткое содержание всего диалога."
+        )
+        summary_messages = [
+            {
+                "role": "system",
+                "content": (
+                    "Ты составляешь краткое содержание диалога пользователя с "
+                    "ассистентом. Сохрани факты о пользователе, его цели, "
+                    "договоренности и нерешенные вопросы. Пиши кратко, "
+                    "без вступлений."
+                ),
+            },
+            {"role": "user", "content": prompt},
+        ]
+
+        return await self.agenerate_response(
+            messages=summary_messages,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=0.3,
+            timeout=timeout,
+            max_retries=max_retries,
+            priority=PRIORITY_BACKGROUND,
+            # Пересказываемые сообщения не обрезаются
+            max_context_tokens=self.count_messages_tokens(summary_messages, model),
+        )
+
+    async def _astream_once(
+        self,
+        messages: List[Dict],
+        model: str = "gpt-3.5-turbo",
+        max_tokens: int = 1000,
+        temperature: float = 0.7,
+        max_context_tokens: int = 3000,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        priority: Optional[int] = None,
+    ) -> AsyncIterator[Dict]:
+        """Один потоковый запрос к модели (см. astream_response)"""
+        try:
+            # Обрезаем сообщения если нужно
+            trimmed_messages, prompt_tokens = self._trim_messages(
+                messages, max_context_tokens, model
+            )
+
+            logger.info(
+                f"Sending streaming request to OpenAI: {len(trimmed_messages)} messages"
+            )
+
+            estimated_tokens = prompt_tokens + max_tokens
+            parts = []
+            usage = None
+            # Повторяется только открытие потока: начатый ответ уже
+            # отправляется пользователю
+            stream, api_key = await self._acreate_completion(
+                timeout,
+                max_retries,
+                estimated_tokens,
+                None,
+                priority,
+                model=model,
+                messages=trimmed_messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+
+            # Слот очереди занят, пока поток не дочитан
+            finished = False
+            try:
+                async for chunk in stream:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield {"type": "delta", "content": delta}
+                finished = True
+            finally:
+                self.scheduler.release()
+                if not finished:
+                    # Оборванный поток (ошибка, отмена) тоже сверяет резерв
+                    # ключа: оплачены промпт и полученная часть ответа
+                    self._record_usage(
+                        api_key,
+                        estimated_tokens,
+                        prompt_tokens + self.count_tokens("".join(parts), model),
+                    )
+
+            content = "".join(parts)
+            if usage:
+                usage = {
                     "prompt_tokens": usage.prompt_tokens,
                     "completion_tokens": usage.completion_tokens,
                     "total_tokens": usage.total_tokens,
-                },
+                }
+            else:
+                # Провайдер не вернул usage - считаем сами
+                prompt_tokens = self.count_messages_tokens(trimmed_messages, model)
+                completion_tokens = self.count_tokens(content, model)
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }
+
+            self._record_usage(api_key, estimated_tokens, usage["total_tokens"])
+            logger.info(f"OpenAI stream finished: {usage['total_tokens']} tokens used")
+
+            result = {
+                "success": True,
+                "content": content,
+                "usage": usage,
                 "model": model,
             }
 
-        except openai.RateLimitError as e:
+        except Exception as e:
+            result = self._build_error(e)
+
+        yield {"type": "result", "result": result}
+
+    def _create_completion(
+        self,
+        timeout: Optional[float],
+        max_retries: Optional[int],
+        estimated_tokens: int,
+        priority: Optional[int] = None,
+        **kwargs,
+    ) -> Tuple[Any, str]:
+        """
+        Запрос chat.completions.create с выбором ключа, лимитами ключа,
+        повторами и предохранителем
+
+        Слот очереди запросов занимается только на время самого запроса:
+        ожидание лимитов ключа и паузы между повторами не задерживают
+        запросы других ботов.
+
+        Args:
+            timeout: Таймаут одной попытки, секунды
+            max_retries: Количество повторов
+            estimated_tokens: Оценка токенов запроса для лимита TPM
+            priority: Класс приоритета в очереди (по умолчанию - сервиса)
+            **kwargs: Параметры запроса
+
+        Returns:
+            Ответ OpenAI и ключ, которым он получен
+        """
+        timeout, policy = self._get_retry_options(timeout, max_retries)
+
+        attempt = 0
+        while True:
+            api_key = select_api_key(self.api_keys, kwargs["model"])
+            breaker = get_circuit_breaker(api_key, kwargs["model"])
+            limiter = get_api_rate_limiter(api_key)
+            state = get_key_state(api_key)
+
+            trial = breaker.before_request()
+            # Ждем своей очереди в лимитах ключа, а не получаем 429
+            wait = limiter.reserve(estimated_tokens)
+            try:
+                if wait:
+                    time.sleep(wait)
+                with self.scheduler.slot(*self._slot_args(priority)):
+                    state.in_flight += 1
+                    try:
+                        response = self.clients.get_client(
+                            api_key
+                        ).chat.completions.create(timeout=timeout, **kwargs)
+                    finally:
+                        state.in_flight -= 1
+            except Exception as e:
+                error = e
+            except BaseException:
+                # Прерванный запрос не должен навсегда занять пробный запрос
+                # предохранителя и резерв TPM
+                limiter.reconcile(estimated_tokens, None)
+                breaker.release_trial(trial)
+                raise
+            else:
+                breaker.record_success()
+                if not kwargs.get("stream"):
+                    self._record_usage(
+                        api_key, estimated_tokens, response.usage.total_tokens
+                    )
+                return response, api_key
+
+            state.failures += 1
+            limiter.reconcile(estimated_tokens, None)
+            if self._retire_rejected_key(api_key, error):
+                breaker.release_trial(trial)
+                continue
+            delay = self._handle_failure(error, attempt, policy, breaker, limiter)
+            if delay is None:
+                raise error
+            time.sleep(delay)
+            attempt += 1
+
+    async def _acreate_completion(
+        self,
+        timeout: Optional[float],
+        max_retries: Optional[int],
+        estimated_tokens: int,
+        on_send: Optional[Callable[[], None]] = None,
+        priority: Optional[int] = None,
+        **kwargs,
+    ) -> Tuple[Any, str]:
+        """
+        Асинхронный вариант _create_completion
+
+        Для потокового запроса фактический расход токенов учитывает
+        вызывающий код (_record_usage), когда поток завершится, и он же
+        освобождает слот очереди (scheduler.release), дочитав поток.
+        on_send вызывается перед каждой отправкой запроса в API
+        """
+        timeout, policy = self._get_retry_options(timeout, max_retries)
+
+        attempt = 0
+        while True:
+            api_key = select_api_key(self.api_keys, kwargs["model"])
+            breaker = get_circuit_breaker(api_key, kwargs["model"])
+            limiter = get_api_rate_limiter(api_key)
+            state = get_key_state(api_key)
+
+            trial = breaker.before_request()
+            wait = limiter.reserve(estimated_tokens)
+            try:
+                if wait:
+                    await asyncio.sleep(wait)
+                await self.scheduler.aacquire(*self._slot_args(priority))
+                state.in_flight += 1
+                if on_send:
+                    on_send()
+                try:
+                    response = await self.clients.get_async_client(
+                        api_key
+                    ).chat.completions.create(timeout=timeout, **kwargs)
+                except BaseException:
+                    self.scheduler.release()
+                    raise
+                finally:
+                    state.in_flight -= 1
+                if not kwargs.get("stream"):
+                    self.scheduler.release()
+            except Exception as e:
+                error = e
+            except BaseException:
+                # Отмена (проигравшая страховка, остановка раннера) не должна
+                # навсегда занять пробный запрос предохранителя и резерв TPM
+                limiter.reconcile(estimated_tokens, None)
+                breaker.release_trial(trial)
+                raise
+            else:
+                breaker.record_success()
+                if not kwargs.get("stream"):
+                    self._record_usage(
+                        api_key, estimated_tokens, response.usage.total_tokens
+                    )
+                return response, api_key
+
+            state.failures += 1
+            limiter.reconcile(estimated_tokens, None)
+            if self._retire_rejected_key(api_key, error):
+                breaker.release_trial(trial)
+                continue
+            delay = self._handle_failure(error, attempt, policy, breaker, limiter)
+            if delay is None:
+                raise error
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _record_usage(self, api_key: str, estimated_tokens: int, used: int) -> None:
+        """Учесть фактический расход токенов ключа вместо оценки"""
+        get_api_rate_limiter(api_key).reconcile(estimated_tokens, used)
+        state = get_key_state(api_key)
+        state.requests += 1
+        state.tokens += used
+
+    def _retire_rejected_key(self, api_key: str, error: Exception) -> bool:
+        """
+        Отключить ключ, который OpenAI не принимает
+
+        Returns:
+            True, если у сервиса остались другие ключи и запрос можно
+            сразу повторить с ними
+        """
+        if not isinstance(error, openai.AuthenticationError):
+            return False
+
+        retire_api_key(api_key, error, self.api_keys)
+        return any(get_key_state(key).usable for key in self.api_keys)
+
+    def _handle_failure(
+        self,
+        error: Exception,
+        attempt: int,
+        policy: RetryPolicy,
+        breaker: CircuitBreaker,
+        limiter: ApiRateLimiter,
+    ) -> Optional[float]:
+        """
+        Учесть неудачную попытку запроса
+
+        Returns:
+            Задержка перед повтором или None, если повторять не нужно
+        """
+        breaker.record_failure(error)
+
+        # Провайдер сам сказал, сколько ждать - придерживаем весь ключ
+        retry_after = get_retry_after(error)
+        if isinstance(error, openai.RateLimitError) and retry_after:
+            limiter.pause(retry_after)
+
+        delay = policy.get_delay(attempt, error)
+        if delay is not None:
+            logger.warning(
+                f"OpenAI request failed ({error}), "
+                f"retry {attempt + 1} in {delay:.1f}s"
+            )
+        return delay
+
+    def _slot_args(self, priority: Optional[int]) -> Tuple:
+        """Параметры очереди запросов: бот, класс приоритета и вес"""
+        if priority is None:
+            priority = self.priority
+        return self.bot_id, priority, self.weight
+
+    def _get_retry_options(
+        self, timeout: Optional[float], max_retries: Optional[int]
+    ) -> Tuple[float, RetryPolicy]:
+        """Таймаут попытки и политика повторов (с умолчаниями из настроек)"""
+        if timeout is None:
+            timeout = getattr(settings, "OPENAI_TIMEOUT", 30.0)
+        if max_retries is None:
+            max_retries = getattr(settings, "OPENAI_MAX_RETRIES", 2)
+        return timeout, RetryPolicy(max_retries)
+
+    def _build_response(self, response, model: str) -> Dict:
+        """
+        Преобразование ответа OpenAI в словарь результата
+
+        Args:
+            response: Ответ chat.completions.create
+            model: Модель GPT
+
+        Returns:
+            Словарь с ответом и метаданными
+        """
+        # Извлекаем данные из ответа
+        content = response.choices[0].message.content
+        usage = response.usage
+
+        logger.info(f"OpenAI response received: {usage.total_tokens} tokens used")
+
+        return {
+            "success": True,
+            "content": content,
+            "usage": {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+            },
+            "model": model,
+        }
+
+    def _build_error(self, e: Exception) -> Dict:
+        """
+        Преобразование исключения в словарь с описанием ошибки
+
+        Args:
+            e: Исключение, возникшее при запросе к OpenAI
+
+        Returns:
+            Словарь с кодом ошибки и сообщением для пользователя
+        """
+        if isinstance(e, NoApiKeyError):
+            logger.error(f"OpenAI request rejected: {e}")
+            return {
+                "success": False,
+                "error": "auth_error",
+                "message": "Ошибка аутентификации OpenAI API.",
+            }
+
+        if isinstance(e, CircuitOpenError):
+            logger.warning(f"OpenAI request rejected: {e}")
+            return {
+                "success": False,
+                "error": "circuit_open",
+                "message": "Сервис GPT временно недоступен. Попробуйте позже.",
+            }
+
+        if isinstance(e, openai.RateLimitError):
             logger.error(f"OpenAI rate limit exceeded: {e}")
             return {
                 "success": False,
@@ -172,7 +1025,7 @@ class GPTService:
                 "message": "Превышен лимит запросов к GPT. Попробуйте позже.",
             }
 
-        except openai.AuthenticationError as e:
+        if isinstance(e, openai.AuthenticationError):
             logger.error(f"OpenAI authentication error: {e}")
             return {
                 "success": False,
@@ -180,7 +1033,7 @@ class GPTService:
                 "message": "Ошибка аутентификации OpenAI API.",
             }
 
-        except openai.APIError as e:
+        if isinstance(e, openai.APIError):
             logger.error(f"OpenAI API error: {e}")
             return {
                 "success": False,
@@ -188,10 +1041,9 @@ class GPTService:
                 "message": "Ошибка OpenAI API. Попробуйте позже.",
             }
 
-        except Exception as e:
-            logger.error(f"Unexpected error in GPT service: {e}")
-            return {
-                "success": False,
-                "error": "unknown_error",
-                "message": "Произошла неожиданная ошибка. Попробуйте позже.",
-            }
+        logger.error(f"Unexpected error in GPT service: {e}")
+        return {
+            "success": False,
+            "error": "unknown_error",
+            "message": "Произошла неожиданная ошибка. Попробуйте позже.",
+        }
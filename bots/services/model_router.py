@@ -0,0 +1,137 @@
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from .tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Признаки сложного запроса: код, рассуждения, генерация текста
+HEAVY_KEYWORDS = (
+    "```",
+    "код",
+    "code",
+    "почему",
+    "объясни",
+    "сравни",
+    "проанализируй",
+    "анализ",
+    "напиши",
+    "составь",
+    "переведи",
+    "реши",
+    "рассчитай",
+    "докажи",
+    "пошагово",
+    "подробно",
+)
+
+# Реплики, на которые достаточно быстрой модели
+LIGHT_PHRASES = (
+    "привет",
+    "здравствуй",
+    "здравствуйте",
+    "спасибо",
+    "благодарю",
+    "ок",
+    "ok",
+    "окей",
+    "хорошо",
+    "понятно",
+    "ясно",
+    "да",
+    "нет",
+    "пока",
+    "отлично",
+    "супер",
+)
+
+
+class ModelRouter:
+    """
+    Выбор модели для запроса по простым локальным признакам.
+
+    Короткие простые реплики в начале диалога отправляются быстрой
+    дешевой модели, остальные - основной модели бота. Правила бота
+    (Bot.gpt_routing_rules) дополняют и переопределяют значения по
+    умолчанию:
+        light_max_tokens - максимум токенов сообщения для быстрой модели;
+        light_max_history - максимум сообщений истории для быстрой модели;
+        heavy_keywords - дополнительные слова, требующие основной модели;
+        light_phrases - дополнительные реплики для быстрой модели.
+    """
+
+    def __init__(self):
+        self.decisions = {"light": 0, "heavy": 0}
+        self.reasons: Dict[str, int] = {}
+
+    def route(
+        self, messages: List[Dict], model: str, routing: Optional[Dict]
+    ) -> Tuple[str, str]:
+        """
+        Выбрать модель
+
+        Args:
+            messages: Сообщения запроса в формате OpenAI
+            model: Основная модель
+            routing: Быстрая модель (light_model) и правила. None - без
+                маршрутизации
+
+        Returns:
+            Модель и причина выбора
+        """
+        if not routing or not routing.get("light_model"):
+            return model, "disabled"
+
+        light_model = routing["light_model"]
+        chosen, reason = self._decide(messages, model, light_model, routing)
+
+        self.decisions["light" if chosen == light_model else "heavy"] += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        # Решения пишутся в лог для подбора правил
+        logger.info(f"Model routing: {chosen} ({reason}), {len(messages)} messages")
+        return chosen, reason
+
+    def _decide(
+        self, messages: List[Dict], model: str, light_model: str, rules: Dict
+    ) -> Tuple[str, str]:
+        dialog = [msg for msg in messages if msg.get("role") != "system"]
+        if not dialog or dialog[-1].get("role") != "user":
+            return model, "no_user_message"
+
+        last = dialog[-1]
+        text = last.get("content", "")
+        normalized = re.sub(r"[^\w\s]", "", text.lower()).strip()
+
+        # Ключевое слово ищется с начала слова: "код" найдет "коде", "кодом"
+        heavy_keywords = HEAVY_KEYWORDS + tuple(rules.get("heavy_keywords", ()))
+        for keyword in heavy_keywords:
+            if re.search(r"(?<!\w)" + re.escape(keyword.lower()), text.lower()):
+                return model, f"keyword:{keyword}"
+
+        # Даже простая реплика в длинном диалоге может опираться на его
+        # контекст, который быстрая модель учтет хуже
+        max_history = rules.get(
+            "light_max_history", getattr(settings, "OPENAI_ROUTING_MAX_HISTORY", 6)
+        )
+        if len(dialog) > max_history:
+            return model, "long_history"
+
+        light_phrases = LIGHT_PHRASES + tuple(rules.get("light_phrases", ()))
+        if normalized in (phrase.lower() for phrase in light_phrases):
+            return light_model, "trivial"
+
+        tokens = last.get("tokens")
+        if tokens is None:
+            tokens = count_tokens(text, light_model)
+        max_tokens = rules.get(
+            "light_max_tokens", getattr(settings, "OPENAI_ROUTING_MAX_TOKENS", 40)
+        )
+        if tokens > max_tokens:
+            return model, "long_message"
+
+        return light_model, "short_message"
+
+    def get_stats(self) -> Dict:
+        """Статистика решений"""
+        return {**self.decisions, "reasons": dict(self.reasons)}
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import threading
+from typing import Dict, Tuple
+import httpx
+import openai
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAIClientRegistry:
+    """
+    Общие для процесса клиенты OpenAI, по одному на API ключ.
+
+    Каждый клиент держит свой пул keep-alive соединений, поэтому сервисы,
+    боты и запросы API с одним ключом переиспользуют уже установленные
+    TLS соединения. Асинхронные клиенты привязаны к event loop, в котором
+    созданы, и хранятся отдельно для каждого loop.
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, openai.OpenAI] = {}
+        self._async_clients: Dict[
+            Tuple[str, asyncio.AbstractEventLoop], openai.AsyncOpenAI
+        ] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def _client_options(self) -> Dict:
+        """Общие параметры клиентов"""
+        return {
+            # Повторы выполняет GPTService (см. resilience.RetryPolicy)
+            "max_retries": 0,
+            # Например, локальный тестовый сервер. None - адрес OpenAI
+            "base_url": getattr(settings, "OPENAI_BASE_URL", None) or None,
+        }
+
+    def _limits(self) -> httpx.Limits:
+        """Размеры пула соединений из настроек"""
+        return httpx.Limits(
+            max_connections=getattr(settings, "OPENAI_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=getattr(
+                settings, "OPENAI_MAX_KEEPALIVE_CONNECTIONS", 20
+            ),
+            keepalive_expiry=getattr(settings, "OPENAI_KEEPALIVE_EXPIRY", 30.0),
+        )
+
+    def get_client(self, api_key: str) -> openai.OpenAI:
+        """
+        Синхронный клиент для API ключа
+
+        Args:
+            api_key: API ключ OpenAI
+
+        Returns:
+            Общий клиент (потокобезопасен)
+        """
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    **self._client_options(),
+                    http_client=openai.DefaultHttpxClient(limits=self._limits()),
+                )
+                self._clients[api_key] = client
+                self.created += 1
+            return client
+
+    def get_async_client(self, api_key: str) -> openai.AsyncOpenAI:
+        """
+        Асинхронный клиент для API ключа в текущем event loop
+
+        Args:
+            api_key: API ключ OpenAI
+
+        Returns:
+            Общий клиент текущего event loop
+        """
+        key = (api_key, asyncio.get_running_loop())
+        with self._lock:
+            client = self._async_clients.get(key)
+            if client is None:
+                client = openai.AsyncOpenAI(
+                    api_key=api_key,
+                    **self._client_options(),
+                    http_client=openai.DefaultAsyncHttpxClient(limits=self._limits()),
+                )
+                self._async_clients[key] = client
+                self.created += 1
+            return client
+
+    async def aclose(self) -> None:
+        """Закрыть асинхронные клиенты текущего event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            keys = [key for key in self._async_clients if key[1] is loop]
+            clients = [self._async_clients.pop(key) for key in keys]
+
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"Error closing OpenAI client: {e}")
+
+    def get_stats(self) -> Dict:
+        """Статистика клиентов"""
+        return {
+            "clients": len(self._clients),
+            "async_clients": len(self._async_clients),
+            "created": self.created,
+        }
+
+
+_registry = OpenAIClientRegistry()
+
+
+def get_client_registry() -> OpenAIClientRegistry:
+    """Общий для процесса реестр клиентов OpenAI"""
+    return _registry
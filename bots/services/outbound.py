@@ -0,0 +1,244 @@
+import asyncio
+import datetime
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Tuple
+from django.conf import settings
+from telegram import Bot as TelegramBot, Message
+from telegram.error import RetryAfter
+from .rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def get_retry_after(error: RetryAfter) -> float:
+    """Пауза из ошибки RetryAfter в секундах (int или timedelta по версии PTB)"""
+    retry_after = error.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Разбить длинный текст на части не длиннее limit
+
+    Резать стараемся по абзацам, затем по строкам, затем по пробелам.
+
+    Args:
+        text: Исходный текст
+        limit: Максимальная длина части
+
+    Returns:
+        Список частей (хотя бы одна)
+    """
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+class OutboundQueue:
+    """
+    Общая очередь исходящих запросов к Telegram для всех ботов раннера.
+
+    Запросы в один чат уходят строго по порядку, разные чаты -
+    параллельно. Частоту ограничивают token bucket на бота (общий лимит
+    Telegram) и на чат (личные чаты и группы имеют разные лимиты). При
+    ответе 429 на паузу retry_after ставится бакет чата, а запрос
+    повторяется: остальные чаты бота продолжают получать сообщения. Бакеты чатов без запросов, успевшие наполниться,
+    периодически удаляются: новый бакет такого чата ничем не отличается.
+    """
+
+    def __init__(self):
+        self.bot_rate = getattr(settings, "TELEGRAM_BOT_SEND_RATE", 30)
+        self.private_chat_rate = getattr(settings, "TELEGRAM_CHAT_SEND_RATE", 1)
+        self.group_chat_rate = getattr(settings, "TELEGRAM_GROUP_SEND_RATE", 20 / 60)
+        self.max_retries = 5
+        # Как часто удалять бакеты простаивающих чатов, секунды
+        self.bucket_sweep_interval = 60.0
+        self._swept_at = time.monotonic()
+
+        self._bot_buckets: Dict[int, TokenBucket] = {}
+        self._chat_buckets: Dict[Tuple[int, int], TokenBucket] = {}
+        self._queues: Dict[Tuple[int, int], Deque] = {}
+        self._workers: Dict[Tuple[int, int], asyncio.Task] = {}
+
+        # Статистика
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.split_messages = 0
+
+    def _get_bot_bucket(self, bot_id: int) -> TokenBucket:
+        bucket = self._bot_buckets.get(bot_id)
+        if bucket is None:
+            bucket = self._bot_buckets[bot_id] = TokenBucket(self.bot_rate)
+        return bucket
+
+    def _get_chat_bucket(self, bot_id: int, chat_id: int) -> TokenBucket:
+        key = (bot_id, chat_id)
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            # Отрицательные ID у групп и каналов
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_chat_rate, capacity=3)
+            else:
+                bucket = TokenBucket(self.private_chat_rate, capacity=3)
+            self._chat_buckets[key] = bucket
+        return bucket
+
+    def submit(
+        self, bot: TelegramBot, chat_id: int, request: Callable[[], Awaitable]
+    ) -> asyncio.Future:
+        """
+        Поставить запрос к Telegram в очередь чата
+
+        Args:
+            bot: Бот, от имени которого выполняется запрос
+            chat_id: ID чата
+            request: Функция, создающая корутину запроса
+
+        Returns:
+            Future с результатом запроса
+        """
+        key = (bot.id, chat_id)
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append((request, future))
+
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._run_chat_queue(key))
+        return future
+
+    async def send_text(
+        self, bot: TelegramBot, chat_id: int, text: str, **kwargs
+    ) -> List[Message]:
+        """
+        Отправить текст, при необходимости разбив его на несколько сообщений
+
+        Все части ставятся в очередь сразу и уходят подряд, не смешиваясь
+        с другими ответами в этот чат.
+
+        Returns:
+            Отправленные сообщения
+        """
+        chunks = split_message(text)
+        if len(chunks) > 1:
+            self.split_messages += 1
+
+        futures = [
+            self.submit(
+                bot,
+                chat_id,
+                lambda chunk=chunk: bot.send_message(chat_id, chunk, **kwargs),
+            )
+            for chunk in chunks
+        ]
+        return list(await asyncio.gather(*futures))
+
+    async def edit_text(self, message: Message, text: str, **kwargs):
+        """Изменить текст сообщения через очередь чата"""
+        return await self.submit(
+            message.get_bot(),
+            message.chat_id,
+            lambda: message.edit_text(text, **kwargs),
+        )
+
+    async def _run_chat_queue(self, key: Tuple[int, int]) -> None:
+        """Последовательная отправка запросов одного чата"""
+        bot_id, chat_id = key
+        queue = self._queues[key]
+        try:
+            while queue:
+                request, future = queue.popleft()
+                if future.cancelled():
+                    continue
+
+                try:
+                    result = await self._send(bot_id, chat_id, request)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    self.failed += 1
+                    if not future.cancelled():
+                        future.set_exception(e)
+                else:
+                    self.sent += 1
+                    if not future.cancelled():
+                        future.set_result(result)
+        finally:
+            del self._workers[key]
+            # Прерванный воркер (остановка раннера) не должен оставить
+            # ожидающих ответа навсегда
+            while queue:
+                _, future = queue.popleft()
+                future.cancel()
+            del self._queues[key]
+            self._sweep_chat_buckets()
+
+    def _sweep_chat_buckets(self) -> None:
+        """Удалить бакеты чатов без запросов, запас которых восстановлен"""
+        now = time.monotonic()
+        if now - self._swept_at < self.bucket_sweep_interval:
+            return
+        self._swept_at = now
+
+        idle = [
+            key
+            for key, bucket in self._chat_buckets.items()
+            if key not in self._workers and bucket.available >= bucket.capacity
+        ]
+        for key in idle:
+            del self._chat_buckets[key]
+
+    async def _send(self, bot_id: int, chat_id: int, request: Callable[[], Awaitable]):
+        """Выполнить запрос с учетом лимитов и повтором после 429"""
+        bot_bucket = self._get_bot_bucket(bot_id)
+        chat_bucket = self._get_chat_bucket(bot_id, chat_id)
+
+        for attempt in range(self.max_retries + 1):
+            delay = max(chat_bucket.reserve(), bot_bucket.reserve())
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                return await request()
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                retry_after = get_retry_after(e)
+                self.rate_limited += 1
+                logger.warning(
+                    f"Telegram flood limit for chat {chat_id}, "
+                    f"retrying in {retry_after}s"
+                )
+                chat_bucket.pause(retry_after)
+
+    def get_stats(self) -> Dict:
+        """Статистика очереди"""
+        return {
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "active_chats": len(self._workers),
+            "chat_buckets": len(self._chat_buckets),
+            "sent": self.sent,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+            "split_messages": self.split_messages,
+        }
@@ -0,0 +1,202 @@
+import threading
+import time
+from typing import Dict, Optional
+from django.conf import settings
+
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket с резервированием.
+
+    reserve() сразу списывает токены (баланс может уйти в минус) и
+    возвращает, сколько нужно подождать, прежде чем использовать их.
+    Так ожидающие обслуживаются в порядке резервирования без отдельной
+    очереди, а бакет одинаково работает из asyncio и из потоков.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Инициализация бакета
+
+        Args:
+            rate: Скорость пополнения, токенов в секунду
+            capacity: Максимальный запас токенов (по умолчанию - rate)
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """
+        Зарезервировать токены
+
+        Args:
+            amount: Количество токенов
+
+        Returns:
+            Время ожидания в секундах до того, как токены можно использовать
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def adjust(self, amount: float) -> None:
+        """
+        Вернуть (amount > 0) или дополнительно списать (amount < 0) токены,
+        например когда фактический расход отличается от оценки
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать токены ближайшие seconds секунд (например, после 429)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+    @property
+    def available(self) -> float:
+        """Текущий запас токенов (отрицательный - есть очередь)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class ApiRateLimiter:
+    """
+    Лимиты запросов (RPM) и токенов (TPM) в минуту для одного API ключа.
+
+    Лимиты заданы с запасом (OPENAI_RATE_LIMIT_HEADROOM), а запас бакетов -
+    на несколько секунд, поэтому запросы ставятся в очередь чуть ниже
+    лимита провайдера, а не упираются в него и получают 429.
+    """
+
+    # Максимальный всплеск - расход за столько секунд
+    BURST_SECONDS = 6
+
+    def __init__(
+        self, rpm_limit: Optional[int] = None, tpm_limit: Optional[int] = None
+    ):
+        """
+        Инициализация лимитера
+
+        Args:
+            rpm_limit: Запросов в минуту (0 - без ограничения).
+                По умолчанию - OPENAI_RPM_LIMIT
+            tpm_limit: Токенов в минуту (0 - без ограничения).
+                По умолчанию - OPENAI_TPM_LIMIT
+        """
+        if rpm_limit is None:
+            rpm_limit = getattr(settings, "OPENAI_RPM_LIMIT", 500)
+        if tpm_limit is None:
+            tpm_limit = getattr(settings, "OPENAI_TPM_LIMIT", 200000)
+        self.requests = self._make_bucket(rpm_limit)
+        self.tokens = self._make_bucket(tpm_limit)
+        self.reserved = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.estimate_error = 0
+
+    def _make_bucket(self, per_minute: int) -> Optional[TokenBucket]:
+        if not per_minute:
+            return None
+        headroom = getattr(settings, "OPENAI_RATE_LIMIT_HEADROOM", 0.9)
+        rate = per_minute * headroom / 60
+        return TokenBucket(rate, capacity=max(1.0, rate * self.BURST_SECONDS))
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Зарезервировать запрос с оценкой расхода токенов
+
+        Args:
+            tokens: Оценка токенов запроса (контекст и максимум ответа)
+
+        Returns:
+            Сколько секунд подождать перед отправкой запроса
+        """
+        wait = 0.0
+        if self.requests:
+            wait = self.requests.reserve(1)
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+
+        self.reserved += 1
+        if wait > 0:
+            self.throttled += 1
+            self.wait_seconds += wait
+        return wait
+
+    def reconcile(self, estimated: int, used: Optional[int]) -> None:
+        """
+        Учесть фактический расход токенов вместо оценки
+
+        Args:
+            estimated: Зарезервированная оценка
+            used: Фактический расход (usage.total_tokens). None - запрос
+                не выполнен, и оценка возвращается целиком
+        """
+        used = used or 0
+        self.estimate_error += estimated - used
+        if self.tokens:
+            self.tokens.adjust(estimated - used)
+
+    def remaining(self) -> float:
+        """
+        Доля неизрасходованных лимитов: минимум по запросам и токенам,
+        отрицательная - есть очередь, 1 - лимиты не заданы или не тронуты
+        """
+        fractions = [
+            bucket.available / bucket.capacity
+            for bucket in (self.requests, self.tokens)
+            if bucket
+        ]
+        return min(fractions, default=1.0)
+
+    def pause(self, seconds: float) -> None:
+        """Не отправлять запросы seconds секунд (провайдер вернул 429)"""
+        if self.requests:
+            self.requests.pause(seconds)
+
+    def get_stats(self) -> Dict:
+        """Статистика лимитера"""
+        return {
+            "reserved": self.reserved,
+            "throttled": self.throttled,
+            "wait_seconds": round(self.wait_seconds, 1),
+            "estimate_error": self.estimate_error,
+            "requests_available": (
+                round(self.requests.available, 1) if self.requests else None
+            ),
+            "tokens_available": (round(self.tokens.available) if self.tokens else None),
+        }
+
+
+_api_limiters: Dict[str, ApiRateLimiter] = {}
+_api_limiters_lock = threading.Lock()
+
+
+def get_api_rate_limiter(api_key: str) -> ApiRateLimiter:
+    """Общий для процесса лимитер API ключа"""
+    with _api_limiters_lock:
+        limiter = _api_limiters.get(api_key)
+        if limiter is None:
+            limiter = _api_limiters[api_key] = ApiRateLimiter()
+        return limiter
+
+
+def get_api_rate_limit_stats() -> Dict:
+    """Статистика лимитеров (ключи API сокращены до последних символов)"""
+    with _api_limiters_lock:
+        limiters = list(_api_limiters.items())
+    return {f"...{api_key[-4:]}": limiter.get_stats() for api_key, limiter in limiters}
@@ -0,0 +1,263 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+import openai
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: провайдер недавно отвечал ошибками"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Circuit breaker is open, retry in {retry_in:.1f}s")
+        self.retry_in = retry_in
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Можно ли повторить запрос после ошибки
+
+    Повторяются перегрузка (429, кроме исчерпанной квоты), ошибки сервера
+    и сети. Ошибки запроса и аутентификации повтор не исправит
+    """
+    if isinstance(error, openai.RateLimitError):
+        return getattr(error, "code", None) != "insufficient_quota"
+    return isinstance(
+        error,
+        (openai.APIConnectionError, openai.InternalServerError),
+    )
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Пауза из заголовков Retry-After ответа OpenAI, секунды
+
+    Returns:
+        Пауза или None, если сервер ее не указал
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class RetryPolicy:
+    """Экспоненциальная задержка с полным jitter между повторами"""
+
+    def __init__(
+        self,
+        max_retries: int,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+    ):
+        """
+        Инициализация политики
+
+        Args:
+            max_retries: Сколько раз повторять запрос после первой попытки
+            base_delay: Задержка перед первым повтором, секунды.
+                По умолчанию - OPENAI_RETRY_BASE_DELAY
+            max_delay: Максимальная задержка, секунды. Если сервер просит
+                подождать дольше, запрос не повторяется.
+                По умолчанию - OPENAI_RETRY_MAX_DELAY
+        """
+        self.max_retries = max_retries
+        self.base_delay = (
+            base_delay
+            if base_delay is not None
+            else getattr(settings, "OPENAI_RETRY_BASE_DELAY", 0.5)
+        )
+        self.max_delay = (
+            max_delay
+            if max_delay is not None
+            else getattr(settings, "OPENAI_RETRY_MAX_DELAY", 20.0)
+        )
+
+    def get_delay(self, attempt: int, error: Exception) -> Optional[float]:
+        """
+        Задержка перед повтором
+
+        Args:
+            attempt: Номер неудачной попытки (с 0)
+            error: Ошибка попытки
+
+        Returns:
+            Задержка в секундах или None, если повторять не нужно
+        """
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_delay else None
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для пары API ключ + модель.
+
+    После failure_threshold ошибок подряд запросы отклоняются сразу, без
+    обращения к API, на reset_timeout секунд. Затем пропускается один
+    пробный запрос: успех закрывает предохранитель, ошибка снова
+    открывает его. Пробный запрос без результата (отменен или завис)
+    через reset_timeout уступает место следующему.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: Optional[int] = None,
+        reset_timeout: Optional[float] = None,
+    ):
+        """
+        Инициализация предохранителя
+
+        Args:
+            failure_threshold: Ошибок подряд до размыкания.
+                По умолчанию - OPENAI_CIRCUIT_FAILURE_THRESHOLD
+            reset_timeout: Время в разомкнутом состоянии, секунды.
+                По умолчанию - OPENAI_CIRCUIT_RESET_TIMEOUT
+        """
+        self.failure_threshold = failure_threshold or getattr(
+            settings, "OPENAI_CIRCUIT_FAILURE_THRESHOLD", 5
+        )
+        self.reset_timeout = reset_timeout or getattr(
+            settings, "OPENAI_CIRCUIT_RESET_TIMEOUT", 30.0
+        )
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._trial_started_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_request(self) -> bool:
+        """
+        Проверить, можно ли отправить запрос
+
+        Returns:
+            True, если запрос пробный: его нужно завершить record_success,
+            record_failure или release_trial
+
+        Raises:
+            CircuitOpenError: Предохранитель разомкнут
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+
+            now = time.monotonic()
+            retry_in = self.opened_at + self.reset_timeout - now
+            if self.state == self.OPEN and retry_in <= 0:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+
+            if (
+                self.state == self.HALF_OPEN
+                and self._trial_in_flight
+                and now - self._trial_started_at > self.reset_timeout
+            ):
+                logger.warning("OpenAI circuit breaker trial request expired")
+                self._trial_in_flight = False
+
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                self._trial_started_at = now
+                return True
+
+            self.rejected += 1
+            raise CircuitOpenError(max(retry_in, 0.0))
+
+    def record_success(self) -> None:
+        """Запрос выполнен успешно"""
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("OpenAI circuit breaker closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self, trial: bool) -> None:
+        """
+        Освободить пробный запрос, завершившийся без результата
+
+        Args:
+            trial: Значение, которое вернул before_request
+        """
+        if trial:
+            with self._lock:
+                self._trial_in_flight = False
+
+    def record_failure(self, error: Exception) -> None:
+        """
+        Запрос завершился ошибкой
+
+        Учитываются только ошибки, говорящие о проблемах провайдера
+        (см. is_retryable): неверный запрос не размыкает предохранитель
+        """
+        with self._lock:
+            self._trial_in_flight = False
+            if not is_retryable(error):
+                return
+
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.failures >= self.failure_threshold
+            ):
+                if self.state != self.OPEN:
+                    logger.warning(
+                        f"OpenAI circuit breaker opened after {self.failures} "
+                        f"failures: {error}"
+                    )
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def get_stats(self) -> Dict:
+        """Состояние предохранителя"""
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(api_key: str, model: str) -> CircuitBreaker:
+    """Общий для процесса предохранитель пары API ключ + модель"""
+    with _breakers_lock:
+        breaker = _breakers.get((api_key, model))
+        if breaker is None:
+            breaker = _breakers[(api_key, model)] = CircuitBreaker()
+        return breaker
+
+
+def get_circuit_stats() -> Dict:
+    """Состояние предохранителей (ключи API сокращены до последних символов)"""
+    with _breakers_lock:
+        breakers = list(_breakers.items())
+    return {
+        f"...{api_key[-4:]}/{model}": breaker.get_stats()
+        for (api_key, model), breaker in breakers
+    }
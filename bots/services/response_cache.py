@@ -0,0 +1,421 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from django.conf import settings
+from .gpt_scheduler import PRIORITY_SCENARIO
+from .gpt_service import GPTService
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(
+    bot_id: int, prompt: str, model: str, temperature: float, max_tokens: int
+) -> str:
+    """
+    Ключ кеша ответа
+
+    Температура округляется до 0.1: настройки 0.7 и 0.71 дают один ключ.
+    Ответы разных ботов не смешиваются: каждый бот платит за свои запросы
+    своими ключами
+
+    Args:
+        bot_id: Бот, запросивший ответ
+        prompt: Промпт после подстановки переменных
+        model: Модель GPT
+        temperature: Температура запроса
+        max_tokens: Максимум токенов в ответе (ответ мог быть обрезан им)
+
+    Returns:
+        Хеш бота, промпта, модели, температуры и лимита ответа
+    """
+    bucket = round(float(temperature or 0), 1)
+    raw = f"{bot_id}\0{model}\0{bucket}\0{max_tokens}\0{prompt}".encode()
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+class MemoryBackend:
+    """Хранилище в памяти процесса: LRU с ограничением размера и TTL"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class FileBackend:
+    """
+    Хранилище в файлах: один JSON файл на ключ.
+
+    Переживает перезапуск процесса и общее для процессов на одной
+    машине. Время использования - время изменения файла: при
+    переполнении удаляются давно не использованные записи.
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                item = json.load(f)
+            expired = item["expires_at"] <= time.time()
+            value = item["value"]
+        except (OSError, ValueError):
+            return None
+        except (KeyError, TypeError):
+            # Файл не в формате кеша - удаляем, чтобы не читать снова
+            self._delete(path)
+            return None
+
+        if expired:
+            self._delete(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": time.time() + ttl, "value": value}, f)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            files = self._files()
+            if len(files) > self.max_size:
+                files.sort(key=lambda name: self._mtime(name))
+                for name in files[: len(files) - self.max_size]:
+                    self._delete(os.path.join(self.directory, name))
+
+    def _files(self):
+        try:
+            return [n for n in os.listdir(self.directory) if n.endswith(".json")]
+        except OSError:
+            return []
+
+    def _mtime(self, name: str) -> float:
+        try:
+            return os.path.getmtime(os.path.join(self.directory, name))
+        except OSError:
+            return 0.0
+
+    @staticmethod
+    def _delete(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def size(self) -> int:
+        return len(self._files())
+
+
+class LocalRedis:
+    """
+    Замена Redis в памяти процесса с тем же интерфейсом (get/setex).
+
+    Используется, когда адрес Redis не задан или пакет redis не
+    установлен, например при локальной разработке.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(name)
+            if item is None:
+                return None
+            if item[0] <= time.time():
+                del self._data[name]
+                return None
+            return item[1]
+
+    def setex(self, name: str, time_seconds: int, value: str) -> None:
+        with self._lock:
+            self._data[name] = (time.time() + time_seconds, value.encode())
+
+
+class RedisBackend:
+    """
+    Хранилище в Redis: общее для всех процессов и серверов.
+
+    Срок хранения задается TTL ключа, вытеснение при переполнении -
+    настройкой maxmemory-policy сервера (allkeys-lru).
+    """
+
+    prefix = "gpt_response:"
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        self.client.setex(self.prefix + key, ttl, value)
+
+    def size(self) -> Optional[int]:
+        # dbsize считает все ключи базы, а не только ответы
+        return None
+
+
+class ResponseCache:
+    """
+    Кеш ответов GPT на промпты шагов сценариев.
+
+    Шаг сценария того же бота с одинаковым промптом (после подстановки
+    переменных), моделью, температурой и лимитом ответа получает сохраненный ответ
+    без запроса к API. Ошибки хранилища и поврежденные записи не
+    прерывают обработку: запрос просто идет к GPT.
+    """
+
+    def __init__(self, backend):
+        """
+        Инициализация кеша
+
+        Args:
+            backend: Хранилище (MemoryBackend, FileBackend или RedisBackend)
+        """
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.saved_tokens = 0
+
+    def get(
+        self,
+        bot_id: int,
+        prompt: str,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+    ) -> Optional[Dict]:
+        """
+        Найти сохраненный ответ
+
+        Returns:
+            Словарь с content и tokens или None
+        """
+        key = make_cache_key(bot_id, prompt, model, temperature, max_tokens)
+        try:
+            raw = self.backend.get(key)
+            item = None if raw is None else json.loads(raw)
+            if item is not None and not isinstance(item.get("content"), str):
+                raise ValueError("cached item has no content")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Response cache read error: {e}")
+            return None
+
+        if item is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.saved_tokens += item.get("tokens", 0)
+        return item
+
+    def set(
+        self,
+        bot_id: int,
+        prompt: str,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        content: str,
+        tokens: int,
+        ttl: int,
+    ) -> None:
+        """
+        Сохранить ответ
+
+        Args:
+            bot_id: Бот, запросивший ответ
+            prompt: Промпт после подстановки переменных
+            model: Модель GPT, давшая ответ
+            temperature: Температура запроса
+            max_tokens: Максимум токенов в ответе
+            content: Ответ GPT
+            tokens: Сколько токенов стоил ответ
+            ttl: Срок хранения, секунды
+        """
+        key = make_cache_key(bot_id, prompt, model, temperature, max_tokens)
+        raw = json.dumps({"content": content, "tokens": tokens}, ensure_ascii=False)
+        try:
+            self.backend.set(key, raw, ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Response cache write error: {e}")
+
+    def get_stats(self) -> Dict:
+        """Статистика кеша"""
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "size": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "saved_tokens": self.saved_tokens,
+        }
+
+
+def _create_backend():
+    backend = getattr(settings, "GPT_RESPONSE_CACHE_BACKEND", "memory")
+    max_size = getattr(settings, "GPT_RESPONSE_CACHE_SIZE", 1000)
+
+    if backend == "file":
+        directory = getattr(settings, "GPT_RESPONSE_CACHE_DIR", "") or os.path.join(
+            settings.BASE_DIR, "gpt_response_cache"
+        )
+        return FileBackend(str(directory), max_size)
+
+    if backend == "redis":
+        url = getattr(settings, "GPT_RESPONSE_CACHE_REDIS_URL", "")
+        if url:
+            try:
+                import redis
+
+                return RedisBackend(redis.Redis.from_url(url))
+            except ImportError:
+                logger.warning("redis package is not installed, using local stand-in")
+        return RedisBackend(LocalRedis())
+
+    if backend != "memory":
+        logger.warning(f"Unknown response cache backend {backend}, using memory")
+    return MemoryBackend(max_size)
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Общий для процесса кеш ответов (хранилище - GPT_RESPONSE_CACHE_BACKEND)"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(_create_backend())
+        return _response_cache
+
+
+def parse_cache_ttl(value) -> int:
+    """
+    Срок хранения ответа из данных шага сценария
+
+    Значение приводится к целому: строка "0" отключает кеш, а не
+    включает его. Нечисловое или отрицательное значение - ошибка
+    настройки шага, ответ такого шага не кешируется
+
+    Returns:
+        Срок хранения, секунды (0 - без кеша)
+    """
+    try:
+        if isinstance(value, bool):
+            raise ValueError("boolean")
+        ttl = int(value or 0)
+        if ttl < 0:
+            raise ValueError("negative")
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid scenario cache_ttl {value!r}, caching disabled")
+        return 0
+    return ttl
+
+
+def generate_scenario_response(bot, prompt: str, cache_ttl=0) -> str:
+    """
+    Ответ GPT на промпт шага сценария
+
+    Args:
+        bot: Бот сценария (модель, ключи и параметры запроса)
+        prompt: Промпт после подстановки переменных
+        cache_ttl: Срок хранения ответа в кеше, секунды (значение из
+            данных шага, см. parse_cache_ttl). 0 - без кеша
+
+    Returns:
+        Ответ GPT или сообщение об ошибке для пользователя
+    """
+    cache_ttl = parse_cache_ttl(cache_ttl)
+    cache = get_response_cache() if cache_ttl else None
+    if cache is not None:
+        cached = cache.get(
+            bot.id, prompt, bot.gpt_model, bot.temperature, bot.max_tokens
+        )
+        if cached is not None:
+            return cached["content"]
+
+    gpt_service = GPTService(
+        api_keys=bot.get_gpt_api_keys(),
+        bot_id=bot.id,
+        weight=bot.gpt_weight,
+        priority=PRIORITY_SCENARIO,
+    )
+    result = gpt_service.generate_response(
+        messages=[{"role": "user", "content": prompt}],
+        model=bot.gpt_model,
+        max_tokens=bot.max_tokens,
+        temperature=bot.temperature,
+        timeout=bot.gpt_timeout,
+        max_retries=bot.gpt_max_retries,
+        fallback_models=bot.get_gpt_fallback_models(),
+    )
+    if not result["success"]:
+        return result["message"]
+
+    if cache is not None:
+        # Ответ резервной модели сохраняется под ее именем и не будет
+        # выдан вместо ответа основной модели
+        cache.set(
+            bot.id,
+            prompt,
+            result["model"],
+            bot.temperature,
+            bot.max_tokens,
+            result["content"],
+            result["usage"]["total_tokens"],
+            cache_ttl,
+        )
+    return result["content"]
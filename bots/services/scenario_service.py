@@ -3,7 +3,7 @@ import logging
 from typing import Dict, Any, Optional, Tuple
 from django.utils import timezone
 from ..models import Scenario, UserScenarioSession, Bot, TelegramUser
-from .gpt_service import GPTService
+from .response_cache import generate_scenario_response
 
 logger = logging.getLogger(__name__)
 
@@ -11,9 +11,6 @@ logger = logging.getLogger(__name__)
 class ScenarioService:
     """Сервис для работы со сценариями взаимодействия"""
 
-    def __init__(self):
-        self.gpt_service = GPTService()
-
     def start_scenario(
         self,
         bot: Bot,
@@ -178,10 +175,12 @@ class ScenarioService:
             prompt = state_data.get("prompt", "")
             formatted_prompt = self._format_prompt(prompt, session.context_data)
 
-            # Отправляем запрос к GPT
-            gpt_response = self.gpt_service.get_response(
-                bot=session.bot,
-                messages=[{"role": "user", "content": formatted_prompt}],
+            # Отправляем запрос к GPT (ответ берется из кеша, если у шага
+            # задан cache_ttl и такой промпт уже был)
+            gpt_response = generate_scenario_response(
+                session.bot,
+                formatted_prompt,
+                cache_ttl=state_data.get("cache_ttl", 0),
             )
 
             # Обрабатываем переходы
@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def make_request_key(
+    model: str, messages: List[Dict], temperature: float, max_tokens: int, **extra
+) -> str:
+    """
+    Канонический ключ запроса к GPT
+
+    Учитываются только роль и текст сообщений, поэтому служебные поля
+    (tokens, timestamp) не мешают совпадению одинаковых запросов.
+
+    Args:
+        model: Модель GPT
+        messages: Сообщения запроса
+        temperature: Температура
+        max_tokens: Максимум токенов в ответе
+        **extra: Другие параметры, влияющие на ответ
+
+    Returns:
+        Хеш параметров запроса
+    """
+    payload = {
+        "model": model,
+        "messages": [[msg.get("role"), msg.get("content")] for msg in messages],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        **extra,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode()
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+class _Participant:
+    """Запрос, ожидающий общего результата"""
+
+    __slots__ = ("event", "loop", "future", "result", "error")
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.result = None
+        self.error = None
+        if loop is None:
+            self.event = threading.Event()
+            self.future = None
+        else:
+            self.event = None
+            self.future = loop.create_future()
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._set_result)
+
+    def _set_result(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class _Flight:
+    """Выполняющийся запрос и его участники"""
+
+    __slots__ = ("participants", "initiator", "task")
+
+    def __init__(self, initiator: _Participant):
+        self.participants: List[_Participant] = [initiator]
+        # Участник, запустивший запрос (не учитывается в shared)
+        self.initiator = initiator
+        # Задача запроса из asyncio (ссылка не дает сборщику мусора ее удалить)
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов к GPT.
+
+    Пока запрос с некоторым ключом выполняется, такие же запросы не
+    отправляются в API, а ждут его результата. Токены ответа делятся
+    между всеми участниками поровну (с округлением до целых), поэтому
+    сумма учтенных по диалогам токенов равна фактическим затратам.
+    Работает и из потоков, и из asyncio.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+        self.saved_tokens = 0
+
+    def _join(self, key: str, participant: _Participant) -> Optional[_Flight]:
+        """Присоединиться к запросу. Запрос, если его нужно выполнить самому"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.shared += 1
+                flight.participants.append(participant)
+                return None
+
+            flight = self._flights[key] = _Flight(participant)
+            self.calls += 1
+            return flight
+
+    def _leave(self, key: str, participant: _Participant) -> None:
+        """
+        Отменившийся участник не получает долю токенов. Если отменились
+        все участники, запрос больше никому не нужен и отменяется
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None or participant not in flight.participants:
+                return
+            flight.participants.remove(participant)
+            if participant is not flight.initiator:
+                self.shared -= 1
+            if flight.participants or flight.task is None:
+                return
+            # Новые такие же запросы запустят свой, а не присоединятся
+            # к отменяемому
+            del self._flights[key]
+        flight.task.cancel()
+
+    def _finish(
+        self,
+        key: str,
+        flight: _Flight,
+        result: Optional[Dict] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """Раздать результат участникам и завершить запрос"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            participants = list(flight.participants)
+
+        count = len(participants)
+        for index, participant in enumerate(participants):
+            participant.error = error
+            if result is not None:
+                participant.result = self._share(result, count, index)
+        if result is not None and count > 1:
+            usage = result.get("usage") or {}
+            self.saved_tokens += usage.get("total_tokens", 0) * (count - 1)
+            logger.info(f"GPT request shared by {count} callers")
+
+        for participant in participants:
+            participant.wake()
+
+    @staticmethod
+    def _share(result: Dict, count: int, index: int) -> Dict:
+        """
+        Результат участника: total_tokens - его доля. prompt_tokens и
+        completion_tokens описывают сам ответ и не делятся
+        """
+        usage = result.get("usage")
+        if count == 1 or not usage:
+            return result
+        total = usage["total_tokens"]
+        share = total // count + (1 if index < total % count else 0)
+        return {**result, "usage": {**usage, "total_tokens": share, "shared_by": count}}
+
+    @staticmethod
+    def _outcome(participant: _Participant) -> Dict:
+        if participant.error is not None:
+            raise participant.error
+        return participant.result
+
+    def do(self, key: str, call: Callable[[], Dict]) -> Dict:
+        """
+        Выполнить запрос или дождаться такого же (блокирует поток)
+
+        Args:
+            key: Ключ запроса (make_request_key)
+            call: Выполняет запрос и возвращает результат
+
+        Returns:
+            Результат с долей токенов участника
+        """
+        participant = _Participant()
+        flight = self._join(key, participant)
+        if flight is None:
+            participant.event.wait()
+            return self._outcome(participant)
+
+        try:
+            result = call()
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+            raise
+        self._finish(key, flight, result)
+        return self._outcome(participant)
+
+    async def ado(self, key: str, call: Callable[[], Awaitable[Dict]]) -> Dict:
+        """
+        Асинхронный вариант do
+
+        Запрос выполняется отдельной задачей: если инициатор отменен,
+        остальные участники все равно получат результат. Запрос, от
+        которого отказались все участники, отменяется.
+        """
+        loop = asyncio.get_running_loop()
+        participant = _Participant(loop)
+        flight = self._join(key, participant)
+        if flight is not None:
+            flight.task = loop.create_task(call())
+            flight.task.add_done_callback(
+                lambda task: self._task_done(key, flight, task)
+            )
+
+        try:
+            await participant.future
+        except asyncio.CancelledError:
+            self._leave(key, participant)
+            raise
+        return self._outcome(participant)
+
+    def _task_done(self, key: str, flight: _Flight, task: asyncio.Task) -> None:
+        if task.cancelled():
+            self._finish(key, flight, error=asyncio.CancelledError())
+        elif task.exception() is not None:
+            self._finish(key, flight, error=task.exception())
+        else:
+            self._finish(key, flight, task.result())
+
+    def get_stats(self) -> Dict:
+        """Запросов в API, объединенных запросов и сэкономленных токенов"""
+        with self._lock:
+            in_flight = len(self._flights)
+        return {
+            "in_flight": in_flight,
+            "calls": self.calls,
+            "shared": self.shared,
+            "saved_tokens": self.saved_tokens,
+        }
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Общий для процесса объединитель запросов"""
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
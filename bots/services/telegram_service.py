@@ -1,12 +1,39 @@
 import asyncio
 import logging
 import time
-from typing import Dict, Optional
-from telegram import Bot as TelegramBot, Update
+from typing import Dict, List, Optional, Set, Tuple
+from telegram import Bot as TelegramBot, Message, Update
+from telegram.error import BadRequest, InvalidToken, RetryAfter, TelegramError
 from telegram.ext import Application, MessageHandler, CommandHandler, filters
+from django.conf import settings
 from django.utils import timezone
 from ..models import Bot, TelegramUser, Conversation
+from .api_keys import get_key_stats
+from .faq_index import find_faq_answer, flush_faq_stats, get_faq_index
 from .gpt_service import GPTService
+from .gpt_scheduler import get_gpt_scheduler
+from .openai_clients import get_client_registry
+from .rate_limit import get_api_rate_limit_stats
+from .response_cache import get_response_cache
+from .single_flight import get_single_flight
+from .resilience import get_circuit_stats
+from .db_executor import DatabaseExecutor, get_db_executor
+from .config_channel import BotConfigWatcher
+from .webhook_server import WebhookServer, get_webhook_secret
+from .bot_supervisor import shard_for_bot
+from .update_processor import (
+    AcceptedUpdateQueue,
+    ChatOrderedUpdateProcessor,
+    UpdateConcurrencyLimiter,
+)
+from .outbound import (
+    OutboundQueue,
+    TELEGRAM_MESSAGE_LIMIT,
+    get_retry_after,
+    split_message,
+)
+from .update_offsets import UpdateOffsetStore, UpdateOffsetTracker
+from .tokenizer import count_tokens, get_token_counter
 
 logger = logging.getLogger(__name__)
 
@@ -14,23 +41,90 @@ logger = logging.getLogger(__name__)
 class TelegramBotService:
     """Сервис для работы с Telegram ботом в polling режиме"""
 
-    def __init__(self, bot_instance: Bot):
+    def __init__(
+        self,
+        bot_instance: Bot,
+        db_executor: Optional[DatabaseExecutor] = None,
+        config_watcher: Optional[BotConfigWatcher] = None,
+        update_limiter: Optional[UpdateConcurrencyLimiter] = None,
+        outbound: Optional[OutboundQueue] = None,
+        offset_store: Optional[UpdateOffsetStore] = None,
+    ):
         """
         Инициализация сервиса
 
         Args:
             bot_instance: Экземпляр модели Bot
+            db_executor: Пул потоков для запросов к БД (по умолчанию общий)
+            config_watcher: Канал изменений настроек ботов
+            update_limiter: Общий лимит одновременно обрабатываемых обновлений
+            outbound: Общая очередь исходящих сообщений
+            offset_store: Хранилище позиций обработанных обновлений
         """
         self.bot_instance = bot_instance
         self.telegram_bot = TelegramBot(token=bot_instance.telegram_token)
-        self.gpt_service = GPTService(api_key=bot_instance.gpt_api_key)
+        self.gpt_service = GPTService(
+            api_keys=bot_instance.get_gpt_api_keys(),
+            bot_id=bot_instance.id,
+            weight=bot_instance.gpt_weight,
+        )
+        self.db = db_executor or get_db_executor()
+        self.config_watcher = config_watcher
+        self.update_processor = ChatOrderedUpdateProcessor(
+            update_limiter or UpdateConcurrencyLimiter(),
+            on_receive=self.collect_message,
+            on_complete=self.complete_update,
+        )
+        self.outbound = outbound or OutboundQueue()
+        self.offset_store = offset_store or UpdateOffsetStore(self.db)
+        self.offsets: Optional[UpdateOffsetTracker] = None
+        self.poll_timeout = 10
+        self.max_pending_updates = getattr(
+            settings, "TELEGRAM_MAX_PENDING_UPDATES", 1000
+        )
+        self.shutdown_timeout = getattr(settings, "TELEGRAM_SHUTDOWN_TIMEOUT", 25)
+        # Итоги остановки: дообработанные и прерванные обновления
+        self.drained_updates = 0
+        self.abandoned_updates = 0
         self.application = None
         self.is_running = False
+        self.webhook_secret = get_webhook_secret(bot_instance.telegram_token)
+        self.webhook_server: Optional[WebhookServer] = None
+        self.startup_ms: Optional[float] = None
+        self.stream_edit_interval = getattr(
+            settings, "TELEGRAM_STREAM_EDIT_INTERVAL", 1.0
+        )
+        self.restart_requested = False
+        self._stop_event: Optional[asyncio.Event] = None
+        self._poll_task: Optional[asyncio.Task] = None
+        # Текстовые сообщения, которые обрабатывает handle_message
+        self.message_filter = filters.TEXT & ~filters.COMMAND
+        # (chat_id, user_id) -> еще не отвеченные сообщения пачки и время последнего
+        self._bursts: Dict[Tuple[int, Optional[int]], List[Message]] = {}
+        self._burst_received_at: Dict[Tuple[int, Optional[int]], float] = {}
+        # (chat_id, message_id) сообщений, уже вошедших в отвеченную пачку
+        self._merged: Set[Tuple[int, int]] = set()
+        self.coalesced_messages = 0
+        # Фоновое сжатие истории: conversation_id -> задача
+        self._summary_tasks: Dict[int, asyncio.Task] = {}
+        self.summaries_created = 0
 
     async def setup_application(self):
-        """Настройка Telegram Application"""
+        """
+        Настройка Telegram Application
+
+        Updater не используется: в режиме polling обновления получает
+        poll_updates, в режиме webhook - общий HTTP сервер
+        """
+        # Обновления разных чатов обрабатываются параллельно,
+        # одного чата - последовательно
         self.application = (
-            Application.builder().token(self.bot_instance.telegram_token).build()
+            Application.builder()
+            .token(self.bot_instance.telegram_token)
+            .concurrent_updates(self.update_processor)
+            .update_queue(AcceptedUpdateQueue())
+            .updater(None)
+            .build()
         )
 
         # Добавляем обработчики команд
@@ -41,7 +135,7 @@ class TelegramBotService:
 
         # Добавляем обработчик текстовых сообщений
         self.application.add_handler(
-            MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message)
+            MessageHandler(self.message_filter, self.handle_message)
         )
 
         logger.info(f"Bot '{self.bot_instance.name}' application configured")
@@ -83,12 +177,54 @@ class TelegramBotService:
             telegram_user=telegram_user,
             defaults={"is_active": True},
         )
+        # Актуальные настройки бота и кеш токенов системного промпта
+        # без лишнего запроса к БД
+        conversation.bot = self.bot_instance
         return conversation
 
+    # Синхронные операции с БД. Вызываются только через self.db.run(...),
+    # чтобы не блокировать event loop
+
+    def load_user_conversation(self, telegram_user_data):
+        """Получить пользователя и его диалог с ботом"""
+        user = self.get_or_create_telegram_user(telegram_user_data)
+        conversation = self.get_or_create_conversation(user)
+        return user, conversation
+
+    def add_user_message(self, conversation: Conversation, text: str):
+        """Сохранить сообщение пользователя и собрать контекст для GPT"""
+        conversation.add_message("user", text)
+        return conversation.get_openai_messages()
+
+    def save_assistant_message(
+        self, conversation: Conversation, text: str, usage: Dict
+    ) -> Optional[int]:
+        """
+        Сохранить ответ бота и обновить счетчик токенов
+
+        Returns:
+            Граница сжатия истории (см. Conversation.get_summary_end)
+            или None, если сжимать пока не нужно
+        """
+        conversation.add_message("assistant", text, tokens=usage["completion_tokens"])
+        conversation.add_usage(usage["total_tokens"])
+
+        threshold = self.bot_instance.summary_threshold_tokens
+        if threshold:
+            return conversation.get_summary_end(threshold)
+        return None
+
+    async def reply(self, update: Update, text: str) -> List[Message]:
+        """Ответить в чат обновления через очередь исходящих сообщений"""
+        return await self.outbound.send_text(
+            self.application.bot, update.effective_chat.id, text
+        )
+
     async def handle_start(self, update: Update, context) -> None:
         """Обработчик команды /start"""
-        user = self.get_or_create_telegram_user(update.effective_user)
-        conversation = self.get_or_create_conversation(user)
+        user, conversation = await self.db.run(
+            self.load_user_conversation, update.effective_user
+        )
 
         welcome_message = (
             f"👋 Привет! Я {self.bot_instance.name}.\n\n"
@@ -100,7 +236,7 @@ class TelegramBotService:
             "/settings - настройки бота"
         )
 
-        await update.message.reply_text(welcome_message)
+        await self.reply(update, welcome_message)
         logger.info(
             f"User {user} started conversation with bot {self.bot_instance.name}"
         )
@@ -118,17 +254,18 @@ class TelegramBotService:
             "💬 Просто напишите мне любое сообщение, и я отвечу с помощью GPT!"
         )
 
-        await update.message.reply_text(help_message)
+        await self.reply(update, help_message)
 
     async def handle_clear(self, update: Update, context) -> None:
         """Обработчик команды /clear"""
-        user = self.get_or_create_telegram_user(update.effective_user)
-        conversation = self.get_or_create_conversation(user)
+        user, conversation = await self.db.run(
+            self.load_user_conversation, update.effective_user
+        )
 
-        conversation.clear_history()
+        await self.db.run(conversation.clear_history)
 
-        await update.message.reply_text(
-            "🗑️ История диалога очищена! Можете начать новый разговор."
+        await self.reply(
+            update, "🗑️ История диалога очищена! Можете начать новый разговор."
         )
         logger.info(f"User {user} cleared conversation history")
 
@@ -142,49 +279,144 @@ class TelegramBotService:
             f"📝 Системный промпт:\n{self.bot_instance.system_prompt}"
         )
 
-        await update.message.reply_text(settings_message)
+        await self.reply(update, settings_message)
+
+    def collect_message(self, update: object) -> None:
+        """
+        Запомнить текстовое сообщение сразу при поступлении.
+
+        Обновления чата обрабатываются по очереди, поэтому пачку сообщений
+        нужно собирать до того, как обработчик первого из них начнет ждать.
+        """
+        if not self.bot_instance.debounce_seconds or not isinstance(update, Update):
+            return
+        if not self.message_filter.check_update(update):
+            return
+
+        burst_key = self._burst_key(update)
+        self._bursts.setdefault(burst_key, []).append(update.message)
+        self._burst_received_at[burst_key] = time.monotonic()
+
+    @staticmethod
+    def _burst_key(update: Update) -> Tuple[int, Optional[int]]:
+        """
+        Пачка сообщений - чат и отправитель: в группе сообщения разных
+        пользователей не объединяются в один запрос
+        """
+        user = update.effective_user
+        return update.effective_chat.id, user.id if user else None
+
+    async def take_burst(self, update: Update) -> Optional[str]:
+        """
+        Дождаться окончания пачки сообщений отправителя в чате и забрать
+        ее целиком
+
+        Returns:
+            Объединенный текст пачки или None, если сообщение уже вошло
+            в пачку, на которую ответил предыдущий обработчик
+        """
+        chat_id = update.effective_chat.id
+        key = (chat_id, update.message.message_id)
+        if key in self._merged:
+            self._merged.discard(key)
+            return None
+
+        burst_key = self._burst_key(update)
+        burst = self._bursts.get(burst_key)
+        if burst is None or update.message not in burst:
+            return update.message.text
+
+        try:
+            # Ждем, пока в течение окна не перестанут приходить новые сообщения
+            while True:
+                delay = (
+                    self._burst_received_at[burst_key]
+                    + self.bot_instance.debounce_seconds
+                    - time.monotonic()
+                )
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            burst = self._bursts[burst_key]
+        finally:
+            # Пачка прерванного обработчика не должна войти в следующую:
+            # ее сообщения ответят их собственные обработчики
+            self._bursts.pop(burst_key, None)
+            self._burst_received_at.pop(burst_key, None)
+
+        self._merged.update(
+            (chat_id, message.message_id)
+            for message in burst
+            if message.message_id != update.message.message_id
+        )
+        self.coalesced_messages += len(burst) - 1
+        return "\n".join(message.text for message in burst)
 
     async def handle_message(self, update: Update, context) -> None:
         """Обработчик текстовых сообщений"""
         try:
+            # Сообщения, присланные подряд, объединяются в один запрос
+            user_message = await self.take_burst(update)
+            if user_message is None:
+                return
+
             # Показываем индикатор "печатает..."
             await context.bot.send_chat_action(
                 chat_id=update.effective_chat.id, action="typing"
             )
 
-            user = self.get_or_create_telegram_user(update.effective_user)
-            conversation = self.get_or_create_conversation(user)
+            user, conversation = await self.db.run(
+                self.load_user_conversation, update.effective_user
+            )
 
-            user_message = update.message.text
             logger.info(f"Received message from {user}: {user_message[:50]}...")
 
-            # Добавляем сообщение пользователя в диалог
-            conversation.add_message("user", user_message)
+            # Добавляем сообщение пользователя в диалог и получаем сообщения для GPT
+            messages = await self.db.run(
+                self.add_user_message, conversation, user_message
+            )
 
-            # Получаем сообщения для GPT
-            messages = conversation.get_openai_messages()
+            # Частый вопрос - ответ из базы знаний бота без запроса к GPT
+            gpt_response = await self.db.run(self.answer_from_faq, user_message)
 
-            # Отправляем запрос к GPT
-            gpt_response = self.gpt_service.generate_response(
-                messages=messages,
-                model=self.bot_instance.gpt_model,
-                max_tokens=self.bot_instance.max_tokens,
-                temperature=self.bot_instance.temperature,
-            )
+            # Отправляем запрос к GPT (не блокируя остальных ботов)
+            placeholder = None
+            if gpt_response is None and self.bot_instance.stream_responses:
+                (placeholder,) = await self.reply(update, "…")
+                gpt_response = await self.stream_response(placeholder, messages)
+            elif gpt_response is None:
+                gpt_response = await self.gpt_service.agenerate_response(
+                    messages=messages,
+                    model=self.bot_instance.gpt_model,
+                    max_tokens=self.bot_instance.max_tokens,
+                    temperature=self.bot_instance.temperature,
+                    max_context_tokens=self.bot_instance.get_max_context_tokens(),
+                    timeout=self.bot_instance.gpt_timeout,
+                    max_retries=self.bot_instance.gpt_max_retries,
+                    fallback_models=self.bot_instance.get_gpt_fallback_models(),
+                    hedge_after=self.bot_instance.gpt_hedge_after,
+                    routing=self.bot_instance.get_gpt_routing(),
+                )
 
             if gpt_response["success"]:
                 # Успешный ответ от GPT
                 bot_message = gpt_response["content"]
 
-                # Добавляем ответ бота в диалог
-                conversation.add_message("assistant", bot_message)
-
-                # Обновляем счетчик токенов
-                conversation.total_tokens += gpt_response["usage"]["total_tokens"]
-                conversation.save()
+                # Добавляем ответ бота в диалог и обновляем счетчик токенов
+                summary_end = await self.db.run(
+                    self.save_assistant_message,
+                    conversation,
+                    bot_message,
+                    gpt_response["usage"],
+                )
+                if summary_end is not None:
+                    self.schedule_summary(conversation, summary_end)
 
-                # Отправляем ответ пользователю
-                await update.message.reply_text(bot_message)
+                # Отправляем ответ пользователю (длинный - несколькими сообщениями)
+                if placeholder:
+                    await self.finish_stream_message(placeholder, bot_message)
+                else:
+                    await self.reply(update, bot_message)
 
                 logger.info(f"Sent GPT response to {user}: {bot_message[:50]}...")
                 logger.info(f"Tokens used: {gpt_response['usage']['total_tokens']}")
@@ -192,116 +424,736 @@ class TelegramBotService:
             else:
                 # Ошибка от GPT
                 error_message = f"❌ {gpt_response['message']}"
-                await update.message.reply_text(error_message)
+                if placeholder:
+                    await self.finish_stream_message(placeholder, error_message)
+                else:
+                    await self.reply(update, error_message)
                 logger.error(f"GPT error for user {user}: {gpt_response}")
 
         except Exception as e:
             logger.error(f"Error handling message from {update.effective_user.id}: {e}")
-            await update.message.reply_text(
-                "😔 Произошла ошибка при обработке сообщения. Попробуйте позже."
+            await self.reply(
+                update, "😔 Произошла ошибка при обработке сообщения. Попробуйте позже."
+            )
+
+    def answer_from_faq(self, text: str) -> Optional[Dict]:
+        """
+        Ответ из базы знаний бота
+
+        Returns:
+            Результат в формате GPTService.generate_response или None,
+            если похожего вопроса в базе нет
+        """
+        match = find_faq_answer(self.bot_instance, text)
+        if match is None:
+            return None
+        return {
+            "success": True,
+            "content": match.answer,
+            "model": "faq",
+            # Ответ не стоил токенов; completion_tokens - его размер в истории
+            "usage": {
+                "prompt_tokens": 0,
+                "completion_tokens": count_tokens(
+                    match.answer, self.bot_instance.gpt_model
+                ),
+                "total_tokens": 0,
+            },
+        }
+
+    def schedule_summary(self, conversation: Conversation, end: int) -> None:
+        """Запустить сжатие истории диалога в фоне, не задерживая ответ"""
+        if conversation.id in self._summary_tasks:
+            return
+
+        task = asyncio.create_task(self.summarize_conversation(conversation, end))
+        self._summary_tasks[conversation.id] = task
+        task.add_done_callback(lambda _: self._summary_tasks.pop(conversation.id, None))
+
+    async def summarize_conversation(self, conversation: Conversation, end: int):
+        """
+        Свернуть сообщения диалога до end в краткое содержание
+
+        Args:
+            conversation: Диалог
+            end: Индекс, до которого сообщения войдут в пересказ
+        """
+        start = conversation.summarized_count
+        generation = conversation.history_generation
+        try:
+            result = await self.gpt_service.asummarize(
+                conversation.summary,
+                conversation.messages[start:end],
+                model=self.bot_instance.gpt_model,
+                max_tokens=self.bot_instance.get_summary_max_tokens(),
+                timeout=self.bot_instance.gpt_timeout,
+                max_retries=self.bot_instance.gpt_max_retries,
+            )
+            if not result["success"]:
+                logger.warning(
+                    f"Failed to summarize conversation {conversation.id}: {result}"
+                )
+                return
+
+            saved = await self.db.run(
+                conversation.apply_summary,
+                result["content"],
+                result["usage"]["completion_tokens"],
+                start,
+                end,
+                generation,
+            )
+            await self.db.run(conversation.add_usage, result["usage"]["total_tokens"])
+            if saved:
+                self.summaries_created += 1
+                logger.info(
+                    f"Conversation {conversation.id}: messages {start}-{end} "
+                    f"summarized ({result['usage']['total_tokens']} tokens)"
+                )
+        except Exception as e:
+            logger.error(f"Error summarizing conversation {conversation.id}: {e}")
+
+    async def stream_response(self, placeholder: Message, messages: List[Dict]) -> Dict:
+        """
+        Потоковый ответ GPT с постепенным обновлением сообщения
+
+        Args:
+            placeholder: Отправленное сообщение-заглушка
+            messages: Сообщения для GPT
+
+        Returns:
+            Результат в формате GPTService.generate_response
+        """
+        text = ""
+        shown = ""
+        next_edit_at = time.monotonic() + self.stream_edit_interval
+        result = None
+
+        async for event in self.gpt_service.astream_response(
+            messages=messages,
+            model=self.bot_instance.gpt_model,
+            max_tokens=self.bot_instance.max_tokens,
+            temperature=self.bot_instance.temperature,
+            max_context_tokens=self.bot_instance.get_max_context_tokens(),
+            timeout=self.bot_instance.gpt_timeout,
+            max_retries=self.bot_instance.gpt_max_retries,
+            fallback_models=self.bot_instance.get_gpt_fallback_models(),
+            routing=self.bot_instance.get_gpt_routing(),
+        ):
+            if event["type"] == "result":
+                result = event["result"]
+                break
+
+            text += event["content"]
+            now = time.monotonic()
+            if now >= next_edit_at and text.strip() != shown:
+                # Правки сообщения ограничены Telegram, поэтому обновляем
+                # его пачками не чаще stream_edit_interval. Правка идет через
+                # очередь чата и при 429 дожидается разрешенного момента
+                await self.edit_stream_message(
+                    placeholder, text.rstrip()[: TELEGRAM_MESSAGE_LIMIT - 2] + " …"
+                )
+                shown = text.strip()
+                next_edit_at = time.monotonic() + self.stream_edit_interval
+
+        return result
+
+    async def edit_stream_message(self, message: Message, text: str) -> None:
+        """
+        Обновить текст сообщения потокового ответа
+
+        Args:
+            message: Редактируемое сообщение
+            text: Новый текст (не длиннее лимита Telegram)
+        """
+        try:
+            await self.outbound.edit_text(message, text)
+        except BadRequest as e:
+            # Текст не изменился - это не ошибка
+            if "not modified" not in str(e).lower():
+                raise
+
+    async def finish_stream_message(self, message: Message, text: str) -> None:
+        """
+        Итоговая правка потокового ответа: первая часть текста заменяет
+        заглушку, остальные отправляются отдельными сообщениями
+        """
+        first, *rest = split_message(text)
+        bot = message.get_bot()
+        # Все части сразу встают в очередь чата и уходят по порядку
+        await asyncio.gather(
+            self.edit_stream_message(message, first),
+            *(self.outbound.send_text(bot, message.chat_id, chunk) for chunk in rest),
+        )
+
+    def apply_config(self, values: Optional[Dict]) -> None:
+        """
+        Применить новые настройки бота из канала изменений
+
+        Args:
+            values: Новые значения полей или None, если бот удален
+        """
+        if values is None:
+            logger.info(f"Bot '{self.bot_instance.name}' was deleted, stopping")
+            self.request_stop()
+            return
+
+        changed = [
+            field
+            for field, value in values.items()
+            if getattr(self.bot_instance, field) != value
+        ]
+        for field, value in values.items():
+            setattr(self.bot_instance, field, value)
+
+        logger.info(f"Bot '{self.bot_instance.name}' config reloaded: {changed}")
+        self.gpt_service.weight = self.bot_instance.gpt_weight
+
+        if {"telegram_token", "gpt_api_key", "gpt_api_keys"} & set(changed):
+            # Новые ключи требуют пересоздания клиентов - менеджер перезапустит бота
+            logger.info(
+                f"Bot '{self.bot_instance.name}' credentials changed, restarting"
+            )
+            self.restart_requested = True
+            self.request_stop()
+            return
+
+        if not self.bot_instance.is_active:
+            logger.info(f"Bot '{self.bot_instance.name}' was deactivated, stopping")
+            self.request_stop()
+
+    def request_stop(self) -> None:
+        """Попросить цикл работы бота завершиться"""
+        if self._stop_event:
+            self._stop_event.set()
+
+    async def process_webhook_update(self, data: Dict) -> bool:
+        """
+        Передать обновление из webhook в очередь Application
+
+        Args:
+            data: JSON обновления Telegram
+
+        Returns:
+            False, если бот не запущен
+        """
+        if not self.is_running or not self.application:
+            return False
+
+        update = Update.de_json(data, self.application.bot)
+        # Telegram может доставить обновление повторно
+        if self.offsets.should_process(update.update_id, update):
+            await self.application.update_queue.put(update)
+        return True
+
+    def complete_update(self, update: object) -> None:
+        """Отметить обновление как обработанное"""
+        if self.offsets and isinstance(update, Update):
+            self.offsets.complete(update.update_id)
+
+    async def poll_updates(self) -> None:
+        """
+        Получение обновлений через getUpdates.
+
+        Полученные обновления сразу подтверждаются следующим запросом,
+        поэтому долгая обработка одного из них не мешает получать
+        остальные. Необработанные обновления сохраняются в позиции бота и
+        обрабатываются после перезапуска, уже обработанные при повторном
+        получении пропускаются. Пока бот обрабатывает max_pending_updates
+        обновлений, новые не запрашиваются.
+        """
+        bot = self.application.bot
+        await bot.delete_webhook(drop_pending_updates=False)
+
+        errors = 0
+        # None - с первого неподтвержденного: после пустого ответа все
+        # полученные уже подтверждены, а ID после недели без обновлений
+        # Telegram выбирает случайно и они могут оказаться меньше прежних
+        offset = None
+        while self.is_running:
+            if self.offsets.in_flight >= self.max_pending_updates:
+                await self.offsets.wait_for_progress(1.0)
+                continue
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=self.poll_timeout,
+                    allowed_updates=["message", "callback_query"],
+                )
+                errors = 0
+            except InvalidToken as e:
+                logger.error(f"Bot '{self.bot_instance.name}' token is invalid: {e}")
+                self.request_stop()
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(get_retry_after(e))
+                continue
+            except TelegramError as e:
+                errors += 1
+                delay = min(30, 2**errors)
+                logger.warning(
+                    f"Error polling updates for bot '{self.bot_instance.name}': "
+                    f"{e}, retrying in {delay}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            offset = max(u.update_id for u in updates) + 1 if updates else None
+            for update in updates:
+                if self.offsets.should_process(update.update_id, update):
+                    await self.application.update_queue.put(update)
+
+    async def replay_pending_updates(self) -> None:
+        """Обработать обновления, не обработанные до прошлой остановки"""
+        pending = self.offsets.take_pending()
+        if pending:
+            logger.info(
+                f"Bot '{self.bot_instance.name}': replaying {len(pending)} updates"
             )
+        for data in pending:
+            update = Update.de_json(data, self.application.bot)
+            if self.offsets.should_process(update.update_id, update):
+                await self.application.update_queue.put(update)
 
     async def start_polling(self):
         """Запуск polling режима"""
+        await self.run()
+
+    async def start_webhook(
+        self, webhook_server: WebhookServer, webhook_url: Optional[str] = None
+    ):
+        """
+        Запуск в режиме webhook через общий HTTP сервер
+
+        Args:
+            webhook_server: Общий сервер приема обновлений
+            webhook_url: Публичный адрес сервера. Если не указан, webhook
+                в Telegram не регистрируется (локальная отладка)
+        """
+        await self.run(webhook_server, webhook_url)
+
+    async def run(
+        self,
+        webhook_server: Optional[WebhookServer] = None,
+        webhook_url: Optional[str] = None,
+    ):
+        """Запуск бота в режиме polling или webhook"""
         if self.is_running:
             logger.warning(f"Bot {self.bot_instance.name} is already running")
             return
 
+        mode = "webhook" if webhook_server else "polling"
+        started_at = time.monotonic()
         try:
             await self.setup_application()
 
-            logger.info(f"Starting bot '{self.bot_instance.name}' in polling mode...")
+            logger.info(f"Starting bot '{self.bot_instance.name}' in {mode} mode...")
             self.is_running = True
+            self._stop_event = asyncio.Event()
+            if self.config_watcher:
+                self.config_watcher.subscribe(self.bot_instance, self.apply_config)
 
-            # Запускаем polling
             await self.application.initialize()
+            # Продолжаем с сохраненной позиции обработанных обновлений
+            self.offsets = await self.offset_store.acquire(self.bot_instance.id)
             await self.application.start()
-            await self.application.updater.start_polling(
-                drop_pending_updates=True, allowed_updates=["message", "callback_query"]
-            )
+            await self.replay_pending_updates()
 
-            logger.info(f"Bot '{self.bot_instance.name}' started successfully")
+            if webhook_server is None:
+                # Запускаем polling
+                self._poll_task = asyncio.create_task(self.poll_updates())
+            else:
+                # Регистрируем маршрут в общем HTTP сервере
+                self.webhook_server = webhook_server
+                path = webhook_server.register(self)
+                if webhook_url:
+                    await self.application.bot.set_webhook(
+                        url=webhook_url.rstrip("/") + path,
+                        secret_token=self.webhook_secret,
+                        allowed_updates=["message", "callback_query"],
+                    )
+                else:
+                    logger.info(
+                        f"Bot '{self.bot_instance.name}' webhook path (local): {path}"
+                    )
 
-            # Ждем пока бот работает
-            while self.is_running and self.bot_instance.is_active:
-                await asyncio.sleep(1)
+            self.startup_ms = round((time.monotonic() - started_at) * 1000, 1)
+            logger.info(
+                f"Bot '{self.bot_instance.name}' started successfully "
+                f"in {self.startup_ms} ms"
+            )
 
-                # Обновляем данные бота из БД
-                self.bot_instance.refresh_from_db()
+            # Ждем пока бот работает. Настройки обновляются через канал
+            # изменений, без опроса БД
+            if self.is_running and self.bot_instance.is_active:
+                await self._stop_event.wait()
 
         except Exception as e:
             logger.error(f"Error starting bot {self.bot_instance.name}: {e}")
-            self.is_running = False
         finally:
             await self.stop_polling()
 
-    async def stop_polling(self):
-        """Остановка polling режима"""
+    async def drain_updates(self, deadline: float) -> None:
+        """
+        Дождаться обработки принятых обновлений, а не успевшие до deadline
+        прервать. Прерванные обновления не отмечаются обработанными и будут
+        обработаны после перезапуска
+        """
+        queue = self.application.update_queue
+        # Принятые обновления учитываются с момента извлечения из очереди:
+        # задача обновления попадает в обработчик позже
+        pending = queue.accepted + queue.qsize()
+        if pending:
+            logger.info(
+                f"Bot '{self.bot_instance.name}': waiting for {pending} updates"
+            )
+
+        while queue.accepted or queue.qsize():
+            if time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(0.05)
+
+        # Даем созданным задачам обновлений попасть в обработчик,
+        # чтобы прервать и их
+        await asyncio.sleep(0)
+        abandoned = self.update_processor.cancel_all()
+        while not queue.empty():
+            queue.get_nowait()
+            queue.task_done()
+            abandoned += 1
+
+        self.abandoned_updates += abandoned
+        self.drained_updates += max(0, pending - abandoned)
+
+    async def stop_polling(self, deadline: Optional[float] = None):
+        """
+        Остановка бота
+
+        Args:
+            deadline: Момент (time.monotonic()), до которого можно ждать
+                обработки принятых обновлений. По умолчанию - через
+                TELEGRAM_SHUTDOWN_TIMEOUT секунд
+        """
         if not self.is_running:
             return
 
         logger.info(f"Stopping bot '{self.bot_instance.name}'...")
         self.is_running = False
+        self.request_stop()
+        if self.config_watcher:
+            self.config_watcher.unsubscribe(self.bot_instance.id)
+        if self.webhook_server:
+            self.webhook_server.unregister(self)
+
+        # Сначала перестаем принимать новые обновления
+        if self._poll_task:
+            self._poll_task.cancel()
+            await asyncio.gather(self._poll_task, return_exceptions=True)
+
+        if self.application and self.application.running:
+            if deadline is None:
+                deadline = time.monotonic() + self.shutdown_timeout
+            await self.drain_updates(deadline)
 
         if self.application:
             try:
-                await self.application.updater.stop()
-                await self.application.stop()
+                if self.application.running:
+                    await self.application.stop()
                 await self.application.shutdown()
             except Exception as e:
                 logger.error(f"Error stopping bot {self.bot_instance.name}: {e}")
 
-        logger.info(f"Bot '{self.bot_instance.name}' stopped")
+        if self.offsets:
+            try:
+                await self.offset_store.release(self.offsets)
+            except Exception as e:
+                logger.error(
+                    f"Error saving update offset of bot {self.bot_instance.name}: {e}"
+                )
+
+        # Несохраненное сжатие повторится после следующего ответа
+        for task in list(self._summary_tasks.values()):
+            task.cancel()
+
+        logger.info(
+            f"Bot '{self.bot_instance.name}' stopped "
+            f"(drained {self.drained_updates}, abandoned {self.abandoned_updates})"
+        )
 
 
 class TelegramBotManager:
     """Менеджер для управления несколькими Telegram ботами"""
 
-    def __init__(self):
+    def __init__(self, db_executor: Optional[DatabaseExecutor] = None):
         self.bot_services: Dict[int, TelegramBotService] = {}
         self.is_running = False
+        self.db = db_executor or get_db_executor()
+        self.config_watcher = BotConfigWatcher(self.db)
+        self.update_limiter = UpdateConcurrencyLimiter()
+        self.outbound = OutboundQueue()
+        self.offset_store = UpdateOffsetStore(self.db)
+        self.webhook_server: Optional[WebhookServer] = None
+        self.webhook_url: Optional[str] = None
+        self.bot_ids: Optional[List[int]] = None
+        self.shard: Optional[Tuple[int, int]] = None
+        self.metrics_interval = getattr(settings, "TELEGRAM_METRICS_INTERVAL", 60)
+        self.faq_stats_interval = getattr(settings, "FAQ_STATS_FLUSH_INTERVAL", 10)
+        self.reconcile_interval = getattr(settings, "TELEGRAM_RECONCILE_INTERVAL", 30)
+        self.max_restart_delay = 300
+        self.shutdown_timeout = getattr(settings, "TELEGRAM_SHUTDOWN_TIMEOUT", 25)
+        self.drained_updates = 0
+        self.abandoned_updates = 0
+        self._tasks: Dict[int, asyncio.Task] = {}
+        # bot_id -> (количество неудачных запусков, время следующей попытки)
+        self._failures: Dict[int, Tuple[int, float]] = {}
+        self._reconcile_event: Optional[asyncio.Event] = None
+
+    async def start_all_bots(
+        self,
+        bot_ids: Optional[List[int]] = None,
+        webhook_server: Optional[WebhookServer] = None,
+        webhook_url: Optional[str] = None,
+        shard: Optional[Tuple[int, int]] = None,
+    ):
+        """
+        Запуск всех активных ботов и поддержание их набора в актуальном
+        состоянии до вызова stop_all_bots
 
-    async def start_all_bots(self):
-        """Запуск всех активных ботов"""
+        Args:
+            bot_ids: Ограничить запуск указанными ботами
+            webhook_server: Общий сервер приема обновлений (режим webhook).
+                Если не указан, каждый бот работает в polling режиме
+            webhook_url: Публичный адрес webhook сервера
+            shard: Пара (номер, количество) - запускать только ботов шарда
+        """
         if self.is_running:
             logger.warning("Bot manager is already running")
             return
 
         self.is_running = True
-        active_bots = Bot.objects.filter(is_active=True)
+        self.bot_ids = bot_ids
+        self.shard = shard
+        self.webhook_server = webhook_server
+        self.webhook_url = webhook_url
+        self._reconcile_event = asyncio.Event()
+        self.config_watcher.add_listener(self._reconcile_event.set)
+
+        metrics_task = asyncio.create_task(self.report_metrics())
+        faq_stats_task = asyncio.create_task(self.save_faq_stats())
+        watcher_task = asyncio.create_task(self.config_watcher.run())
+        offsets_task = asyncio.create_task(self.offset_store.run())
+
+        try:
+            while self.is_running:
+                try:
+                    await self.reconcile()
+                except Exception as e:
+                    logger.error(f"Error reconciling bots: {e}")
+
+                try:
+                    await asyncio.wait_for(
+                        self._reconcile_event.wait(), self.reconcile_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                self._reconcile_event.clear()
+        finally:
+            metrics_task.cancel()
+            faq_stats_task.cancel()
+            watcher_task.cancel()
+            offsets_task.cancel()
+            self.config_watcher.remove_listener(self._reconcile_event.set)
+            self.is_running = False
+            logger.info("All bots stopped")
+
+    def get_desired_bots(self) -> Set[int]:
+        """ID активных ботов, которые должен обслуживать процесс"""
+        queryset = Bot.objects.filter(is_active=True)
+        if self.bot_ids is not None:
+            queryset = queryset.filter(id__in=self.bot_ids)
+
+        desired = set(queryset.values_list("id", flat=True))
+        if self.shard:
+            index, count = self.shard
+            desired = {
+                bot_id for bot_id in desired if shard_for_bot(bot_id, count) == index
+            }
+        return desired
+
+    async def reconcile(self) -> None:
+        """Привести набор запущенных ботов в соответствие с БД"""
+        desired = await self.db.run(self.get_desired_bots)
+        now = time.monotonic()
+
+        # Убираем завершившиеся сервисы и останавливаем лишние
+        for bot_id, service in list(self.bot_services.items()):
+            task = self._tasks.get(bot_id)
+            if task is not None and task.done():
+                del self.bot_services[bot_id]
+                del self._tasks[bot_id]
+                if service.restart_requested:
+                    self._failures.pop(bot_id, None)
+                elif bot_id in desired:
+                    # Бот должен работать, но упал - повторяем с задержкой
+                    failures = self._failures.get(bot_id, (0, 0.0))[0] + 1
+                    delay = min(self.max_restart_delay, 2**failures)
+                    self._failures[bot_id] = (failures, now + delay)
+                    logger.error(
+                        f"Bot '{service.bot_instance.name}' stopped unexpectedly, "
+                        f"retrying in {delay}s"
+                    )
+            elif bot_id not in desired:
+                logger.info(f"Bot '{service.bot_instance.name}' is no longer active")
+                service.request_stop()
+
+        # Запускаем новых ботов
+        new_ids = [
+            bot_id
+            for bot_id in desired
+            if bot_id not in self.bot_services
+            and self._failures.get(bot_id, (0, 0.0))[1] <= now
+        ]
+        if not new_ids:
+            return
 
-        logger.info(f"Starting {active_bots.count()} active bots...")
+        new_bots = await self.db.run(list, Bot.objects.filter(id__in=new_ids))
+        logger.info(f"Starting {len(new_bots)} bots...")
+        for bot in new_bots:
+            self.start_bot(bot)
 
-        # Создаем задачи для каждого бота
-        tasks = []
-        for bot in active_bots:
+    def start_bot(self, bot: Bot) -> None:
+        """Запуск сервиса одного бота"""
+        try:
+            service = TelegramBotService(
+                bot,
+                db_executor=self.db,
+                config_watcher=self.config_watcher,
+                update_limiter=self.update_limiter,
+                outbound=self.outbound,
+                offset_store=self.offset_store,
+            )
+        except Exception as e:
+            failures = self._failures.get(bot.id, (0, 0.0))[0] + 1
+            delay = min(self.max_restart_delay, 2**failures)
+            self._failures[bot.id] = (failures, time.monotonic() + delay)
+            logger.error(f"Failed to start bot {bot.name}: {e}")
+            return
+
+        self.bot_services[bot.id] = service
+        if self.webhook_server:
+            coroutine = service.start_webhook(self.webhook_server, self.webhook_url)
+        else:
+            coroutine = service.start_polling()
+        task = asyncio.create_task(coroutine)
+        task.add_done_callback(lambda _: self._reconcile_event.set())
+        self._tasks[bot.id] = task
+
+    def get_metrics(self) -> Dict:
+        """Текущие метрики раннера"""
+        metrics = {
+            "running_bots": len(self.bot_services),
+            "bots": {
+                bot_id: {
+                    "name": service.bot_instance.name,
+                    "running": service.is_running,
+                    "startup_ms": service.startup_ms,
+                    "active_chats": service.update_processor.active_chats,
+                    "coalesced_messages": service.coalesced_messages,
+                    "summaries_created": service.summaries_created,
+                    "hedging": service.gpt_service.hedge_stats,
+                    "routing": service.gpt_service.router.get_stats(),
+                    "faq": get_faq_index(bot_id).get_stats(),
+                }
+                for bot_id, service in self.bot_services.items()
+            },
+            "failing_bots": [
+                bot_id for bot_id in self._failures if bot_id not in self.bot_services
+            ],
+            "updates": self.update_limiter.get_stats(),
+            "coalesced_messages": sum(
+                service.coalesced_messages for service in self.bot_services.values()
+            ),
+            "outbound": self.outbound.get_stats(),
+            "update_offsets": self.offset_store.get_stats(),
+            "token_cache": get_token_counter().get_stats(),
+            "openai_clients": get_client_registry().get_stats(),
+            "circuit_breakers": get_circuit_stats(),
+            "openai_rate_limits": get_api_rate_limit_stats(),
+            "gpt_scheduler": get_gpt_scheduler().get_stats(),
+            "openai_keys": get_key_stats(),
+            "scenario_response_cache": get_response_cache().get_stats(),
+            "single_flight": get_single_flight().get_stats(),
+            "db_pool": self.db.get_stats(),
+        }
+        if self.webhook_server:
+            metrics["webhook"] = self.webhook_server.get_stats()
+        return metrics
+
+    async def report_metrics(self):
+        """Периодически пишет метрики раннера в лог"""
+        if not self.metrics_interval:
+            return
+
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            metrics = self.get_metrics()
+            db_stats = metrics["db_pool"]
+            if db_stats["queued"] > 0:
+                logger.warning(f"DB pool saturated: {db_stats}")
+            logger.info(f"Runner metrics: {metrics}")
+
+    async def save_faq_stats(self):
+        """Периодически записывает счетчики баз знаний в БД"""
+        while True:
+            await asyncio.sleep(self.faq_stats_interval)
             try:
-                service = TelegramBotService(bot)
-                self.bot_services[bot.id] = service
-                task = asyncio.create_task(service.start_polling())
-                tasks.append(task)
+                await self.db.run(flush_faq_stats)
             except Exception as e:
-                logger.error(f"Failed to start bot {bot.name}: {e}")
-
-        if tasks:
-            # Ждем завершения всех задач
-            await asyncio.gather(*tasks, return_exceptions=True)
+                logger.error(f"Error saving FAQ stats: {e}")
 
+    def request_shutdown(self) -> None:
+        """Попросить раннер завершить работу (например, по сигналу)"""
         self.is_running = False
-        logger.info("All bots stopped")
+        if self._reconcile_event:
+            self._reconcile_event.set()
 
-    async def stop_all_bots(self):
-        """Остановка всех ботов"""
+    async def stop_all_bots(self, timeout: Optional[float] = None):
+        """
+        Остановка всех ботов
+
+        Новые обновления перестают приниматься, а уже принятые
+        дообрабатываются в течение общего для всех ботов таймаута
+
+        Args:
+            timeout: Сколько ждать обработки принятых обновлений, секунды.
+                По умолчанию - TELEGRAM_SHUTDOWN_TIMEOUT
+        """
         logger.info("Stopping all bots...")
-        self.is_running = False
+        self.request_shutdown()
+        if timeout is None:
+            timeout = self.shutdown_timeout
+        deadline = time.monotonic() + timeout
 
         # Останавливаем все сервисы
-        stop_tasks = []
-        for service in self.bot_services.values():
-            stop_tasks.append(service.stop_polling())
+        services = list(self.bot_services.values())
+        if services:
+            await asyncio.gather(
+                *(service.stop_polling(deadline) for service in services),
+                return_exceptions=True,
+            )
 
-        if stop_tasks:
-            await asyncio.gather(*stop_tasks, return_exceptions=True)
+        self.drained_updates += sum(s.drained_updates for s in services)
+        self.abandoned_updates += sum(s.abandoned_updates for s in services)
 
         self.bot_services.clear()
-        logger.info("All bots stopped")
+        self._tasks.clear()
+        try:
+            await self.db.run(flush_faq_stats)
+        except Exception as e:
+            logger.error(f"Error saving FAQ stats: {e}")
+        # Клиенты OpenAI общие для всех ботов - закрываем после остановки всех
+        await get_client_registry().aclose()
+        logger.info(
+            f"All bots stopped: {self.drained_updates} updates drained, "
+            f"{self.abandoned_updates} abandoned"
+        )
@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+import tiktoken
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Кодировки tiktoken по моделям. None - модель неизвестна tiktoken
+_encodings: Dict[str, Optional[tiktoken.Encoding]] = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    """
+    Кодировка tiktoken для модели.
+
+    Загружается один раз на процесс: encoding_for_model каждый раз
+    ищет модель в реестре и заново собирает объект кодировки.
+    """
+    try:
+        return _encodings[model]
+    except KeyError:
+        pass
+
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                logger.warning(f"No tiktoken encoding for model {model}")
+                _encodings[model] = None
+            except Exception as e:
+                # Например, файл кодировки не скачался - попробуем позже
+                logger.warning(f"Error loading tiktoken encoding for {model}: {e}")
+                return None
+        return _encodings[model]
+
+
+class TokenCounter:
+    """
+    Подсчет токенов с LRU кешем результатов.
+
+    Ключ кеша - кодировка и хеш содержимого, поэтому неизменные строки
+    (системные промпты, сообщения истории) токенизируются один раз, а
+    память кеша не зависит от длины текстов.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        """
+        Инициализация счетчика
+
+        Args:
+            max_size: Максимум запомненных строк. Если не указан,
+                используется TOKEN_COUNT_CACHE_SIZE
+        """
+        self.max_size = max_size or getattr(settings, "TOKEN_COUNT_CACHE_SIZE", 10000)
+        self._cache: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text: str, model: str = "gpt-3.5-turbo") -> int:
+        """
+        Количество токенов в тексте
+
+        Args:
+            text: Текст для подсчета
+            model: Модель GPT
+
+        Returns:
+            Количество токенов
+        """
+        encoding = get_encoding(model)
+        if encoding is None:
+            # Приблизительная оценка: 1 токен ≈ 4 символа
+            return len(text) // 4
+
+        key = (
+            encoding.name,
+            hashlib.blake2b(text.encode(), digest_size=16).digest(),
+        )
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return tokens
+
+        tokens = len(encoding.encode(text))
+
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = tokens
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def clear(self) -> None:
+        """Очистить кеш"""
+        with self._lock:
+            self._cache.clear()
+
+    def get_stats(self) -> Dict:
+        """Статистика кеша"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+_token_counter: Optional[TokenCounter] = None
+_token_counter_lock = threading.Lock()
+
+
+def get_token_counter() -> TokenCounter:
+    """Общий для процесса счетчик токенов"""
+    global _token_counter
+    with _token_counter_lock:
+        if _token_counter is None:
+            _token_counter = TokenCounter()
+        return _token_counter
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Количество токенов в тексте (через общий кеш процесса)"""
+    return get_token_counter().count(text, model)
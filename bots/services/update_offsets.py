@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Set
+from django.conf import settings
+from .db_executor import DatabaseExecutor, get_db_executor
+
+logger = logging.getLogger(__name__)
+
+# Telegram выбирает ID следующего обновления случайно, если обновлений
+# не было неделю. ID намного меньше сохраненной позиции означает такой
+# сброс, а не повтор старого обновления
+UPDATE_ID_RESET_GAP = 100_000
+
+
+class UpdateOffsetTracker:
+    """
+    Учет обработанных обновлений одного бота.
+
+    Обновления разных чатов завершаются не по порядку, поэтому позиция
+    (last_update_id) сдвигается только до первого еще обрабатываемого
+    обновления. Завершенные обновления после нее хранятся отдельно,
+    чтобы после перезапуска не обработать их повторно, а принятые, но
+    не обработанные - вместе с содержимым, чтобы обработать их после
+    перезапуска: Telegram их уже не вернет.
+    """
+
+    def __init__(
+        self,
+        bot_id: int,
+        last_update_id: int = 0,
+        completed_ids: Iterable[int] = (),
+        pending_updates: Iterable[Dict] = (),
+    ):
+        self.bot_id = bot_id
+        self.last_update_id = last_update_id
+        self._completed: Set[int] = {i for i in completed_ids if i > last_update_id}
+        # ID обрабатываемого обновления -> обновление (для сохранения)
+        self._in_flight: Dict[int, object] = {}
+        self._pending: List[Dict] = list(pending_updates)
+        self._progress = asyncio.Event()
+        self.dirty = False
+        self.duplicates = 0
+        self.resets = 0
+
+    def should_process(self, update_id: int, update: object = None) -> bool:
+        """
+        Проверить, нужно ли обрабатывать обновление, и отметить его как
+        принятое в обработку
+
+        Args:
+            update_id: ID обновления
+            update: Обновление (telegram.Update). Сохраняется до конца
+                обработки, чтобы повторить ее после перезапуска
+
+        Returns:
+            False для уже обработанных или обрабатываемых обновлений
+        """
+        if update_id in self._in_flight:
+            # Повторно получено обновление, которое еще обрабатывается
+            return False
+        if update_id + UPDATE_ID_RESET_GAP < self.last_update_id:
+            self._reset(update_id)
+        elif update_id <= self.last_update_id or update_id in self._completed:
+            self.duplicates += 1
+            return False
+
+        self._in_flight[update_id] = update
+        self.dirty = True
+        return True
+
+    def _reset(self, update_id: int) -> None:
+        """Начать учет заново после сброса ID обновлений в Telegram"""
+        logger.warning(
+            f"Update IDs of bot {self.bot_id} restarted at {update_id} "
+            f"(last processed {self.last_update_id}), resetting offset"
+        )
+        self.last_update_id = update_id - 1
+        self._completed.clear()
+        self._in_flight.clear()
+        self.resets += 1
+
+    def take_pending(self) -> List[Dict]:
+        """
+        Забрать сохраненные при остановке необработанные обновления
+
+        Returns:
+            JSON обновлений для повторной обработки
+        """
+        pending, self._pending = self._pending, []
+        return pending
+
+    def complete(self, update_id: int) -> None:
+        """Отметить обновление как обработанное"""
+        if update_id not in self._in_flight:
+            return
+
+        del self._in_flight[update_id]
+        self._completed.add(update_id)
+
+        # Сдвигаем позицию до первого незавершенного обновления
+        limit = min(self._in_flight) if self._in_flight else None
+        done = {i for i in self._completed if limit is None or i < limit}
+        if done:
+            self.last_update_id = max(self.last_update_id, max(done))
+            self._completed -= done
+
+        self.dirty = True
+        self._progress.set()
+
+    async def wait_for_progress(self, timeout: float) -> None:
+        """Дождаться завершения какого-либо обновления (не дольше timeout)"""
+        self._progress.clear()
+        try:
+            await asyncio.wait_for(self._progress.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    @property
+    def in_flight(self) -> int:
+        """Количество обновлений в обработке"""
+        return len(self._in_flight)
+
+    @property
+    def completed_ids(self) -> list:
+        """Завершенные обновления после last_update_id"""
+        return sorted(self._completed)
+
+    @property
+    def pending_updates(self) -> list:
+        """JSON принятых, но еще не обработанных обновлений"""
+        pending = [
+            update.to_dict()
+            for update in self._in_flight.values()
+            if update is not None
+        ]
+        # Еще не повторенные после перезапуска сохраняются как были
+        return pending + self._pending
+
+
+class UpdateOffsetStore:
+    """
+    Хранилище позиций обновлений ботов процесса.
+
+    Изменения копятся в памяти и записываются в BotUpdateState одним
+    запросом для всех ботов раз в flush_interval, а также при остановке бота.
+    """
+
+    def __init__(
+        self,
+        db_executor: Optional[DatabaseExecutor] = None,
+        flush_interval: Optional[float] = None,
+    ):
+        """
+        Инициализация хранилища
+
+        Args:
+            db_executor: Пул потоков для запросов к БД
+            flush_interval: Интервал записи позиций, секунды
+        """
+        self.db = db_executor or get_db_executor()
+        self.flush_interval = flush_interval or getattr(
+            settings, "TELEGRAM_OFFSET_FLUSH_INTERVAL", 1.0
+        )
+        self._trackers: Dict[int, UpdateOffsetTracker] = {}
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_flush_ms = 0.0
+
+    async def acquire(self, bot_id: int) -> UpdateOffsetTracker:
+        """Загрузить сохраненную позицию бота и начать ее учет"""
+        from ..models import BotUpdateState
+
+        state = await self.db.run(
+            lambda: BotUpdateState.objects.filter(bot_id=bot_id)
+            .values_list("last_update_id", "completed_ids", "pending_updates")
+            .first()
+        )
+        tracker = UpdateOffsetTracker(bot_id, *(state or (0, ())))
+        self._trackers[bot_id] = tracker
+        return tracker
+
+    async def release(self, tracker: UpdateOffsetTracker) -> None:
+        """Сохранить позицию бота и прекратить ее учет"""
+        try:
+            await self.flush([tracker])
+        finally:
+            if self._trackers.get(tracker.bot_id) is tracker:
+                del self._trackers[tracker.bot_id]
+
+    async def flush(self, trackers: Optional[Iterable[UpdateOffsetTracker]] = None):
+        """Записать измененные позиции в БД"""
+        from ..models import Bot, BotUpdateState
+
+        dirty = [
+            tracker
+            for tracker in (self._trackers.values() if trackers is None else trackers)
+            if tracker.dirty
+        ]
+        if not dirty:
+            return
+
+        # Снимок берется в event loop, пока позиции не изменились
+        rows = {
+            tracker.bot_id: {
+                "last_update_id": tracker.last_update_id,
+                "completed_ids": tracker.completed_ids,
+                "pending_updates": tracker.pending_updates,
+            }
+            for tracker in dirty
+        }
+        for tracker in dirty:
+            tracker.dirty = False
+
+        def write():
+            existing = set(Bot.objects.filter(id__in=rows).values_list("id", flat=True))
+            BotUpdateState.objects.bulk_create(
+                [
+                    BotUpdateState(bot_id=bot_id, **fields)
+                    for bot_id, fields in rows.items()
+                    if bot_id in existing
+                ],
+                update_conflicts=True,
+                unique_fields=["bot"],
+                update_fields=[
+                    "last_update_id",
+                    "completed_ids",
+                    "pending_updates",
+                    "updated_at",
+                ],
+            )
+            return len(existing)
+
+        started_at = time.monotonic()
+        try:
+            self.rows_written += await self.db.run(write)
+        except Exception:
+            # Не потеряем изменения - запишем при следующей попытке
+            for tracker in dirty:
+                tracker.dirty = True
+            raise
+
+        self.flushes += 1
+        self.last_flush_ms = round((time.monotonic() - started_at) * 1000, 1)
+
+    async def run(self) -> None:
+        """Периодическая запись позиций"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error saving update offsets: {e}")
+
+    def get_stats(self) -> Dict:
+        """Статистика хранилища позиций"""
+        return {
+            "bots": len(self._trackers),
+            "in_flight": sum(t.in_flight for t in self._trackers.values()),
+            "duplicates_skipped": sum(t.duplicates for t in self._trackers.values()),
+            "offset_resets": sum(t.resets for t in self._trackers.values()),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "last_flush_ms": self.last_flush_ms,
+        }
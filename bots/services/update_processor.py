@@ -0,0 +1,188 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+from django.conf import settings
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Верхняя граница для семафора PTB: реальное ограничение задает
+# общий UpdateConcurrencyLimiter
+UNBOUNDED_UPDATES = 2**16
+
+
+class UpdateConcurrencyLimiter:
+    """Общий для всех ботов процесса лимит одновременно обрабатываемых обновлений"""
+
+    def __init__(self, max_concurrency: Optional[int] = None):
+        """
+        Инициализация лимита
+
+        Args:
+            max_concurrency: Максимум одновременно обрабатываемых обновлений.
+                Если не указан, используется TELEGRAM_MAX_CONCURRENT_UPDATES
+        """
+        self.max_concurrency = max_concurrency or getattr(
+            settings, "TELEGRAM_MAX_CONCURRENT_UPDATES", 256
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_in_flight = 0
+        self.processed = 0
+
+    async def __aenter__(self):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.in_flight -= 1
+        self.processed += 1
+        self._semaphore.release()
+
+    def get_stats(self) -> Dict:
+        """Статистика обработки обновлений"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "peak_in_flight": self.peak_in_flight,
+            "processed": self.processed,
+        }
+
+
+class AcceptedUpdateQueue(asyncio.Queue):
+    """
+    Очередь обновлений Application с учетом принятых, но не обработанных.
+
+    Application забирает обновление из очереди раньше, чем его задача
+    попадает в обработчик, поэтому по размеру очереди и задачам обработчика
+    нельзя понять, что все принятые обновления обработаны. Счетчик
+    увеличивается при извлечении и уменьшается в task_done, который
+    Application вызывает после обработки обновления.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accepted = 0
+
+    def get_nowait(self):
+        item = super().get_nowait()
+        self.accepted += 1
+        return item
+
+    def task_done(self):
+        super().task_done()
+        self.accepted -= 1
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обработчик обновлений одного бота.
+
+    Обновления одного чата выполняются строго последовательно в порядке
+    поступления, разные чаты - параллельно. Суммарное количество
+    одновременно обрабатываемых обновлений ограничивает общий лимит.
+    """
+
+    def __init__(
+        self,
+        limiter: UpdateConcurrencyLimiter,
+        on_receive: Optional[Callable[[object], None]] = None,
+        on_complete: Optional[Callable[[object], None]] = None,
+    ):
+        """
+        Args:
+            limiter: Общий лимит одновременно обрабатываемых обновлений
+            on_receive: Вызывается для каждого обновления сразу при
+                поступлении, до ожидания очереди чата
+            on_complete: Вызывается после обработки обновления
+        """
+        super().__init__(max_concurrent_updates=UNBOUNDED_UPDATES)
+        self.limiter = limiter
+        self.on_receive = on_receive
+        self.on_complete = on_complete
+        # Ключ чата -> [блокировка, количество ожидающих и выполняемых]
+        self._chat_locks: Dict[Hashable, list] = {}
+        # Задачи обновлений в обработке или в очереди чата
+        self._tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def get_chat_key(update: object) -> Optional[Hashable]:
+        """Ключ очереди для обновления (None - порядок не важен)"""
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    @property
+    def active_chats(self) -> int:
+        """Количество чатов с обновлениями в обработке или в очереди"""
+        return len(self._chat_locks)
+
+    @property
+    def in_flight(self) -> int:
+        """Количество обновлений в обработке или в очереди чата"""
+        return len(self._tasks)
+
+    def cancel_all(self) -> int:
+        """
+        Прервать обработку всех обновлений
+
+        Returns:
+            Количество прерванных обновлений
+        """
+        for task in self._tasks:
+            task.cancel()
+        return len(self._tasks)
+
+    async def do_process_update(
+        self, update: object, coroutine: Awaitable[Any]
+    ) -> None:
+        if self.on_receive:
+            self.on_receive(update)
+
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            await self._process_in_order(update, coroutine)
+        finally:
+            self._tasks.discard(task)
+            # Прерванное обновление не считается обработанным
+            if self.on_complete and not task.cancelling():
+                self.on_complete(update)
+
+    async def _process_in_order(self, update: object, coroutine: Awaitable[Any]):
+        """Обработать обновление в очереди его чата"""
+        key = self.get_chat_key(update)
+        if key is None:
+            async with self.limiter:
+                await coroutine
+            return
+
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+
+        try:
+            # asyncio.Lock выдает доступ в порядке очереди ожидания
+            async with entry[0]:
+                async with self.limiter:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+from typing import Callable, Dict, Optional, Tuple
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH_PREFIX = "/telegram/"
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY_SIZE = 1024 * 1024
+# Сколько ждать запроса в открытом соединении и его заголовков и тела,
+# секунды: медленные клиенты не должны копить соединения
+READ_TIMEOUT = 30.0
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+def get_webhook_secret(telegram_token: str) -> str:
+    """
+    Секрет бота для пути webhook и заголовка X-Telegram-Bot-Api-Secret-Token
+
+    Args:
+        telegram_token: Токен Telegram бота
+
+    Returns:
+        Стабильный секрет, не раскрывающий токен
+    """
+    return hmac.new(
+        settings.SECRET_KEY.encode(), telegram_token.encode(), hashlib.sha256
+    ).hexdigest()[:32]
+
+
+class WebhookServer:
+    """
+    Общий HTTP сервер для приема webhook обновлений всех ботов.
+
+    Обновления маршрутизируются по секретному пути /telegram/<secret>
+    в сервис нужного бота. Дополнительно отдает GET /health и GET /metrics.
+    Метрики доступны только с того же хоста, а если задан metrics_token -
+    с любого адреса по заголовку Authorization: Bearer <token>.
+    """
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        metrics_provider: Optional[Callable[[], Dict]] = None,
+        metrics_token: str = "",
+    ):
+        """
+        Инициализация сервера
+
+        Args:
+            host: Адрес для прослушивания
+            port: Порт для прослушивания
+            metrics_provider: Функция, возвращающая метрики раннера
+            metrics_token: Токен доступа к /metrics. Пусто - только с localhost
+        """
+        self.host = host
+        self.port = port
+        self.metrics_provider = metrics_provider
+        self.metrics_token = metrics_token
+        self._routes: Dict[str, object] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        # Статистика
+        self.received = 0
+        self.rejected = 0
+
+    def register(self, service) -> str:
+        """
+        Зарегистрировать сервис бота
+
+        Args:
+            service: TelegramBotService с методом process_webhook_update
+
+        Returns:
+            Путь webhook для бота
+        """
+        secret = service.webhook_secret
+        self._routes[secret] = service
+        return f"{WEBHOOK_PATH_PREFIX}{secret}"
+
+    def unregister(self, service) -> None:
+        """Удалить маршрут сервиса бота"""
+        if self._routes.get(service.webhook_secret) is service:
+            del self._routes[service.webhook_secret]
+
+    async def start(self) -> None:
+        """Запуск HTTP сервера"""
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        logger.info(f"Webhook server listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        """Остановка HTTP сервера"""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            logger.info("Webhook server stopped")
+
+    def get_stats(self) -> Dict:
+        """Статистика сервера"""
+        return {
+            "routes": len(self._routes),
+            "received": self.received,
+            "rejected": self.rejected,
+        }
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Обработка HTTP/1.1 соединения (с поддержкой keep-alive)"""
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+                if not request_line:
+                    break
+
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._write_response(writer, 400, {"error": "bad request"})
+                    break
+
+                headers = await asyncio.wait_for(
+                    self._read_headers(reader), READ_TIMEOUT
+                )
+
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0 or length > MAX_BODY_SIZE:
+                    await self._write_response(writer, 413, {"error": "bad length"})
+                    break
+
+                body = b""
+                if length:
+                    body = await asyncio.wait_for(
+                        reader.readexactly(length), READ_TIMEOUT
+                    )
+                status, payload = await self._dispatch(
+                    method, target, headers, body, peer
+                )
+
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                await self._write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Webhook connection error: {e}")
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_headers(reader: asyncio.StreamReader) -> Dict[str, str]:
+        """Чтение заголовков запроса до пустой строки"""
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    def _metrics_allowed(self, headers: Dict, peer) -> bool:
+        """Проверить доступ к /metrics: по токену или с localhost"""
+        if self.metrics_token:
+            scheme, _, token = headers.get("authorization", "").partition(" ")
+            return scheme.lower() == "bearer" and hmac.compare_digest(
+                token.strip(), self.metrics_token
+            )
+        try:
+            return ipaddress.ip_address(peer[0]).is_loopback
+        except (TypeError, IndexError, ValueError):
+            # Unix сокет или адрес не определен
+            return False
+
+    async def _dispatch(
+        self,
+        method: str,
+        target: str,
+        headers: Dict,
+        body: bytes,
+        peer: Optional[Tuple] = None,
+    ) -> Tuple[int, Dict]:
+        """Маршрутизация запроса"""
+        path = target.split("?", 1)[0]
+
+        if path == "/health":
+            return 200, {"status": "ok"}
+
+        if path == "/metrics":
+            if not self._metrics_allowed(headers, peer):
+                if self.metrics_token:
+                    return 401, {"error": "unauthorized"}
+                return 403, {"error": "forbidden"}
+            if self.metrics_provider:
+                return 200, self.metrics_provider()
+            return 200, {"webhook": self.get_stats()}
+
+        if not path.startswith(WEBHOOK_PATH_PREFIX):
+            return 404, {"error": "not found"}
+
+        secret = path[len(WEBHOOK_PATH_PREFIX) :]
+        service = self._routes.get(secret)
+        if service is None:
+            self.rejected += 1
+            return 404, {"error": "unknown bot"}
+
+        if method != "POST":
+            return 405, {"error": "method not allowed"}
+
+        # Telegram присылает заголовок, если секрет передан в setWebhook
+        header_secret = headers.get(SECRET_HEADER)
+        if header_secret is not None and not hmac.compare_digest(header_secret, secret):
+            self.rejected += 1
+            return 403, {"error": "bad secret token"}
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            self.rejected += 1
+            return 400, {"error": "invalid json"}
+
+        if not await service.process_webhook_update(data):
+            return 503, {"error": "bot is not running"}
+
+        self.received += 1
+        return 200, {"ok": True}
+
+    async def _write_response(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        payload: Dict,
+        keep_alive: bool = False,
+    ) -> None:
+        """Отправка JSON ответа"""
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode()
+        head = (
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
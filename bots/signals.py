@@ -0,0 +1,24 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Bot, BotConfigVersion, FaqEntry
+from .services.config_channel import notify_config_changed
+from .services.faq_index import invalidate_faq_indexes
+
+
+@receiver(post_save, sender=Bot)
+@receiver(post_delete, sender=Bot)
+def bot_config_changed(sender, instance, **kwargs):
+    """Сообщаем раннерам об изменении настроек бота"""
+    BotConfigVersion.bump()
+    notify_config_changed()
+
+
+@receiver(post_save, sender=FaqEntry)
+@receiver(post_delete, sender=FaqEntry)
+def faq_entry_changed(sender, instance, **kwargs):
+    """
+    Обновляем индекс базы знаний бота в этом процессе. Раннеры других
+    процессов перечитывают изменения сами (FAQ_INDEX_REFRESH_INTERVAL),
+    версия настроек ботов при этом не меняется
+    """
+    invalidate_faq_indexes(instance.bot_id)
@@ -0,0 +1,101 @@
+import asyncio
+import datetime
+import time
+from types import SimpleNamespace
+
+import httpx
+from telegram import Chat, Message, Update, User
+
+from ..services.gpt_scheduler import GPTRequestScheduler
+from ..services.gpt_service import GPTService
+
+MESSAGES = [{"role": "user", "content": "Привет"}]
+
+
+def make_api_error(cls, status: int, headers=None):
+    """Ошибка OpenAI с HTTP ответом, как ее создает клиент"""
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, request=request, headers=headers or {})
+    return cls(f"HTTP {status}", response=response, body=None)
+
+
+def make_completion(content="ok", total_tokens=10):
+    """Ответ chat.completions.create"""
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(
+            prompt_tokens=total_tokens - 2,
+            completion_tokens=2,
+            total_tokens=total_tokens,
+        ),
+    )
+
+
+class FakeCompletions:
+    """
+    Заменитель chat.completions: по очереди отдает заданные результаты.
+    Исключение в списке выбрасывается, последний результат повторяется
+    """
+
+    def __init__(self, *results, delay=0.0):
+        self.results = list(results)
+        self.delay = delay
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        result = self.results[0] if len(self.results) == 1 else self.results.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def create(self, **kwargs):
+        time.sleep(self.delay)
+        return self._next()
+
+
+class FakeAsyncCompletions(FakeCompletions):
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self._next()
+
+
+class FakeStream:
+    """Поток ответа: заданные фрагменты, затем ошибка, если задана"""
+
+    def __init__(self, *deltas, error=None):
+        self.deltas = deltas
+        self.error = error
+
+    async def __aiter__(self):
+        for delta in self.deltas:
+            yield SimpleNamespace(
+                usage=None,
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))],
+            )
+        if self.error:
+            raise self.error
+
+
+def make_service(api_key, completions, max_concurrent=4):
+    """GPTService с поддельным клиентом и собственной очередью запросов"""
+    service = GPTService(api_key=api_key)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    service.clients = SimpleNamespace(
+        get_client=lambda key: client, get_async_client=lambda key: client
+    )
+    service.scheduler = GPTRequestScheduler(max_concurrent)
+    return service
+
+
+def make_update(update_id, user_id=7, chat=None, text=None):
+    """Обновление Telegram с текстовым сообщением"""
+    chat = chat or Chat(user_id, Chat.PRIVATE)
+    message = Message(
+        update_id,
+        datetime.datetime.now(datetime.timezone.utc),
+        chat,
+        from_user=User(user_id, f"user{user_id}", False),
+        text=text or f"message {update_id}",
+    )
+    return Update(update_id, message=message)
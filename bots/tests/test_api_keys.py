@@ -0,0 +1,115 @@
+import time
+
+import openai
+from django.test import SimpleTestCase, override_settings
+
+from ..services.api_keys import (
+    NoApiKeyError,
+    get_key_state,
+    retire_api_key,
+    select_api_key,
+)
+from ..services.rate_limit import get_api_rate_limiter
+from ..services.resilience import CircuitBreaker, get_circuit_breaker
+from .fakes import (
+    MESSAGES,
+    FakeCompletions,
+    make_api_error,
+    make_completion,
+    make_service,
+)
+
+
+class SelectApiKeyTests(SimpleTestCase):
+    """Выбор ключа для запроса"""
+
+    def test_prefers_key_with_more_limit_left(self):
+        busy, free = "sk-test-select-busy", "sk-test-select-free"
+        get_api_rate_limiter(busy).reserve(100000)
+
+        self.assertEqual(select_api_key([busy, free], "m"), free)
+
+    def test_prefers_fewer_requests_in_flight(self):
+        busy, free = "sk-test-inflight-busy", "sk-test-inflight-free"
+        get_key_state(busy).in_flight = 3
+        self.addCleanup(setattr, get_key_state(busy), "in_flight", 0)
+
+        self.assertEqual(select_api_key([busy, free], "m"), free)
+
+    def test_open_circuit_is_last_resort(self):
+        broken, working = "sk-test-circuit-broken", "sk-test-circuit-working"
+        get_circuit_breaker(broken, "m").state = CircuitBreaker.OPEN
+
+        self.assertEqual(select_api_key([broken, working], "m"), working)
+        self.assertEqual(select_api_key([broken], "m"), broken)
+
+    def test_skips_retired_and_raises_without_keys(self):
+        retired, working = "sk-test-skip-retired", "sk-test-skip-working"
+        get_key_state(retired).retired = True
+
+        self.assertEqual(select_api_key([retired, working], "m"), working)
+        with self.assertRaises(NoApiKeyError):
+            select_api_key([retired], "m")
+
+
+class RetireApiKeyTests(SimpleTestCase):
+    """Отключение ключей, отклоненных OpenAI"""
+
+    error = make_api_error(openai.AuthenticationError, 401)
+
+    def test_retires_key_when_others_remain(self):
+        rejected, other = "sk-test-retire-rejected", "sk-test-retire-other"
+
+        retire_api_key(rejected, self.error, [rejected, other])
+
+        self.assertTrue(get_key_state(rejected).retired)
+        self.assertEqual(select_api_key([rejected, other], "m"), other)
+
+    @override_settings(OPENAI_KEY_REJECT_COOLDOWN=0.05)
+    def test_only_key_is_skipped_for_cooldown(self):
+        only = "sk-test-retire-only"
+
+        retire_api_key(only, self.error, [only])
+
+        self.assertFalse(get_key_state(only).retired)
+        with self.assertRaises(NoApiKeyError):
+            select_api_key([only], "m")
+        time.sleep(0.06)
+        self.assertEqual(select_api_key([only], "m"), only)
+
+    def test_last_remaining_key_is_not_retired(self):
+        first, last = "sk-test-retire-first", "sk-test-retire-last"
+
+        retire_api_key(first, self.error, [first, last])
+        retire_api_key(last, self.error, [first, last])
+
+        self.assertTrue(get_key_state(first).retired)
+        self.assertFalse(get_key_state(last).retired)
+        self.assertGreater(get_key_state(last).cooldown_until, time.monotonic())
+
+
+@override_settings(OPENAI_SINGLE_FLIGHT=False)
+class RejectedKeyRequestTests(SimpleTestCase):
+    """Запросы при ошибке аутентификации"""
+
+    def test_request_moves_to_another_key(self):
+        completions = FakeCompletions(
+            make_api_error(openai.AuthenticationError, 401), make_completion()
+        )
+        service = make_service("sk-test-request-first", completions)
+        service.api_keys = ["sk-test-request-first", "sk-test-request-second"]
+
+        result = service.generate_response(MESSAGES, model="m", max_retries=0)
+
+        self.assertTrue(result["success"])
+        self.assertEqual(completions.calls, 2)
+        self.assertEqual(sum(get_key_state(key).retired for key in service.api_keys), 1)
+
+    def test_only_key_fails_request_without_retiring(self):
+        completions = FakeCompletions(make_api_error(openai.AuthenticationError, 401))
+        service = make_service("sk-test-request-only", completions)
+
+        result = service.generate_response(MESSAGES, model="m", max_retries=0)
+
+        self.assertEqual(result["error"], "auth_error")
+        self.assertFalse(get_key_state("sk-test-request-only").retired)
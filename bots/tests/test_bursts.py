@@ -0,0 +1,81 @@
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase
+from telegram import Chat
+
+from ..models import Bot
+from ..services.telegram_service import TelegramBotService
+from .fakes import make_update
+
+
+class TakeBurstTests(SimpleTestCase):
+    """Объединение сообщений, присланных подряд"""
+
+    def make_service(self, debounce_seconds=0.05):
+        bot = Bot(
+            id=1,
+            name="test",
+            telegram_token="123456:TEST",
+            gpt_api_key="sk-test-burst",
+            debounce_seconds=debounce_seconds,
+        )
+        return TelegramBotService(bot, db_executor=mock.Mock())
+
+    def take_all(self, service, updates):
+        """Собрать сообщения и обработать их по очереди, как обработчик чата"""
+        for update in updates:
+            service.collect_message(update)
+
+        async def scenario():
+            return [await service.take_burst(update) for update in updates]
+
+        return asyncio.run(scenario())
+
+    def test_merges_messages_of_one_user(self):
+        service = self.make_service()
+        updates = [make_update(1, text="Привет"), make_update(2, text="как дела?")]
+
+        texts = self.take_all(service, updates)
+
+        self.assertEqual(texts, ["Привет\nкак дела?", None])
+        self.assertEqual(service.coalesced_messages, 1)
+
+    def test_group_members_are_not_merged(self):
+        service = self.make_service()
+        group = Chat(-100, Chat.GROUP)
+        updates = [
+            make_update(1, user_id=7, chat=group, text="a1"),
+            make_update(2, user_id=8, chat=group, text="b1"),
+            make_update(3, user_id=7, chat=group, text="a2"),
+        ]
+
+        texts = self.take_all(service, updates)
+
+        self.assertEqual(texts, ["a1\na2", "b1", None])
+
+    def test_disabled_debounce_returns_message(self):
+        service = self.make_service(debounce_seconds=0)
+        updates = [make_update(1, text="a"), make_update(2, text="b")]
+
+        self.assertEqual(self.take_all(service, updates), ["a", "b"])
+
+    def test_cancelled_handler_leaves_no_burst(self):
+        service = self.make_service(debounce_seconds=10)
+        first, second = make_update(1, text="a"), make_update(2, text="b")
+        service.collect_message(first)
+        service.collect_message(second)
+
+        async def scenario():
+            task = asyncio.create_task(service.take_burst(first))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            # Следующее сообщение начинает новую пачку
+            third = make_update(3, text="c")
+            service.collect_message(third)
+            service.bot_instance.debounce_seconds = 0.01
+            return await service.take_burst(second), await service.take_burst(third)
+
+        self.assertEqual(asyncio.run(scenario()), ("b", "c"))
+        self.assertEqual(service._bursts, {})
@@ -0,0 +1,74 @@
+from django.test import TestCase
+
+from ..models import Bot, Conversation, TelegramUser
+
+
+class ConversationSummaryTests(TestCase):
+    """Сжатие истории диалога в пересказ"""
+
+    def setUp(self):
+        bot = Bot.objects.create(
+            name="test",
+            telegram_token="123456:SUMMARY",
+            gpt_api_key="sk-test-summary",
+        )
+        user = TelegramUser.objects.create(telegram_id=7)
+        self.conversation = Conversation.objects.create(bot=bot, telegram_user=user)
+
+    def fill(self, count, tokens=10):
+        for i in range(count):
+            role = "user" if i % 2 == 0 else "assistant"
+            self.conversation.add_message(role, f"message {i}", tokens=tokens)
+
+    def test_no_summary_below_threshold(self):
+        self.fill(4)
+        self.assertIsNone(self.conversation.get_summary_end(threshold=40))
+
+    def test_summary_end_keeps_half_of_threshold(self):
+        self.fill(10)
+        # 100 токенов при пороге 40: остаются последние 20 токенов
+        self.assertEqual(self.conversation.get_summary_end(threshold=40), 8)
+
+    def test_summary_end_keeps_last_two_messages(self):
+        self.fill(4, tokens=50)
+        self.assertEqual(self.conversation.get_summary_end(threshold=40), 2)
+
+    def test_apply_summary_moves_summarized_count(self):
+        self.fill(10)
+        end = self.conversation.get_summary_end(threshold=40)
+
+        saved = self.conversation.apply_summary("пересказ", 5, 0, end, 0)
+
+        self.assertTrue(saved)
+        stored = Conversation.objects.get(pk=self.conversation.pk)
+        self.assertEqual(
+            (stored.summary, stored.summary_tokens, stored.summarized_count),
+            ("пересказ", 5, end),
+        )
+        messages = stored.get_openai_messages()
+        self.assertEqual(messages[1]["tokens"], 5)
+        self.assertEqual(len(messages), 2 + 10 - end)
+
+    def test_apply_summary_rejects_already_summarized(self):
+        self.fill(10)
+        self.assertTrue(self.conversation.apply_summary("a", 5, 0, 8, 0))
+
+        stale = Conversation.objects.get(pk=self.conversation.pk)
+        self.assertFalse(stale.apply_summary("b", 5, 0, 8, 0))
+        self.assertEqual(Conversation.objects.get(pk=stale.pk).summary, "a")
+
+    def test_apply_summary_rejects_cleared_and_refilled_history(self):
+        self.fill(10)
+        generation = self.conversation.history_generation
+        end = self.conversation.get_summary_end(threshold=40)
+
+        # Пока пересказ строился, историю очистили и заполнили снова
+        other = Conversation.objects.get(pk=self.conversation.pk)
+        other.clear_history()
+        for i in range(10):
+            other.add_message("user", f"new {i}", tokens=10)
+
+        self.assertFalse(self.conversation.apply_summary("old", 5, 0, end, generation))
+        stored = Conversation.objects.get(pk=self.conversation.pk)
+        self.assertEqual((stored.summary, stored.summarized_count), ("", 0))
+        self.assertEqual(stored.history_generation, generation + 1)
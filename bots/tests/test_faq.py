@@ -0,0 +1,201 @@
+import datetime
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ..models import Bot, BotConfigVersion, BotFaqStats, FaqEntry
+from ..services import faq_index
+from ..services.faq_index import (
+    FaqIndex,
+    find_faq_answer,
+    flush_faq_stats,
+    get_faq_index,
+    tokenize,
+)
+
+ENTRIES = [
+    (1, "Какие у вас часы работы?", "С 9 до 18"),
+    (2, "Сколько стоит доставка?", "300 рублей"),
+    (3, "Как оформить возврат товара?", "Через личный кабинет"),
+    (4, "Есть ли доставка в выходные дни?", "Да, по субботам"),
+]
+
+
+class FaqSearchTests(SimpleTestCase):
+    """Поиск по индексу BM25"""
+
+    def setUp(self):
+        self.index = FaqIndex(bot_id=1)
+        for entry in ENTRIES:
+            self.index.add(*entry)
+
+    def test_tokenize_stems_and_drops_stop_words(self):
+        self.assertEqual(tokenize("Какие часы работы?"), tokenize("часов работе"))
+        self.assertEqual(tokenize("как и что"), [])
+
+    def test_ranks_best_matching_question(self):
+        cases = [
+            ("До скольки вы работаете? Часы работы", 1),
+            ("доставка сколько стоит", 2),
+            ("хочу вернуть товар, как оформить возврат", 3),
+            ("доставка в выходные", 4),
+        ]
+        for text, expected in cases:
+            with self.subTest(text):
+                self.assertEqual(self.index.search(text).entry_id, expected)
+
+    def test_exact_question_scores_one(self):
+        self.assertEqual(self.index.search("Сколько стоит доставка?").score, 1.0)
+
+    def test_extra_words_lower_score(self):
+        exact = self.index.search("Сколько стоит доставка").score
+        longer = self.index.search("Сколько стоит доставка пиццы ночью").score
+
+        self.assertLess(longer, exact)
+
+    def test_min_score_threshold(self):
+        match = self.index.search("доставка пиццы ночью в офис")
+
+        self.assertIsNotNone(match)
+        self.assertIsNone(self.index.search("доставка пиццы ночью в офис", 0.99))
+        self.assertIsNone(self.index.search("погода на завтра"))
+
+    def test_removed_entry_is_not_found(self):
+        self.index.remove(2)
+
+        match = self.index.search("Сколько стоит доставка?")
+        self.assertNotEqual(match and match.entry_id, 2)
+        self.assertEqual(self.index.get_stats()["entries"], 3)
+
+
+class FaqAnswerTests(TestCase):
+    """Ответы из базы знаний бота"""
+
+    def setUp(self):
+        faq_index._indexes.clear()
+        self.addCleanup(faq_index._indexes.clear)
+        self.bot = Bot.objects.create(
+            name="faq", telegram_token="123456:FAQ", faq_min_score=0.5
+        )
+        self.entries = [
+            FaqEntry.objects.create(bot=self.bot, question=question, answer=answer)
+            for _, question, answer in ENTRIES
+        ]
+
+    def test_answers_above_threshold(self):
+        match = find_faq_answer(self.bot, "Сколько стоит доставка?")
+
+        self.assertEqual(match.answer, "300 рублей")
+        self.assertIsNone(find_faq_answer(self.bot, "погода на завтра"))
+
+    def test_zero_threshold_disables_faq(self):
+        self.bot.faq_min_score = 0
+
+        self.assertIsNone(find_faq_answer(self.bot, "Сколько стоит доставка?"))
+        self.assertNotIn(self.bot.id, faq_index._indexes)
+
+    def test_threshold_filters_partial_matches(self):
+        text = "доставка пиццы ночью в офис"
+        self.bot.faq_min_score = 0.1
+        self.assertIsNotNone(find_faq_answer(self.bot, text))
+
+        self.bot.faq_min_score = 0.9
+        self.assertIsNone(find_faq_answer(self.bot, text))
+
+    def test_refresh_reads_only_changed_entries(self):
+        index = get_faq_index(self.bot.id)
+        index.refresh()
+        changed = self.entries[1]
+        # update() не вызывает сигналы: изменение из другого процесса
+        FaqEntry.objects.filter(pk=changed.pk).update(
+            question="Цена курьерской доставки",
+            updated_at=timezone.now() + datetime.timedelta(seconds=1),
+        )
+        FaqEntry.objects.filter(pk=self.entries[2].pk).update(is_active=False)
+
+        with self.assertLogs("bots.services.faq_index", "INFO") as logs:
+            index.refresh()
+
+        self.assertIn("1 entries updated", logs.output[0])
+        self.assertEqual(index.search("цена курьерской доставки").entry_id, changed.pk)
+        self.assertIsNone(index.search("оформить возврат товара"))
+
+    def test_other_process_changes_are_picked_up_after_interval(self):
+        find_faq_answer(self.bot, "Сколько стоит доставка?")
+        FaqEntry.objects.filter(pk=self.entries[1].pk).update(is_active=False)
+
+        with self.settings(FAQ_INDEX_REFRESH_INTERVAL=3600):
+            self.assertIsNotNone(find_faq_answer(self.bot, "Сколько стоит доставка?"))
+        with self.settings(FAQ_INDEX_REFRESH_INTERVAL=0):
+            self.assertIsNone(find_faq_answer(self.bot, "Сколько стоит доставка?"))
+
+    def test_entry_change_invalidates_only_its_bot(self):
+        other = Bot.objects.create(name="other", telegram_token="654321:FAQ")
+        index, other_index = get_faq_index(self.bot.id), get_faq_index(other.id)
+        index.refresh()
+        other_index.refresh()
+        version = BotConfigVersion.get_version()
+
+        self.entries[0].answer = "С 10 до 19"
+        self.entries[0].save()
+
+        self.assertTrue(index.stale)
+        self.assertFalse(other_index.stale)
+        self.assertEqual(BotConfigVersion.get_version(), version)
+
+    def test_stats_are_written_on_flush(self):
+        get_faq_index(self.bot.id).refresh()
+        # Построенный индекс отвечает без обращений к БД
+        with self.assertNumQueries(0):
+            for text in ("Сколько стоит доставка?", "доставка сколько", "погода"):
+                find_faq_answer(self.bot, text)
+        self.assertFalse(BotFaqStats.objects.filter(bot=self.bot).exists())
+
+        flush_faq_stats()
+        flush_faq_stats()
+
+        stats = BotFaqStats.objects.get(bot=self.bot)
+        self.assertEqual((stats.lookups, stats.hits), (3, 2))
+        self.entries[1].refresh_from_db()
+        self.assertEqual(self.entries[1].hits, 2)
+
+
+class FaqEntryApiTests(TestCase):
+    """API базы знаний"""
+
+    def setUp(self):
+        faq_index._indexes.clear()
+        self.addCleanup(faq_index._indexes.clear)
+        self.client = APIClient()
+        self.bot = Bot.objects.create(name="faq", telegram_token="123456:API")
+        self.other = Bot.objects.create(name="other", telegram_token="654321:API")
+
+    def test_create_and_filter_by_bot(self):
+        index = get_faq_index(self.bot.id)
+        index.refresh()
+
+        response = self.client.post(
+            "/api/faq-entries/",
+            {
+                "bot": self.bot.id,
+                "question": "Сколько стоит доставка?",
+                "answer": "300 рублей",
+                "hits": 100,
+            },
+            format="json",
+        )
+        FaqEntry.objects.create(bot=self.other, question="Вопрос", answer="Ответ")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["hits"], 0)
+        self.assertTrue(index.stale)
+
+        listed = self.client.get("/api/faq-entries/", {"bot": self.bot.id})
+        self.assertEqual(
+            [entry["question"] for entry in listed.data["results"]],
+            ["Сколько стоит доставка?"],
+        )
+        self.assertEqual(
+            find_faq_answer(self.bot, "сколько стоит доставка").answer, "300 рублей"
+        )
@@ -0,0 +1,121 @@
+import asyncio
+
+import openai
+from django.test import SimpleTestCase, override_settings
+
+from ..services.gpt_scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    GPTRequestScheduler,
+)
+from .fakes import (
+    MESSAGES,
+    FakeAsyncCompletions,
+    make_api_error,
+    make_completion,
+    make_service,
+)
+
+
+class GPTRequestSchedulerTests(SimpleTestCase):
+    """Очередь запросов к GPT"""
+
+    def grant_order(self, requests):
+        """
+        Порядок выдачи слота запросам (bot_id, priority), вставшим в очередь
+        за занятым единственным слотом
+        """
+        scheduler = GPTRequestScheduler(1)
+        order = []
+
+        async def request(name, bot_id, priority):
+            async with scheduler.aslot(bot_id, priority):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        async def scenario():
+            await scheduler.aacquire()
+            tasks = []
+            for name, bot_id, priority in requests:
+                tasks.append(asyncio.create_task(request(name, bot_id, priority)))
+                await asyncio.sleep(0)
+            scheduler.release()
+            await asyncio.gather(*tasks)
+
+        asyncio.run(scenario())
+        self.assertEqual(scheduler.in_flight, 0)
+        return order
+
+    def test_limits_concurrency(self):
+        scheduler = GPTRequestScheduler(2)
+        active = []
+        peak = []
+
+        async def request():
+            async with scheduler.aslot():
+                active.append(1)
+                peak.append(len(active))
+                await asyncio.sleep(0.01)
+                active.pop()
+
+        async def scenario():
+            await asyncio.gather(*(request() for _ in range(6)))
+
+        asyncio.run(scenario())
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(scheduler.in_flight, 0)
+
+    def test_interactive_before_background(self):
+        order = self.grant_order(
+            [
+                ("summary", 1, PRIORITY_BACKGROUND),
+                ("reply", 1, PRIORITY_INTERACTIVE),
+            ]
+        )
+        self.assertEqual(order, ["reply", "summary"])
+
+    def test_bots_take_turns(self):
+        order = self.grant_order(
+            [
+                ("a1", 1, PRIORITY_INTERACTIVE),
+                ("a2", 1, PRIORITY_INTERACTIVE),
+                ("a3", 1, PRIORITY_INTERACTIVE),
+                ("b1", 2, PRIORITY_INTERACTIVE),
+            ]
+        )
+        self.assertLess(order.index("b1"), order.index("a2"))
+
+    def test_cancelled_waiter_does_not_leak_slot(self):
+        scheduler = GPTRequestScheduler(1)
+
+        async def scenario():
+            await scheduler.aacquire()
+            waiter = asyncio.create_task(scheduler.aacquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            scheduler.release()
+
+        asyncio.run(scenario())
+        self.assertEqual(scheduler.in_flight, 0)
+
+    @override_settings(OPENAI_RETRY_BASE_DELAY=0.01, OPENAI_SINGLE_FLIGHT=False)
+    def test_scheduler_slot_is_free_during_backoff(self):
+        error = make_api_error(
+            openai.RateLimitError, 429, headers={"retry-after": "0.2"}
+        )
+        completions = FakeAsyncCompletions(error, make_completion())
+        service = make_service("sk-test-backoff", completions, max_concurrent=1)
+
+        async def scenario():
+            task = asyncio.create_task(
+                service.agenerate_response(MESSAGES, model="m", max_retries=1)
+            )
+            await asyncio.sleep(0.1)
+            in_flight = service.scheduler.in_flight
+            return in_flight, await task
+
+        in_flight, result = asyncio.run(scenario())
+        self.assertEqual(in_flight, 0)
+        self.assertTrue(result["success"])
+        self.assertEqual(service.scheduler.in_flight, 0)
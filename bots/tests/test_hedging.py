@@ -0,0 +1,197 @@
+import asyncio
+from unittest import mock
+
+import openai
+from django.test import SimpleTestCase, override_settings
+
+from ..services.rate_limit import get_api_rate_limiter
+from .fakes import MESSAGES, FakeStream, make_api_error, make_completion, make_service
+
+
+def count_words(text, model):
+    """Детерминированный подсчет токенов без загрузки кодировки tiktoken"""
+    return len(text.split())
+
+
+class ModelCompletions:
+    """
+    Заменитель chat.completions AsyncOpenAI с ответом и задержкой для
+    каждой модели. Исключение в ответе выбрасывается
+    """
+
+    def __init__(self, **models):
+        self.models = models
+        self.calls = []
+
+    async def create(self, model, **kwargs):
+        delay, result = self.models[model]
+        self.calls.append(model)
+        await asyncio.sleep(delay)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+
+@override_settings(OPENAI_SINGLE_FLIGHT=False, OPENAI_RETRY_BASE_DELAY=0.01)
+class HedgedRequestTests(SimpleTestCase):
+    """Страховочные запросы к резервной модели"""
+
+    def setUp(self):
+        patcher = mock.patch(
+            "bots.services.gpt_service.count_tokens", side_effect=count_words
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def generate(self, service, hedge_after):
+        async def scenario():
+            result = await service.agenerate_response(
+                MESSAGES,
+                model="main",
+                max_tokens=100,
+                fallback_models=["backup"],
+                hedge_after=hedge_after,
+                max_retries=0,
+            )
+            # Отмененные запросы завершаются на следующих итерациях цикла
+            await asyncio.sleep(0.05)
+            return result
+
+        return asyncio.run(scenario())
+
+    def test_no_hedge_before_budget(self):
+        completions = ModelCompletions(
+            main=(0.02, make_completion("main")),
+            backup=(0, make_completion("backup")),
+        )
+        service = make_service("sk-test-hedge-fast", completions)
+
+        result = self.generate(service, hedge_after=0.5)
+
+        self.assertEqual(result["content"], "main")
+        self.assertEqual(completions.calls, ["main"])
+        self.assertEqual(service.hedge_stats["hedged"], 0)
+
+    def test_hedge_wins_and_loser_is_refunded(self):
+        api_key = "sk-test-hedge-slow"
+        completions = ModelCompletions(
+            main=(1.0, make_completion("main")),
+            backup=(0, make_completion("backup", total_tokens=10)),
+        )
+        service = make_service(api_key, completions)
+        limiter = get_api_rate_limiter(api_key)
+
+        result = self.generate(service, hedge_after=0.05)
+
+        self.assertEqual(result["content"], "backup")
+        self.assertEqual(completions.calls, ["main", "backup"])
+        self.assertEqual(service.hedge_stats["hedged"], 1)
+        self.assertEqual(service.hedge_stats["fallback_wins"], 1)
+        self.assertEqual(service.hedge_stats["cancelled"], 1)
+        self.assertGreater(service.hedge_stats["overhead_tokens"], 0)
+        # Резерв проигравшего возвращен целиком, победителя - сверен с usage
+        estimated = service._trim_messages(MESSAGES, 3000, "main")[1] + 100
+        self.assertEqual(limiter.estimate_error, 2 * estimated - 10)
+        self.assertEqual(service.scheduler.in_flight, 0)
+
+    def test_hedge_waiting_in_queue_is_not_counted(self):
+        completions = ModelCompletions(
+            main=(0.2, make_completion("main")),
+            backup=(0, make_completion("backup")),
+        )
+        # Единственный слот занят основной моделью, а следующим в очереди
+        # стоит чужой запрос: страховка так и не доходит до API
+        service = make_service("sk-test-hedge-queued", completions, max_concurrent=1)
+
+        async def other_request():
+            await asyncio.sleep(0.01)
+            async with service.scheduler.aslot():
+                await asyncio.sleep(0.1)
+
+        async def scenario():
+            other = asyncio.create_task(other_request())
+            result = await service.agenerate_response(
+                MESSAGES,
+                model="main",
+                fallback_models=["backup"],
+                hedge_after=0.05,
+                max_retries=0,
+            )
+            await other
+            return result
+
+        result = asyncio.run(scenario())
+
+        self.assertEqual(result["content"], "main")
+        self.assertEqual(completions.calls, ["main"])
+        self.assertEqual(service.hedge_stats["hedged"], 0)
+        self.assertEqual(service.hedge_stats["cancelled"], 1)
+        self.assertEqual(service.hedge_stats["overhead_tokens"], 0)
+        self.assertEqual(service.scheduler.in_flight, 0)
+
+    def test_error_starts_next_model_without_hedge(self):
+        completions = ModelCompletions(
+            main=(0, make_api_error(openai.BadRequestError, 400)),
+            backup=(0, make_completion("backup")),
+        )
+        service = make_service("sk-test-hedge-error", completions)
+
+        result = self.generate(service, hedge_after=0.5)
+
+        self.assertEqual(result["content"], "backup")
+        self.assertEqual(service.hedge_stats["hedged"], 0)
+        self.assertEqual(service.hedge_stats["fallback_wins"], 1)
+
+
+@override_settings(OPENAI_SINGLE_FLIGHT=False)
+class StreamFallbackTests(SimpleTestCase):
+    """Резервная модель потокового ответа"""
+
+    def setUp(self):
+        patcher = mock.patch(
+            "bots.services.gpt_service.count_tokens", side_effect=count_words
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, service):
+        async def scenario():
+            return [
+                event
+                async for event in service.astream_response(
+                    MESSAGES, model="main", fallback_models=["backup"], max_retries=0
+                )
+            ]
+
+        return asyncio.run(scenario())
+
+    def test_falls_back_before_first_delta(self):
+        completions = ModelCompletions(
+            main=(0, make_api_error(openai.BadRequestError, 400)),
+            backup=(0, FakeStream("резервный ", "ответ")),
+        )
+        service = make_service("sk-test-stream-fallback", completions)
+
+        events = self.stream(service)
+
+        self.assertEqual(completions.calls, ["main", "backup"])
+        self.assertEqual(
+            [event["content"] for event in events[:-1]], ["резервный ", "ответ"]
+        )
+        result = events[-1]["result"]
+        self.assertTrue(result["success"])
+        self.assertEqual(result["model"], "backup")
+
+    def test_no_fallback_after_delta(self):
+        error = make_api_error(openai.InternalServerError, 500)
+        completions = ModelCompletions(
+            main=(0, FakeStream("начало ", error=error)),
+            backup=(0, FakeStream("резерв")),
+        )
+        service = make_service("sk-test-stream-started", completions)
+
+        events = self.stream(service)
+
+        self.assertEqual(completions.calls, ["main"])
+        self.assertEqual([event["type"] for event in events], ["delta", "result"])
+        self.assertFalse(events[-1]["result"]["success"])
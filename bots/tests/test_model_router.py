@@ -0,0 +1,170 @@
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, override_settings
+
+from ..models import validate_routing_rules
+from ..services.model_router import ModelRouter
+
+SYSTEM = {"role": "system", "content": "Ты помощник"}
+
+
+def dialog(text, history=0, tokens=None):
+    """Запрос: системный промпт, history сообщений истории и реплика"""
+    messages = [SYSTEM]
+    for i in range(history):
+        role = "user" if i % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": f"реплика {i}"})
+    last = {"role": "user", "content": text}
+    if tokens is not None:
+        last["tokens"] = tokens
+    return messages + [last]
+
+
+@override_settings(OPENAI_ROUTING_MAX_TOKENS=40, OPENAI_ROUTING_MAX_HISTORY=6)
+class ModelRouterTests(SimpleTestCase):
+    """Выбор модели по правилам"""
+
+    def setUp(self):
+        patcher = mock.patch(
+            "bots.services.model_router.count_tokens",
+            side_effect=lambda text, model: len(text.split()),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ModelRouter()
+
+    def test_decisions(self):
+        # (описание, сообщения, правила, модель, причина)
+        cases = [
+            ("greeting", dialog("Привет!"), {}, "light", "trivial"),
+            ("short question", dialog("Который час?"), {}, "light", "short_message"),
+            ("heavy keyword", dialog("Напиши стих"), {}, "main", "keyword:напиши"),
+            (
+                "keyword word start",
+                dialog("Что не так в коде?"),
+                {},
+                "main",
+                "keyword:код",
+            ),
+            ("keyword inside word", dialog("Эпизод"), {}, "light", "short_message"),
+            (
+                "bot keyword",
+                dialog("Нужен рецепт"),
+                {"heavy_keywords": ["рецепт"]},
+                "main",
+                "keyword:рецепт",
+            ),
+            (
+                "bot phrase",
+                dialog("Принято."),
+                {"light_phrases": ["принято"]},
+                "light",
+                "trivial",
+            ),
+            (
+                "keyword beats phrase",
+                dialog("код"),
+                {"light_phrases": ["код"]},
+                "main",
+                "keyword:код",
+            ),
+            (
+                "no user message",
+                [SYSTEM, {"role": "assistant", "content": "Привет"}],
+                {},
+                "main",
+                "no_user_message",
+            ),
+            ("only system", [SYSTEM], {}, "main", "no_user_message"),
+        ]
+        for name, messages, rules, expected, reason in cases:
+            with self.subTest(name):
+                routing = {"light_model": "light", **rules}
+                self.assertEqual(
+                    self.router.route(messages, "main", routing), (expected, reason)
+                )
+
+    def test_light_model_thresholds(self):
+        # (описание, токены реплики, сообщений истории, правила, модель)
+        cases = [
+            ("at token limit", 40, 0, {}, "light"),
+            ("over token limit", 41, 0, {}, "main"),
+            ("bot token limit", 11, 0, {"light_max_tokens": 10}, "main"),
+            ("zero token limit", 1, 0, {"light_max_tokens": 0}, "main"),
+            # Реплика - седьмое сообщение диалога
+            ("at history limit", 5, 5, {}, "light"),
+            ("over history limit", 5, 6, {}, "main"),
+            ("bot history limit", 5, 2, {"light_max_history": 2}, "main"),
+            ("long history, greeting", None, 6, {}, "main"),
+        ]
+        for name, tokens, history, rules, expected in cases:
+            with self.subTest(name):
+                text = "спасибо" if tokens is None else "вопрос"
+                messages = dialog(text, history=history, tokens=tokens)
+                routing = {"light_model": "light", **rules}
+                self.assertEqual(
+                    self.router.route(messages, "main", routing)[0], expected
+                )
+
+    def test_counts_tokens_when_not_stored(self):
+        routing = {"light_model": "light", "light_max_tokens": 3}
+
+        self.assertEqual(
+            self.router.route(dialog("один два три"), "main", routing)[0], "light"
+        )
+        self.assertEqual(
+            self.router.route(dialog("один два три четыре"), "main", routing),
+            ("main", "long_message"),
+        )
+
+    def test_disabled_without_light_model(self):
+        for routing in (None, {}, {"light_model": ""}):
+            with self.subTest(routing=routing):
+                self.assertEqual(
+                    self.router.route(dialog("Привет"), "main", routing),
+                    ("main", "disabled"),
+                )
+        self.assertEqual(self.router.get_stats()["light"], 0)
+
+    def test_stats_count_decisions(self):
+        routing = {"light_model": "light"}
+        self.router.route(dialog("Привет"), "main", routing)
+        self.router.route(dialog("Объясни"), "main", routing)
+
+        stats = self.router.get_stats()
+        self.assertEqual((stats["light"], stats["heavy"]), (1, 1))
+        self.assertEqual(stats["reasons"], {"trivial": 1, "keyword:объясни": 1})
+
+
+class RoutingRulesValidatorTests(SimpleTestCase):
+    """Проверка Bot.gpt_routing_rules"""
+
+    def test_accepts_valid_rules(self):
+        for rules in (
+            None,
+            {},
+            {"light_max_tokens": 0},
+            {"light_max_tokens": 30, "light_max_history": 4},
+            {"heavy_keywords": ["рецепт"], "light_phrases": ["принято", "ага"]},
+            {"heavy_keywords": []},
+        ):
+            with self.subTest(rules=rules):
+                validate_routing_rules(rules)
+
+    def test_rejects_invalid_rules(self):
+        for rules in (
+            ["light_max_tokens"],
+            "light_max_tokens=10",
+            {"light_model": "gpt-4o-mini"},
+            {"light_max_tokens": -1},
+            {"light_max_tokens": "10"},
+            {"light_max_tokens": 1.5},
+            {"light_max_history": True},
+            {"heavy_keywords": "рецепт"},
+            {"heavy_keywords": ["рецепт", 1]},
+            {"light_phrases": [" "]},
+        ):
+            with self.subTest(rules=rules):
+                with self.assertRaises(ValidationError):
+                    validate_routing_rules(rules)
@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+import time
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+from telegram.error import RetryAfter
+
+from ..services.outbound import OutboundQueue, split_message
+
+
+class SplitMessageTests(SimpleTestCase):
+    """Разбиение длинных ответов"""
+
+    def test_short_text_is_single_chunk(self):
+        self.assertEqual(split_message("hello", limit=10), ["hello"])
+        self.assertEqual(split_message("", limit=10), [""])
+
+    def test_prefers_paragraphs(self):
+        text = "a" * 6 + "\n\n" + "b" * 6
+        self.assertEqual(split_message(text, limit=10), ["a" * 6, "b" * 6])
+
+    def test_falls_back_to_spaces_and_hard_cut(self):
+        self.assertEqual(
+            split_message("aaaa bbbb cccc", limit=10), ["aaaa bbbb", "cccc"]
+        )
+        self.assertEqual(split_message("x" * 25, limit=10), ["x" * 10] * 2 + ["x" * 5])
+
+    def test_chunks_fit_limit(self):
+        text = " ".join(f"word{i}" for i in range(2000))
+        chunks = split_message(text, limit=100)
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        self.assertEqual(" ".join(chunks), text)
+
+
+class OutboundQueueTests(SimpleTestCase):
+    """Очередь исходящих сообщений"""
+
+    bot = SimpleNamespace(id=1)
+
+    def make_queue(self):
+        queue = OutboundQueue()
+        queue.bot_rate = 1000
+        queue.private_chat_rate = 1000
+        return queue
+
+    def test_flood_limit_pauses_only_its_chat(self):
+        queue = self.make_queue()
+        finished = {}
+        attempts = []
+
+        async def limited():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(datetime.timedelta(milliseconds=300))
+            return "limited"
+
+        async def other():
+            return "other"
+
+        async def scenario():
+            started = time.monotonic()
+
+            async def send(chat_id, request):
+                result = await queue.submit(self.bot, chat_id, request)
+                finished[result] = time.monotonic() - started
+
+            await asyncio.gather(send(1, limited), send(2, other))
+
+        asyncio.run(scenario())
+        self.assertLess(finished["other"], 0.2)
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.25)
+        self.assertEqual(queue.rate_limited, 1)
+
+    def test_cancelled_worker_cancels_queued_requests(self):
+        queue = self.make_queue()
+
+        async def slow():
+            await asyncio.sleep(10)
+
+        async def scenario():
+            futures = [queue.submit(self.bot, 1, slow) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            queue._workers[(1, 1)].cancel()
+            return await asyncio.gather(*futures, return_exceptions=True)
+
+        results = asyncio.run(scenario())
+        self.assertTrue(
+            all(isinstance(r, asyncio.CancelledError) for r in results), results
+        )
+        self.assertEqual(queue.get_stats()["queued"], 0)
+
+    def test_idle_full_buckets_are_dropped(self):
+        queue = self.make_queue()
+
+        async def request():
+            return None
+
+        async def scenario():
+            await asyncio.gather(
+                *(queue.submit(self.bot, chat_id, request) for chat_id in range(20))
+            )
+            await asyncio.sleep(0.05)
+            queue._swept_at -= queue.bucket_sweep_interval
+            await queue.submit(self.bot, 100, request)
+            await asyncio.sleep(0)
+
+        asyncio.run(scenario())
+        # Остается только бакет чата, в который только что писали
+        self.assertEqual(list(queue._chat_buckets), [(1, 100)])
@@ -0,0 +1,109 @@
+import asyncio
+from unittest import mock
+
+import openai
+from django.test import SimpleTestCase, override_settings
+
+from ..services.rate_limit import ApiRateLimiter, get_api_rate_limiter
+from .fakes import (
+    MESSAGES,
+    FakeAsyncCompletions,
+    FakeStream,
+    make_api_error,
+    make_service,
+)
+
+
+def count_words(text, model):
+    """Детерминированный подсчет токенов без загрузки кодировки tiktoken"""
+    return len(text.split())
+
+
+@override_settings(OPENAI_RATE_LIMIT_HEADROOM=1.0)
+class ApiRateLimiterTests(SimpleTestCase):
+    """Резервирование и сверка лимитов ключа"""
+
+    def test_reserve_waits_when_tokens_run_out(self):
+        # 600 токенов в минуту: 10 в секунду, запас на 60
+        limiter = ApiRateLimiter(rpm_limit=0, tpm_limit=600)
+
+        self.assertEqual(limiter.reserve(60), 0)
+        self.assertAlmostEqual(limiter.reserve(20), 2.0, delta=0.05)
+        self.assertEqual(limiter.get_stats()["throttled"], 1)
+
+    def test_reconcile_returns_unused_estimate(self):
+        limiter = ApiRateLimiter(rpm_limit=0, tpm_limit=600)
+        limiter.reserve(50)
+
+        limiter.reconcile(50, 20)
+
+        self.assertAlmostEqual(limiter.tokens.available, 40, delta=1)
+        self.assertEqual(limiter.estimate_error, 30)
+
+    def test_reconcile_without_usage_refunds_everything(self):
+        limiter = ApiRateLimiter(rpm_limit=0, tpm_limit=600)
+        limiter.reserve(50)
+
+        limiter.reconcile(50, None)
+
+        self.assertAlmostEqual(limiter.tokens.available, 60, delta=1)
+
+    def test_overrun_is_charged(self):
+        limiter = ApiRateLimiter(rpm_limit=0, tpm_limit=600)
+        limiter.reserve(10)
+
+        limiter.reconcile(10, 40)
+
+        self.assertAlmostEqual(limiter.tokens.available, 20, delta=1)
+        self.assertEqual(limiter.estimate_error, -30)
+
+    def test_pause_delays_next_request(self):
+        limiter = ApiRateLimiter(rpm_limit=60, tpm_limit=0)
+
+        limiter.pause(3)
+
+        self.assertAlmostEqual(limiter.reserve(1), 4.0, delta=0.05)
+
+
+@override_settings(OPENAI_SINGLE_FLIGHT=False)
+class StreamReservationTests(SimpleTestCase):
+    """Сверка резерва ключа для оборванного потока"""
+
+    def setUp(self):
+        patcher = mock.patch(
+            "bots.services.gpt_service.count_tokens", side_effect=count_words
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def read(self, service, close_after=None):
+        events = []
+        stream = service._astream_once(MESSAGES, max_tokens=100)
+        async for event in stream:
+            events.append(event)
+            if close_after and len(events) == close_after:
+                await stream.aclose()
+                break
+        return events
+
+    def test_error_mid_stream_reconciles_reservation(self):
+        error = make_api_error(openai.InternalServerError, 500)
+        stream = FakeStream("два слова ", "и еще три", error=error)
+        service = make_service("sk-test-stream-error", FakeAsyncCompletions(stream))
+        limiter = get_api_rate_limiter("sk-test-stream-error")
+
+        events = asyncio.run(self.read(service))
+
+        self.assertFalse(events[-1]["result"]["success"])
+        # Из 100 зарезервированных токенов ответа получено 5
+        self.assertEqual(limiter.estimate_error, 95)
+        self.assertEqual(service.scheduler.in_flight, 0)
+
+    def test_abandoned_stream_reconciles_reservation(self):
+        stream = FakeStream("один", "два", "три")
+        service = make_service("sk-test-stream-close", FakeAsyncCompletions(stream))
+        limiter = get_api_rate_limiter("sk-test-stream-close")
+
+        asyncio.run(self.read(service, close_after=1))
+
+        self.assertEqual(limiter.estimate_error, 99)
@@ -0,0 +1,143 @@
+import asyncio
+
+import openai
+from django.test import SimpleTestCase, override_settings
+
+from ..services.rate_limit import get_api_rate_limiter
+from ..services.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    get_circuit_breaker,
+)
+from .fakes import (
+    MESSAGES,
+    FakeAsyncCompletions,
+    FakeCompletions,
+    make_api_error,
+    make_completion,
+    make_service,
+)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """Состояния предохранителя"""
+
+    def test_opens_after_threshold_and_rejects(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        error = make_api_error(openai.InternalServerError, 500)
+
+        breaker.record_failure(error)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure(error)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+        self.assertEqual(breaker.rejected, 1)
+
+    def test_client_errors_do_not_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure(make_api_error(openai.BadRequestError, 400))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_allows_single_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure(make_api_error(openai.InternalServerError, 500))
+        breaker.opened_at -= 31
+
+        self.assertTrue(breaker.before_request())
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertFalse(breaker.before_request())
+
+    def test_released_trial_lets_next_request_through(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure(make_api_error(openai.InternalServerError, 500))
+        breaker.opened_at -= 31
+
+        trial = breaker.before_request()
+        breaker.release_trial(trial)
+        self.assertTrue(breaker.before_request())
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        for _ in range(3):
+            breaker.record_failure(make_api_error(openai.InternalServerError, 500))
+        breaker.opened_at -= 31
+
+        breaker.before_request()
+        breaker.record_failure(make_api_error(openai.InternalServerError, 500))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+@override_settings(OPENAI_RETRY_BASE_DELAY=0.01, OPENAI_SINGLE_FLIGHT=False)
+class RetryLoopTests(SimpleTestCase):
+    """Повторы запросов к GPT, лимиты ключа и предохранитель"""
+
+    def test_retries_server_error(self):
+        completions = FakeCompletions(
+            make_api_error(openai.InternalServerError, 500), make_completion("ответ")
+        )
+        service = make_service("sk-test-retry", completions)
+
+        result = service.generate_response(MESSAGES, model="m", max_retries=2)
+
+        self.assertTrue(result["success"])
+        self.assertEqual(result["content"], "ответ")
+        self.assertEqual(completions.calls, 2)
+
+    def test_does_not_retry_bad_request(self):
+        completions = FakeCompletions(make_api_error(openai.BadRequestError, 400))
+        service = make_service("sk-test-bad-request", completions)
+
+        result = service.generate_response(MESSAGES, model="m", max_retries=2)
+
+        self.assertFalse(result["success"])
+        self.assertEqual(completions.calls, 1)
+
+    def test_gives_up_after_max_retries(self):
+        completions = FakeCompletions(make_api_error(openai.InternalServerError, 500))
+        service = make_service("sk-test-give-up", completions)
+
+        result = service.generate_response(MESSAGES, model="m", max_retries=2)
+
+        self.assertFalse(result["success"])
+        self.assertEqual(completions.calls, 3)
+
+    @override_settings(OPENAI_CIRCUIT_FAILURE_THRESHOLD=2)
+    def test_open_circuit_skips_api(self):
+        completions = FakeCompletions(make_api_error(openai.InternalServerError, 500))
+        service = make_service("sk-test-circuit", completions)
+
+        service.generate_response(MESSAGES, model="m", max_retries=1)
+        result = service.generate_response(MESSAGES, model="m", max_retries=1)
+
+        self.assertEqual(result["error"], "circuit_open")
+        self.assertEqual(completions.calls, 2)
+
+    def test_cancelled_trial_releases_breaker_and_limiter(self):
+        api_key = "sk-test-cancel"
+        completions = FakeAsyncCompletions(make_completion(), delay=1.0)
+        service = make_service(api_key, completions)
+        breaker = get_circuit_breaker(api_key, "m")
+        breaker.state = CircuitBreaker.OPEN
+        breaker.opened_at = 0
+        limiter = get_api_rate_limiter(api_key)
+        tokens_before = limiter.get_stats()["tokens_available"]
+
+        async def scenario():
+            task = asyncio.create_task(service._agenerate_once(MESSAGES, model="m"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(scenario())
+        self.assertTrue(breaker.before_request())
+        self.assertEqual(service.scheduler.in_flight, 0)
+        self.assertAlmostEqual(
+            limiter.get_stats()["tokens_available"], tokens_before, delta=1
+        )
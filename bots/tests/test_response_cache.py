@@ -0,0 +1,200 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..models import Bot
+from ..services import response_cache
+from ..services.response_cache import (
+    FileBackend,
+    LocalRedis,
+    MemoryBackend,
+    RedisBackend,
+    ResponseCache,
+    generate_scenario_response,
+    make_cache_key,
+)
+
+
+class BackendTests(SimpleTestCase):
+    """Хранилища кеша ответов"""
+
+    def setUp(self):
+        patcher = mock.patch.object(response_cache.time, "time", return_value=1000.0)
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_file_backend(self, max_size=10):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return FileBackend(directory.name, max_size)
+
+    def backends(self):
+        return [
+            MemoryBackend(10),
+            self.make_file_backend(),
+            RedisBackend(LocalRedis()),
+        ]
+
+    def test_get_returns_value_until_ttl(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                self.clock.return_value = 1000.0
+                backend.set("key", "value", 60)
+                self.assertEqual(backend.get("key"), "value")
+                self.assertIsNone(backend.get("missing"))
+
+                self.clock.return_value = 1060.0
+                self.assertIsNone(backend.get("key"))
+
+    def test_memory_evicts_least_recently_used(self):
+        backend = MemoryBackend(2)
+        backend.set("a", "1", 60)
+        backend.set("b", "2", 60)
+        backend.get("a")
+        backend.set("c", "3", 60)
+
+        self.assertEqual(backend.get("a"), "1")
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.size(), 2)
+
+    def test_file_evicts_least_recently_used(self):
+        backend = self.make_file_backend(max_size=2)
+        backend.set("a", "1", 60)
+        backend.set("b", "2", 60)
+        os.utime(backend._path("a"), (1, 1))
+        os.utime(backend._path("b"), (2, 2))
+        backend.set("c", "3", 60)
+
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(backend.get("b"), "2")
+        self.assertEqual(backend.size(), 2)
+
+    def test_file_drops_foreign_files(self):
+        backend = self.make_file_backend()
+        with open(backend._path("foreign"), "w", encoding="utf-8") as f:
+            f.write("[1, 2]")
+
+        self.assertIsNone(backend.get("foreign"))
+        self.assertFalse(os.path.exists(backend._path("foreign")))
+
+    def test_file_is_shared_between_instances(self):
+        backend = self.make_file_backend()
+        backend.set("key", "value", 60)
+
+        self.assertEqual(FileBackend(backend.directory, 10).get("key"), "value")
+
+
+class ResponseCacheTests(SimpleTestCase):
+    """Ключи и учет обращений кеша"""
+
+    def test_key_depends_on_bot_and_request(self):
+        key = make_cache_key(1, "prompt", "m", 0.7, 100)
+
+        self.assertEqual(key, make_cache_key(1, "prompt", "m", 0.71, 100))
+        for other in (
+            make_cache_key(2, "prompt", "m", 0.7, 100),
+            make_cache_key(1, "other", "m", 0.7, 100),
+            make_cache_key(1, "prompt", "m2", 0.7, 100),
+            make_cache_key(1, "prompt", "m", 0.9, 100),
+            make_cache_key(1, "prompt", "m", 0.7, 200),
+        ):
+            self.assertNotEqual(key, other)
+
+    def test_corrupt_entry_is_a_miss(self):
+        backend = MemoryBackend(10)
+        cache = ResponseCache(backend)
+        backend.set(make_cache_key(1, "prompt", "m", 0.7, 100), "{broken", 60)
+
+        self.assertIsNone(cache.get(1, "prompt", "m", 0.7, 100))
+        self.assertEqual(cache.get_stats()["errors"], 1)
+
+
+class GenerateScenarioResponseTests(SimpleTestCase):
+    """Ответы шагов сценария через кеш"""
+
+    def setUp(self):
+        self.cache = ResponseCache(MemoryBackend(10))
+        patcher = mock.patch.object(
+            response_cache, "get_response_cache", return_value=self.cache
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(
+            response_cache.GPTService, "generate_response", autospec=True
+        )
+        self.generate = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.generate.return_value = {
+            "success": True,
+            "content": "ответ",
+            "model": "gpt-test",
+            "usage": {"total_tokens": 30},
+        }
+
+    def make_bot(self, bot_id=1):
+        return Bot(
+            id=bot_id,
+            name=f"bot{bot_id}",
+            gpt_api_key="sk-test-scenario",
+            gpt_model="gpt-test",
+        )
+
+    def test_caches_answer_for_ttl(self):
+        bot = self.make_bot()
+        for cache_ttl in (60, "60"):
+            with self.subTest(cache_ttl=cache_ttl):
+                self.generate.reset_mock()
+                self.cache.backend = MemoryBackend(10)
+
+                answers = [
+                    generate_scenario_response(bot, "prompt", cache_ttl)
+                    for _ in range(2)
+                ]
+
+                self.assertEqual(answers, ["ответ", "ответ"])
+                self.assertEqual(self.generate.call_count, 1)
+
+    def test_invalid_or_zero_ttl_disables_cache(self):
+        bot = self.make_bot()
+        for cache_ttl in (0, "0", None, "", -5, "abc", [60], True):
+            with self.subTest(cache_ttl=cache_ttl):
+                self.generate.reset_mock()
+
+                generate_scenario_response(bot, "prompt", cache_ttl)
+                generate_scenario_response(bot, "prompt", cache_ttl)
+
+                self.assertEqual(self.generate.call_count, 2)
+        self.assertEqual(self.cache.backend.size(), 0)
+
+    def test_bots_do_not_share_answers(self):
+        generate_scenario_response(self.make_bot(1), "prompt", 60)
+        generate_scenario_response(self.make_bot(2), "prompt", 60)
+
+        self.assertEqual(self.generate.call_count, 2)
+        self.assertEqual(self.cache.backend.size(), 2)
+
+    def test_errors_are_not_cached(self):
+        self.generate.return_value = {
+            "success": False,
+            "error": "api_error",
+            "message": "Ошибка",
+        }
+        bot = self.make_bot()
+
+        self.assertEqual(generate_scenario_response(bot, "prompt", 60), "Ошибка")
+        self.assertEqual(self.cache.backend.size(), 0)
+
+    def test_fallback_answer_is_not_served_for_main_model(self):
+        self.generate.return_value = {
+            **self.generate.return_value,
+            "model": "gpt-backup",
+        }
+        bot = self.make_bot()
+
+        generate_scenario_response(bot, "prompt", 60)
+        generate_scenario_response(bot, "prompt", 60)
+
+        self.assertEqual(self.generate.call_count, 2)
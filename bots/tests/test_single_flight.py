@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from ..services.single_flight import SingleFlight, make_request_key
+from .fakes import MESSAGES
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Объединение одинаковых одновременных запросов"""
+
+    def test_async_callers_share_one_call(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"content": "ok", "usage": {"total_tokens": 5}}
+
+        async def scenario():
+            return await asyncio.gather(flight.ado("k", call), flight.ado("k", call))
+
+        first, second = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(first["content"], second["content"])
+        # Токены делятся между участниками без потерь
+        shares = [first["usage"]["total_tokens"], second["usage"]["total_tokens"]]
+        self.assertEqual(sorted(shares), [2, 3])
+        self.assertEqual(flight.get_stats()["in_flight"], 0)
+
+    def test_threads_share_one_call_and_error(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        outcomes = []
+
+        def call():
+            started.set()
+            release.wait(1)
+            raise ValueError("boom")
+
+        def worker():
+            try:
+                flight.do("k", call)
+            except ValueError as e:
+                outcomes.append(str(e))
+
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        threads[0].start()
+        started.wait(1)
+        for thread in threads[1:]:
+            thread.start()
+        deadline = time.monotonic() + 1
+        while flight.get_stats()["shared"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(1)
+
+        self.assertEqual(outcomes, ["boom"] * 3)
+        self.assertEqual(flight.get_stats()["calls"], 1)
+
+    def test_cancelled_follower_does_not_cancel_call(self):
+        flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.05)
+            return {"usage": {"total_tokens": 4}}
+
+        async def scenario():
+            leader = asyncio.create_task(flight.ado("k", call))
+            follower = asyncio.create_task(flight.ado("k", call))
+            await asyncio.sleep(0.01)
+            follower.cancel()
+            return await leader
+
+        result = asyncio.run(scenario())
+        self.assertEqual(result["usage"]["total_tokens"], 4)
+
+    def test_key_depends_on_request_and_api_keys(self):
+        key = make_request_key("m", MESSAGES, 0.7, 100, api_keys=["a"])
+        # Служебные поля сообщений не влияют на ключ
+        with_tokens = [{**MESSAGES[0], "tokens": 3}]
+        self.assertEqual(
+            key, make_request_key("m", with_tokens, 0.7, 100, api_keys=["a"])
+        )
+        self.assertNotEqual(
+            key, make_request_key("m", MESSAGES, 0.7, 200, api_keys=["a"])
+        )
+        self.assertNotEqual(
+            key, make_request_key("m", MESSAGES, 0.7, 100, api_keys=["b"])
+        )
+
+    def test_cancelled_initiator_is_not_counted_as_shared(self):
+        flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.05)
+            return {"usage": {"total_tokens": 4}}
+
+        async def scenario():
+            leader = asyncio.create_task(flight.ado("k", call))
+            follower = asyncio.create_task(flight.ado("k", call))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+
+        result = asyncio.run(scenario())
+        # Ответ достался единственному оставшемуся участнику целиком
+        self.assertEqual(result["usage"]["total_tokens"], 4)
+        self.assertEqual(flight.get_stats()["shared"], 1)
+
+    def test_call_is_cancelled_when_everyone_leaves(self):
+        flight = SingleFlight()
+        cancelled = []
+
+        async def call():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+            return {"usage": {"total_tokens": 4}}
+
+        async def scenario():
+            callers = [asyncio.create_task(flight.ado("k", call)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            for caller in callers:
+                caller.cancel()
+            await asyncio.gather(*callers, return_exceptions=True)
+            await asyncio.sleep(0.01)
+            return list(cancelled)
+
+        self.assertEqual(asyncio.run(scenario()), [1])
+        stats = flight.get_stats()
+        self.assertEqual((stats["in_flight"], stats["shared"]), (0, 0))
+
+    def test_new_caller_does_not_join_cancelled_call(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return {"content": "ok", "usage": {"total_tokens": 4}}
+
+        async def scenario():
+            first = asyncio.create_task(flight.ado("k", call))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            await asyncio.gather(first, return_exceptions=True)
+            # Отмененная задача запроса еще не завершилась
+            return await flight.ado("k", call)
+
+        result = asyncio.run(scenario())
+        self.assertEqual(result["content"], "ok")
+        self.assertEqual(len(calls), 2)
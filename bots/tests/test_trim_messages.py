@@ -0,0 +1,62 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..services.gpt_service import GPTService
+
+MODEL = "gpt-3.5-turbo"
+
+
+def count_words(text, model):
+    """Детерминированный подсчет токенов без загрузки кодировки tiktoken"""
+    return len(text.split()) + 1
+
+
+class TrimMessagesTests(SimpleTestCase):
+    """Обрезка контекста по сохраненным количествам токенов"""
+
+    def setUp(self):
+        patcher = mock.patch(
+            "bots.services.gpt_service.count_tokens", side_effect=count_words
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service = GPTService(api_keys=["sk-test-trim"])
+        self.messages = [{"role": "system", "content": "Ты помощник"}] + [
+            {
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": f"Сообщение номер {i}: " + "текст " * (i + 1),
+            }
+            for i in range(10)
+        ]
+
+    def with_tokens(self):
+        return [
+            {**msg, "tokens": count_words(msg["content"], MODEL)}
+            for msg in self.messages
+        ]
+
+    def test_stored_tokens_match_full_recount(self):
+        for max_tokens in (30, 80, 150, 10_000):
+            with self.subTest(max_tokens=max_tokens):
+                trimmed, tokens = self.service._trim_messages(
+                    self.with_tokens(), max_tokens, MODEL
+                )
+                recounted, recount_tokens = self.service._trim_messages(
+                    self.messages, max_tokens, MODEL
+                )
+
+                self.assertEqual(trimmed, recounted)
+                self.assertEqual(tokens, recount_tokens)
+                self.assertEqual(
+                    tokens, self.service.count_messages_tokens(trimmed, MODEL)
+                )
+
+    def test_keeps_newest_messages_and_drops_token_field(self):
+        trimmed, tokens = self.service._trim_messages(self.with_tokens(), 80, MODEL)
+
+        self.assertEqual(trimmed[0], self.messages[0])
+        self.assertEqual(trimmed[-1], self.messages[-1])
+        self.assertLess(len(trimmed), len(self.messages))
+        self.assertLessEqual(tokens, 80)
+        self.assertTrue(all(set(msg) == {"role", "content"} for msg in trimmed))
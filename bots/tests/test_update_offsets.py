@@ -0,0 +1,57 @@
+from django.test import SimpleTestCase
+from telegram import Update
+
+from ..services.update_offsets import UPDATE_ID_RESET_GAP, UpdateOffsetTracker
+from .fakes import make_update
+
+
+class UpdateOffsetTrackerTests(SimpleTestCase):
+    """Учет обработанных обновлений"""
+
+    def test_offset_waits_for_unfinished_update(self):
+        tracker = UpdateOffsetTracker(1, last_update_id=10)
+        for update_id in (11, 12, 13):
+            self.assertTrue(tracker.should_process(update_id))
+
+        tracker.complete(12)
+        tracker.complete(13)
+        self.assertEqual(tracker.last_update_id, 10)
+        self.assertEqual(tracker.completed_ids, [12, 13])
+
+        tracker.complete(11)
+        self.assertEqual(tracker.last_update_id, 13)
+        self.assertEqual(tracker.completed_ids, [])
+
+    def test_skips_duplicates(self):
+        tracker = UpdateOffsetTracker(1, last_update_id=10, completed_ids=[12])
+        self.assertFalse(tracker.should_process(9))
+        self.assertFalse(tracker.should_process(12))
+        self.assertTrue(tracker.should_process(11))
+        # Повтор обновления в обработке не считается обработанным
+        self.assertFalse(tracker.should_process(11))
+        self.assertEqual(tracker.duplicates, 2)
+
+    def test_unfinished_updates_are_saved_and_replayed(self):
+        tracker = UpdateOffsetTracker(1, last_update_id=10)
+        tracker.should_process(11, make_update(11))
+        tracker.should_process(12, make_update(12))
+        tracker.complete(12)
+
+        pending = tracker.pending_updates
+        self.assertEqual([data["update_id"] for data in pending], [11])
+
+        restarted = UpdateOffsetTracker(
+            1, tracker.last_update_id, tracker.completed_ids, pending
+        )
+        replayed = [Update.de_json(data, None) for data in restarted.take_pending()]
+        self.assertEqual(replayed[0].message.text, "message 11")
+        self.assertTrue(restarted.should_process(11, replayed[0]))
+        self.assertFalse(restarted.should_process(12))
+        self.assertEqual(restarted.take_pending(), [])
+
+    def test_resets_when_telegram_restarts_ids(self):
+        tracker = UpdateOffsetTracker(1, last_update_id=UPDATE_ID_RESET_GAP * 3)
+        self.assertTrue(tracker.should_process(5))
+        self.assertEqual(tracker.last_update_id, 4)
+        self.assertEqual(tracker.resets, 1)
+        self.assertFalse(tracker.should_process(5))
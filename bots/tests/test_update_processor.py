@@ -0,0 +1,60 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..models import Bot
+from ..services.telegram_service import TelegramBotService
+from ..services.update_processor import AcceptedUpdateQueue
+from .fakes import make_update
+
+
+class DrainUpdatesTests(SimpleTestCase):
+    """Ожидание принятых обновлений при остановке бота"""
+
+    def make_service(self):
+        bot = Bot(
+            id=1,
+            name="test",
+            telegram_token="123456:TEST",
+            gpt_api_key="sk-test-drain",
+        )
+        service = TelegramBotService(bot, db_executor=mock.Mock())
+        service.application = SimpleNamespace(update_queue=AcceptedUpdateQueue())
+        return service
+
+    def test_queue_counts_dequeued_until_done(self):
+        async def scenario():
+            queue = AcceptedUpdateQueue()
+            await queue.put(make_update(1))
+            counts = [queue.accepted]
+            await queue.get()
+            counts.append(queue.accepted)
+            queue.task_done()
+            counts.append(queue.accepted)
+            return counts
+
+        self.assertEqual(asyncio.run(scenario()), [0, 1, 0])
+
+    def test_waits_for_dequeued_update_before_its_task_starts(self):
+        service = self.make_service()
+        queue = service.application.update_queue
+
+        async def scenario():
+            await queue.put(make_update(1))
+            # Application забрал обновление, но его задача еще не в обработчике
+            await queue.get()
+
+            async def finish_later():
+                await asyncio.sleep(0.1)
+                queue.task_done()
+
+            finisher = asyncio.create_task(finish_later())
+            await service.drain_updates(time.monotonic() + 5)
+            return finisher.done()
+
+        self.assertTrue(asyncio.run(scenario()))
+        self.assertEqual(service.drained_updates, 1)
+        self.assertEqual(service.abandoned_updates, 0)
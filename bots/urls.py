@@ -4,6 +4,7 @@ from .views import (
     BotViewSet,
     TelegramUserViewSet,
     ConversationViewSet,
+    FaqEntryViewSet,
     UserScenarioSessionViewSet,
 )
 
@@ -11,6 +12,7 @@ router = DefaultRouter()
 router.register(r"bots", BotViewSet)
 router.register(r"telegram-users", TelegramUserViewSet)
 router.register(r"conversations", ConversationViewSet)
+router.register(r"faq-entries", FaqEntryViewSet)
 router.register(r"scenario-sessions", UserScenarioSessionViewSet)
 
 urlpatterns = [
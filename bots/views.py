@@ -1,16 +1,25 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Bot, TelegramUser, Conversation, UserScenarioSession
+from .models import (
+    Bot,
+    BotFaqStats,
+    FaqEntry,
+    TelegramUser,
+    Conversation,
+    UserScenarioSession,
+)
 from .serializers import (
     BotSerializer,
     TelegramUserSerializer,
     ConversationSerializer,
     ConversationDetailSerializer,
+    FaqEntrySerializer,
     TestMessageSerializer,
     UserScenarioSessionSerializer,
     ScenarioExecutionSerializer,
 )
+from .services.faq_index import find_faq_answer
 from .services.gpt_service import GPTService
 
 
@@ -28,6 +37,7 @@ class BotViewSet(viewsets.ModelViewSet):
     - POST /api/bots/{id}/test-message/ - тестирование бота
     - GET /api/bots/{id}/conversations/ - диалоги бота
     - GET /api/bots/{id}/stats/ - статистика бота
+    - GET /api/bots/{id}/faq-stats/ - ответы из базы знаний
     """
 
     queryset = Bot.objects.all()
@@ -69,11 +79,28 @@ class BotViewSet(viewsets.ModelViewSet):
             # Добавляем сообщение пользователя
             conversation.add_message("user", message)
 
+            # Частый вопрос - ответ из базы знаний без запроса к GPT
+            faq_match = find_faq_answer(bot, message)
+            if faq_match is not None:
+                conversation.add_message("assistant", faq_match.answer)
+                return Response(
+                    {
+                        "success": True,
+                        "user_message": message,
+                        "bot_response": faq_match.answer,
+                        "faq_entry_id": faq_match.entry_id,
+                        "faq_score": faq_match.score,
+                        "conversation_id": conversation.id,
+                    }
+                )
+
             # Получаем сообщения для GPT
             messages = conversation.get_openai_messages()
 
             # Инициализируем GPT сервис
-            gpt_service = GPTService(api_key=bot.gpt_api_key)
+            gpt_service = GPTService(
+                api_keys=bot.get_gpt_api_keys(), bot_id=bot.id, weight=bot.gpt_weight
+            )
 
             # Генерируем ответ
             gpt_response = gpt_service.generate_response(
@@ -81,16 +108,25 @@ class BotViewSet(viewsets.ModelViewSet):
                 model=bot.gpt_model,
                 max_tokens=bot.max_tokens,
                 temperature=bot.temperature,
+                max_context_tokens=bot.get_max_context_tokens(),
+                timeout=bot.gpt_timeout,
+                max_retries=bot.gpt_max_retries,
+                fallback_models=bot.get_gpt_fallback_models(),
+                routing=bot.get_gpt_routing(),
             )
 
             if gpt_response["success"]:
                 # Добавляем ответ бота в диалог
                 bot_message = gpt_response["content"]
-                conversation.add_message("assistant", bot_message)
+
+                conversation.add_message(
+                    "assistant",
+                    bot_message,
+                    tokens=gpt_response["usage"]["completion_tokens"],
+                )
 
                 # Обновляем счетчик токенов
-                conversation.total_tokens += gpt_response["usage"]["total_tokens"]
-                conversation.save()
+                conversation.add_usage(gpt_response["usage"]["total_tokens"])
 
                 return Response(
                     {
@@ -163,6 +199,53 @@ class BotViewSet(viewsets.ModelViewSet):
 
         return Response(stats)
 
+    @action(detail=True, methods=["get"], url_path="faq-stats")
+    def faq_stats(self, request, pk=None):
+        """
+        Статистика базы знаний бота
+        GET /api/bots/{id}/faq-stats/
+        """
+        bot = self.get_object()
+        counters = BotFaqStats.objects.filter(bot=bot).first()
+        lookups = counters.lookups if counters else 0
+        hits = counters.hits if counters else 0
+        entries = FaqEntry.objects.filter(bot=bot)
+
+        return Response(
+            {
+                "bot_name": bot.name,
+                "min_score": bot.faq_min_score,
+                "entries": entries.count(),
+                "lookups": lookups,
+                "hits": hits,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "top_entries": [
+                    {"id": entry.id, "question": entry.question, "hits": entry.hits}
+                    for entry in entries.filter(hits__gt=0).order_by("-hits")[:10]
+                ],
+            }
+        )
+
+
+class FaqEntryViewSet(viewsets.ModelViewSet):
+    """
+    ViewSet для управления базой знаний ботов
+    - GET /api/faq-entries/?bot={id} - вопросы бота
+    - POST /api/faq-entries/ - добавление вопроса
+    - PUT /api/faq-entries/{id}/ - изменение вопроса
+    - DELETE /api/faq-entries/{id}/ - удаление вопроса
+    """
+
+    queryset = FaqEntry.objects.all()
+    serializer_class = FaqEntrySerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        bot_id = self.request.query_params.get("bot")
+        if bot_id:
+            queryset = queryset.filter(bot_id=bot_id)
+        return queryset
+
 
 class TelegramUserViewSet(viewsets.ReadOnlyModelViewSet):
     """